@@ -1,29 +1,178 @@
 import streamlit as st
-import cv2
-import numpy as np
 import os
 import sys
 import time
-import io
-from PIL import Image
 
 # Add the project root to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from src import instrumentation
 from src.analyzer import ForgeryDetector
+from src.cache import ResultCache, encode_page_images
 from src.converter import DocumentProcessor
-from src.metadata import scan_metadata
+from src.document import ParsedDocument
+from src.pipeline import analysis_cache_key, document_findings, finalize_report, iter_page_reports
+from src.pyramid import render_region, tiles_for_region, choose_level
+from src.report_store import ReportStore, default_store_path
+from src.service_client import AnalysisClient
+from src.template_index import TemplateIndex, default_index_path
 from app.ui_components import render_neon_scanner, inject_scanner_bar
 
 # Page configuration
 st.set_page_config(page_title="Document Forgery Detector Pro", layout="wide")
 
+# Analysis parameters (part of the cache key)
+ELA_QUALITY = 90
+PDF_DPI = 300
+
+# Longest side of a zoomed region view; picks the pyramid level to read tiles from
+ZOOM_SIDE = 700
+
 # Initialize Logic Classes
 detector = ForgeryDetector()
 processor = DocumentProcessor()
 
+@st.cache_resource
+def get_result_cache():
+    """One result cache per server process, shared by every session."""
+    return ResultCache()
+
+result_cache = get_result_cache()
+
+@st.cache_resource
+def configure_instrumentation():
+    """Sets up the stage timing exporters from the environment, once per server process."""
+    return instrumentation.configure_from_env()
+
+configure_instrumentation()
+
+# When set, analysis runs on the HTTP service (python -m src.service) and this
+# app is only its client
+SERVICE_URL = os.environ.get("FORGERY_SERVICE_URL")
+service_client = AnalysisClient(SERVICE_URL) if SERVICE_URL else None
+
+def iter_service_pages(client, job_id, report):
+    """
+    Yields a finished service job's pages with their image previews fetched.
+
+    Only the small previews and the pyramid geometry are downloaded here;
+    zoomed views fetch the few tiles they cover on demand.
+    """
+    for entry in report["pages"]:
+        entry = dict(entry)
+        for field in ("image", "ela_image"):
+            pyramid = client.page_pyramid(job_id, entry["page_number"], field)
+            pyramid["preview"] = client.page_preview(job_id, entry["page_number"], field)
+            pyramid["fetch_tile"] = (
+                lambda level, column, row, n=entry["page_number"], f=field:
+                client.page_tile(job_id, n, f, level, column, row)
+            )
+            entry[f"{field}_pyramid"] = pyramid
+        yield entry
+
+def zoom_targets(entry, limit=8):
+    """
+    Lists the page's suspicious regions as zoom windows with some context around them.
+
+    Returns:
+        list: (label, x, y, width, height) tuples in full-resolution pixels.
+    """
+    candidates = [("Combined", region) for region in entry.get("combined", {}).get("regions", [])]
+    candidates += [("ELA", region) for region in entry.get("regions", [])]
+    targets = []
+    for source, region in candidates[:limit]:
+        margin_x = max(64, region["width"] // 2)
+        margin_y = max(64, region["height"] // 2)
+        targets.append((
+            f"{source} region at ({region['x']}, {region['y']}), {region['width']}×{region['height']} px",
+            region["x"] - margin_x, region["y"] - margin_y,
+            region["width"] + 2 * margin_x, region["height"] + 2 * margin_y,
+        ))
+    return targets
+
+def render_zoom(entry):
+    """Draws a region picker and the chosen region of both images, read from their pyramid tiles."""
+    targets = zoom_targets(entry)
+    if not targets:
+        return
+    choice = st.selectbox(
+        "🔎 Zoom into a suspicious region", range(len(targets) + 1),
+        format_func=lambda i: "—" if i == 0 else targets[i - 1][0],
+        key=f"zoom_{entry['page_number']}",
+    )
+    if choice == 0:
+        return
+    _, x, y, width, height = targets[choice - 1]
+    columns = st.columns(2)
+    for column, field, caption in zip(columns, ("image", "ela_image"), ("Original", "ELA")):
+        pyramid = entry[f"{field}_pyramid"]
+        # Clip the window to the page so the tile count matches what is read
+        left, top = max(0, x), max(0, y)
+        right, bottom = min(x + width, pyramid["width"]), min(y + height, pyramid["height"])
+        view = render_region(
+            pyramid, left, top, right - left, bottom - top, max_side=ZOOM_SIDE, fetch_tile=pyramid.get("fetch_tile")
+        )
+        level = choose_level(pyramid, right - left, bottom - top, ZOOM_SIDE)
+        tiles = len(tiles_for_region(pyramid, level, left, top, right - left, bottom - top))
+        with column:
+            st.image(view, channels="BGR", use_container_width=True)
+            st.caption(f"{caption} · level {level} · {tiles} tile(s)")
+
+@st.cache_resource
+def get_template_index():
+    """One near-duplicate template index per server process, shared by every session."""
+    return TemplateIndex(default_index_path())
+
+template_index = get_template_index()
+
+@st.cache_resource
+def get_report_store():
+    """One report history store per server process, shared with batch runs using the default location."""
+    return ReportStore(default_store_path())
+
+report_store = get_report_store()
+
+def render_history(store):
+    """Draws a sidebar search over previously analyzed documents."""
+    with st.sidebar:
+        st.header("📚 Report history")
+        days = st.number_input("Analyzed in the last N days", min_value=1, value=30)
+        producer = st.text_input("Producer / software contains")
+        min_score = st.slider("Minimum tamper score", 0.0, 1.0, 0.0, 0.05)
+        flag = st.text_input("Red flag category (e.g. ELA, Revision, Suspicious keyword)")
+        filters = {
+            "since": time.time() - days * 86400,
+            "producer": producer or None,
+            "min_tamper_score": min_score or None,
+            "flag": flag.strip() or None,
+        }
+        rows = store.query(limit=200, **filters)
+        st.caption(f"{store.count(**filters)} matching report(s)")
+        if rows:
+            st.dataframe(
+                [{
+                    "analyzed": time.strftime("%Y-%m-%d %H:%M", time.localtime(row["analyzed"])),
+                    "file": row["filename"],
+                    "score": round(row["tamper_score"] or 0.0, 2),
+                    "flags": row["red_flag_count"],
+                    "producer": row["producer"],
+                } for row in rows],
+                use_container_width=True, hide_index=True
+            )
+
+def render_red_flags(placeholder, report):
+    """Draws the red flag summary for a report into a placeholder."""
+    with placeholder.container():
+        if report["red_flags"]:
+            st.error("🚨 **RED FLAGS DETECTED**")
+            for flag in report["red_flags"]:
+                st.markdown(f"- {flag}")
+        else:
+            st.success("✅ No significant forgery markers detected in metadata or ELA baseline.")
+
 # Inject CSS for Neon Scanner
 render_neon_scanner()
+render_history(report_store)
 
 st.title("🛡️ Document Forgery Detector Pro")
 st.markdown("""
@@ -51,84 +200,118 @@ if uploaded_file is not None:
 
     # 2. Background Processing
     try:
-        # We'll store everything in a dict to display later
-        report = {
-            "red_flags": [],
-            "ela_image": None,
-            "original_image": None,
-            "metadata": {}
-        }
+        # Step A: Parse the upload once for every stage below, then look it up
+        # in the result cache shared with the batch tooling, so repeat uploads
+        # of the same bytes skip the pipeline
+        document = ParsedDocument(uploaded_file.getvalue(), uploaded_file.name)
+        cache_key = analysis_cache_key(document, uploaded_file.name, quality=ELA_QUALITY, dpi=PDF_DPI)
+        report = None if service_client else result_cache.get(cache_key)
+        is_cached = report is not None
+        # Reports from the cache or the service are already final
+        is_final = is_cached or service_client is not None
 
-        # Step A: Metadata Scanning (Deep scan for PDF/Docx)
-        # Convert UploadedFile to BytesIO for scanning
-        file_bytes = uploaded_file.getvalue()
-        file_io = io.BytesIO(file_bytes)
-        
-        # Get Red Flags from metadata
-        report["red_flags"] = scan_metadata(file_io)
-
-        # Step B: Document Processing / Image Extraction
-        if uploaded_file.name.endswith('.pdf'):
-            bgr_image = processor.process_pdf(file_bytes)
-        elif uploaded_file.name.endswith('.docx'):
-            bgr_image = processor.process_word(file_bytes)
-        else:
-            # It's an image
-            nparr = np.frombuffer(file_bytes, np.uint8)
-            bgr_image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-        report["original_image"] = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2RGB)
-
-        # Step C: ELA Analysis
-        # We need a temp file for ELA because the current class expects a path
-        temp_path = f"temp_analysis_{uploaded_file.name}"
-        if uploaded_file.name.endswith(('.pdf', '.docx')):
-            temp_path += ".jpg" # Ensure it's a jpg for ELA
-        
-        cv2.imwrite(temp_path, bgr_image)
-        
-        try:
-            ela_result = detector.perform_ela(temp_path)
-            report["ela_image"] = cv2.cvtColor(ela_result, cv2.COLOR_BGR2RGB)
-            
-            # Extract image-specific EXIF metadata if it's an image
-            if not uploaded_file.name.endswith(('.pdf', '.docx')):
-                img_metadata = detector.extract_metadata(temp_path)
-                # Check for image software flags
-                software = str(img_metadata.get('Software', '')).lower()
-                if any(tool in software for tool in ["photoshop", "gimp", "adobe"]):
-                    report["red_flags"].append(f"Image EXIF: Editing software detected: {software}")
-        finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-
-        # 3. Simulated "Processing" Delay (As requested 3-5s)
-        time.sleep(3.5)
-
-        # 4. Clear Scanner and Display Results
-        scanner_placeholder.empty()
+        # 3. Simulated "Processing" Delay (As requested 3-5s), kept outside
+        # the analysis span so it doesn't count towards the stage timings
+        if not is_final:
+            time.sleep(3.5)
 
-        with result_placeholder.container():
-            st.header("🏁 Forensic Analysis Report")
-            
-            # Layout: Comparison
-            col1, col2 = st.columns(2)
-            with col1:
-                st.subheader("Original / Extracted Image")
-                st.image(report["original_image"], use_container_width=True)
-            with col2:
-                st.subheader("ELA (Error Level Analysis)")
-                st.image(report["ela_image"], use_container_width=True)
-                st.caption("Bright/White clusters often indicate localized editing (forgery).")
-
-            # Red Flags Section
-            st.divider()
-            if report["red_flags"]:
-                st.error("🚨 **RED FLAGS DETECTED**")
-                for flag in report["red_flags"]:
-                    st.markdown(f"- {flag}")
+        # One span for the whole local analysis, as `analyze_document` has, so
+        # the stages nest under it and slow analyses are profiled as a whole
+        analysis_span = instrumentation.NULL_SPAN if is_final else instrumentation.span(
+            "analyze_document", bytes_in=len(document.file_bytes)
+        )
+        with analysis_span:
+            if service_client is not None:
+                # The service queues, analyzes and caches; pages are fetched once it
+                # is done. Reruns of the script are answered from its cache.
+                job_id, report, is_cached = service_client.analyze(document.file_bytes, uploaded_file.name)
+                page_entries = iter_service_pages(service_client, job_id, report)
+            elif is_cached:
+                page_entries = report["pages"]
             else:
-                st.success("✅ No significant forgery markers detected in metadata or ELA baseline.")
+                # Step B: Metadata Scanning (Deep scan for PDF/Docx, EXIF for images)
+                report = document_findings(document, uploaded_file.name, detector=detector)
+
+                # Step C: Image Extraction + ELA, lazily page by page so long PDFs
+                # stream through with flat memory
+                page_entries = iter_page_reports(
+                    document, uploaded_file.name, quality=ELA_QUALITY, dpi=PDF_DPI,
+                    detector=detector, processor=processor, keep_images=True, template_index=template_index
+                )
+
+            # 4. Display Results, page by page as they arrive
+            with result_placeholder.container():
+                st.header("🏁 Forensic Analysis Report")
+                if is_cached:
+                    st.caption("⚡ Served from the analysis cache.")
+
+                # Red Flags Section (ELA findings are added once all pages are scored)
+                flags_placeholder = st.empty()
+                render_red_flags(flags_placeholder, report)
+                st.divider()
+
+                analyzed_pages = []
+                for entry in page_entries:
+                    # Page images are kept PNG-encoded (compact to hold and cache)
+                    # and get their display pyramids here, once per analysis
+                    entry = encode_page_images(entry)
+                    analyzed_pages.append(entry)
+
+                    # Clear the scanner once the first page is ready
+                    scanner_placeholder.empty()
+
+                    if report["kind"] == 'pdf':
+                        st.subheader(f"Page {entry['page_number']}")
+
+                    # Layout: Comparison
+                    # Only the compact previews go to the browser; zooming reads pyramid tiles
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.subheader("Original / Extracted Image")
+                        st.image(entry["image_pyramid"]["preview"], use_container_width=True)
+                    with col2:
+                        st.subheader("ELA (Error Level Analysis)")
+                        st.image(entry["ela_image_pyramid"]["preview"], use_container_width=True)
+                        st.caption("Bright/White clusters often indicate localized editing (forgery).")
+                        st.caption(
+                            f"Tamper score: {entry['ela']['score']:.2f} · "
+                            f"{len(entry['regions'])} suspicious region(s)"
+                        )
+                        if "noise" in entry:
+                            st.caption(
+                                f"Noise/resampling score: {entry['noise']['score']:.2f} · "
+                                f"combined score {entry['combined']['score']:.2f} · "
+                                f"{len(entry['combined']['regions'])} combined region(s)"
+                            )
+                        if entry["copy_move"]:
+                            st.caption(f"Copy-move: {len(entry['copy_move'])} cloned region pair(s) found")
+                        if entry.get("template_matches"):
+                            best = entry["template_matches"][0]
+                            st.caption(
+                                f"Template: near-duplicate of '{best['label']}' · "
+                                f"{len(best['differing_regions'])} region(s) differ"
+                            )
+                        if "jpeg" in entry:
+                            st.caption(
+                                f"JPEG history: saved at ~{entry['jpeg']['quality_estimate']}% quality · "
+                                f"double compression score {entry['jpeg']['double_compression_score']:.2f}"
+                            )
+                        for note in entry.get("notes", []):
+                            st.caption(f"ℹ️ {note}")
+
+                    render_zoom(entry)
+
+            scanner_placeholder.empty()
+
+            if not is_final:
+                report["pages"] = analyzed_pages
+                finalize_report(report)
+                render_red_flags(flags_placeholder, report)
+                result_cache.put(cache_key, report)
+
+        # Every new analysis goes into the history; cache hits were stored the first time
+        if not is_cached:
+            report_store.add(report)
 
     except Exception as e:
         scanner_placeholder.empty()
@@ -0,0 +1,136 @@
+"""
+Synthetic, reproducible document corpora for the benchmarks.
+
+Every generator is seeded, so a corpus rebuilt on another machine (or after a
+code change) has byte-identical inputs and timings stay comparable. Files are
+named after CORPUS_VERSION, so changing a generator means bumping it, which
+regenerates the inputs instead of reusing stale ones.
+"""
+from PIL import Image
+from pypdf import PdfWriter
+import cv2
+import docx
+import io
+import numpy as np
+import os
+
+# Bumped whenever a generator's output changes; part of every file name and
+# recorded in the results, so baselines from another corpus are not compared
+CORPUS_VERSION = 1
+
+# Sizes used by the full suite and by --quick
+JPEG_MEGAPIXELS = (1, 4, 12, 24)
+PDF_PAGES = (1, 10, 50)
+DOCX_IMAGES = (1, 10, 40)
+QUICK_JPEG_MEGAPIXELS = (1, 4)
+QUICK_PDF_PAGES = (1, 10)
+QUICK_DOCX_IMAGES = (1, 10)
+
+# A4 portrait aspect ratio (height / width)
+PAGE_ASPECT = 297 / 210
+
+def page_image(megapixels, seed=0):
+    """
+    Draws a document-like page: paper noise, a header band and lines of text.
+
+    Args:
+        megapixels (float): Target pixel count in millions.
+        seed (int): Random seed.
+
+    Returns:
+        numpy.ndarray: The page in BGR format.
+    """
+    width = int(round(np.sqrt(megapixels * 1e6 / PAGE_ASPECT)))
+    height = int(round(width * PAGE_ASPECT))
+    rng = np.random.default_rng(seed)
+
+    page = np.full((height, width, 3), 242, dtype=np.uint8)
+    page += rng.integers(0, 8, (height, width, 1), dtype=np.uint8)
+    cv2.rectangle(page, (width // 20, height // 30), (width - width // 20, height // 10), (120, 70, 30), -1)
+
+    scale = width / 1200
+    line_height = max(12, int(60 * scale))
+    for i, y in enumerate(range(height // 7, height - line_height, line_height)):
+        text = f"Item {seed}-{i:03d} amount {(i * 7919 + seed) % 100000 / 100:9.2f}"
+        cv2.putText(page, text, (width // 15, y), cv2.FONT_HERSHEY_SIMPLEX, scale, (25, 25, 25), max(1, int(2 * scale)))
+    return page
+
+def make_jpeg(megapixels, seed=0, quality=85):
+    """Returns a synthetic page encoded as JPEG bytes."""
+    success, buffer = cv2.imencode(".jpg", page_image(megapixels, seed), [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise ValueError("Could not encode benchmark JPEG")
+    return buffer.tobytes()
+
+def make_scanned_pdf(pages, megapixels=2, seed=0):
+    """Returns a PDF with one full-page JPEG per page, as a scanner writes it."""
+    images = [
+        Image.fromarray(cv2.cvtColor(page_image(megapixels, seed + i), cv2.COLOR_BGR2RGB))
+        for i in range(pages)
+    ]
+    buffer = io.BytesIO()
+    images[0].save(
+        buffer, format="PDF", save_all=True, append_images=images[1:], resolution=150,
+        title="Benchmark statement", author="benchmarks", producer="benchmarks"
+    )
+    return buffer.getvalue()
+
+def make_vector_pdf(pages):
+    """Returns a PDF of blank vector pages, which has to be rasterized to analyze."""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=595, height=842)
+    writer.add_metadata({"/Title": "Benchmark form", "/Producer": "benchmarks"})
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def make_docx(images, megapixels=2, seed=0):
+    """Returns a Word document with `images` JPEG pictures of decreasing size."""
+    document = docx.Document()
+    document.core_properties.author = "benchmarks"
+    for i in range(images):
+        document.add_paragraph(f"Attachment {i + 1}")
+        image_bytes = make_jpeg(megapixels / (1 + i % 4), seed + i)
+        document.add_picture(io.BytesIO(image_bytes))
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+def build_corpus(directory, quick=False):
+    """
+    Writes the benchmark corpus to a directory, reusing files of the same CORPUS_VERSION.
+
+    Args:
+        directory (str): Output directory (created if missing).
+        quick (bool): Use the small size ladder.
+
+    Returns:
+        list: (case name, operation, path) tuples, in run order.
+    """
+    os.makedirs(directory, exist_ok=True)
+    jpeg_sizes = QUICK_JPEG_MEGAPIXELS if quick else JPEG_MEGAPIXELS
+    pdf_pages = QUICK_PDF_PAGES if quick else PDF_PAGES
+    docx_images = QUICK_DOCX_IMAGES if quick else DOCX_IMAGES
+
+    files = []
+    for megapixels in jpeg_sizes:
+        files.append((f"jpeg_{megapixels}mp", ".jpg", lambda mp=megapixels: make_jpeg(mp),
+                      ("perform_ela", "analyze_noise", "extract_metadata")))
+    for pages in pdf_pages:
+        files.append((f"pdf_scanned_{pages}p", ".pdf", lambda n=pages: make_scanned_pdf(n),
+                      ("process_pdf", "scan_metadata")))
+        files.append((f"pdf_vector_{pages}p", ".pdf", lambda n=pages: make_vector_pdf(n),
+                      ("process_pdf", "scan_metadata")))
+    for images in docx_images:
+        files.append((f"docx_{images}img", ".docx", lambda n=images: make_docx(n),
+                      ("process_word", "scan_metadata")))
+
+    cases = []
+    for stem, extension, generate, operations in files:
+        path = os.path.join(directory, f"{stem}.v{CORPUS_VERSION}{extension}")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(generate())
+        cases.extend((f"{operation}/{stem}", operation, path) for operation in operations)
+    return cases
@@ -0,0 +1,279 @@
+"""
+Benchmarks for the conversion and analysis hot paths.
+
+Usage:
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --compare baseline.json [--output current.json]
+
+Each case runs one operation (`perform_ela`, `extract_metadata`, `process_pdf`,
+`process_word` or `scan_metadata`) on one synthetic file in a fresh process,
+so its peak RSS is not polluted by earlier cases. Wall time (min / median /
+mean over --repeat runs after a warm-up), peak RSS and throughput are written
+as JSON. With --compare, cases slower or larger than the baseline beyond the
+tolerances are reported and the exit status is 1; a baseline measured on a
+different corpus version is refused with exit status 2.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# Allow running as a script as well as with `python -m benchmarks.run`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.corpus import CORPUS_VERSION, build_corpus
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Bumped when the result layout changes
+RESULTS_VERSION = 1
+
+# Cases faster than this are dominated by timer noise and never flagged
+MIN_COMPARABLE_SECONDS = 0.005
+
+def peak_rss():
+    """Returns this process's peak resident set size in bytes, or None if unavailable."""
+    # ru_maxrss survives execve on Linux, so a spawned child would report its
+    # parent's peak; the kernel's per-address-space high-water mark does not
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _operation(name):
+    """Returns a callable(path, file_bytes) running one benchmarked operation."""
+    import cv2
+    from src.analyzer import ForgeryDetector
+    from src.converter import DocumentProcessor
+    from src.metadata import scan_metadata
+
+    detector = ForgeryDetector()
+    processor = DocumentProcessor()
+    operations = {
+        "perform_ela": lambda path, data: detector.perform_ela(path),
+        "analyze_noise": lambda path, data: detector.analyze_noise(cv2.imread(path)),
+        "extract_metadata": lambda path, data: detector.extract_metadata(path),
+        "process_pdf": lambda path, data: processor.process_pdf(data),
+        "process_word": lambda path, data: processor.process_word(data),
+        "scan_metadata": lambda path, data: scan_metadata(io.BytesIO(data)),
+    }
+    return operations[name]
+
+def run_case(name, operation, path, repeat=5, warmup=1):
+    """
+    Times one operation on one file. Meant to run in a fresh process.
+
+    Args:
+        name (str): Case name.
+        operation (str): Operation key.
+        path (str): Input file.
+        repeat (int): Timed runs.
+        warmup (int): Untimed runs first (imports, caches, lazy init).
+
+    Returns:
+        dict: Timings, peak RSS and throughput, or an 'error' if the operation failed.
+    """
+    run = _operation(operation)
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    result = {"name": name, "operation": operation, "file": os.path.basename(path), "input_bytes": len(file_bytes)}
+    rss_before = peak_rss()
+
+    try:
+        for _ in range(warmup):
+            output = run(path, file_bytes)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = run(path, file_bytes)
+            times.append(time.perf_counter() - start)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+
+    median = statistics.median(times)
+    rss_after = peak_rss()
+    result.update({
+        "repeat": repeat,
+        "wall_min": min(times),
+        "wall_median": median,
+        "wall_mean": statistics.fmean(times),
+        "peak_rss": rss_after,
+        "rss_growth": None if rss_before is None else rss_after - rss_before,
+        "throughput_mb_s": len(file_bytes) / 1e6 / median if median > 0 else None,
+    })
+    # Image-producing operations also report pixel throughput
+    shape = getattr(output, "shape", None)
+    if shape is not None and median > 0:
+        result["megapixels"] = shape[0] * shape[1] / 1e6
+        result["megapixels_per_s"] = result["megapixels"] / median
+    return result
+
+def environment():
+    """Describes the machine and library versions the results were taken on."""
+    import cv2
+    import numpy
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "opencv": cv2.__version__,
+    }
+
+def run_benchmarks(corpus_dir, quick=False, repeat=5, warmup=1, name_filter=None, log=sys.stderr):
+    """
+    Builds the corpus and runs every case, each in its own process.
+
+    Args:
+        corpus_dir (str): Directory for the generated inputs (reused across runs).
+        quick (bool): Use the small size ladder.
+        repeat (int): Timed runs per case.
+        warmup (int): Untimed runs per case.
+        name_filter (str): Only run cases whose name contains this substring.
+        log (file): Progress stream, or None for silence.
+
+    Returns:
+        dict: {'version', 'corpus_version', 'created', 'environment', 'cases': {name: result}}.
+    """
+    cases = [case for case in build_corpus(corpus_dir, quick=quick) if not name_filter or name_filter in case[0]]
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for name, operation, path in cases:
+        # One short-lived process per case keeps peak RSS attributable
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_case, name, operation, path, repeat, warmup).result()
+        results[name] = result
+        if log is not None:
+            if "error" in result:
+                log.write(f"{name:<40} ERROR {result['error'].splitlines()[0]}\n")
+            else:
+                rss = result["peak_rss"]
+                log.write(
+                    f"{name:<40} {result['wall_median'] * 1000:10.1f} ms  "
+                    f"{(rss or 0) / 2**20:8.1f} MiB  {result['throughput_mb_s']:8.2f} MB/s\n"
+                )
+            log.flush()
+
+    return {
+        "version": RESULTS_VERSION,
+        "corpus_version": CORPUS_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "cases": results,
+    }
+
+def compare_results(baseline, current, time_tolerance=0.10, rss_tolerance=0.20):
+    """
+    Compares two result sets case by case.
+
+    A case regresses when its median wall time grows by more than
+    `time_tolerance` or its peak RSS by more than `rss_tolerance` (fractions).
+    Cases missing from either side, failed cases and cases under
+    MIN_COMPARABLE_SECONDS (for time) are not judged.
+
+    Args:
+        baseline (dict): Earlier `run_benchmarks` output.
+        current (dict): New `run_benchmarks` output.
+        time_tolerance (float): Allowed relative wall-time increase.
+        rss_tolerance (float): Allowed relative peak-RSS increase.
+
+    Returns:
+        list: One dict per compared metric with 'name', 'metric', 'baseline',
+            'current', 'change' (relative) and 'regression'.
+    """
+    rows = []
+    for name, now in current["cases"].items():
+        before = baseline["cases"].get(name)
+        if before is None or "error" in before or "error" in now:
+            continue
+        metrics = (("wall_median", time_tolerance), ("peak_rss", rss_tolerance))
+        for metric, tolerance in metrics:
+            old, new = before.get(metric), now.get(metric)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            judged = metric != "wall_median" or max(old, new) >= MIN_COMPARABLE_SECONDS
+            rows.append({
+                "name": name,
+                "metric": metric,
+                "baseline": old,
+                "current": new,
+                "change": change,
+                "regression": judged and change > tolerance,
+            })
+    return rows
+
+def format_comparison(rows):
+    """Renders `compare_results` rows as a plain-text table."""
+    lines = [f"{'case':<40} {'metric':<12} {'baseline':>12} {'current':>12} {'change':>8}"]
+    for row in rows:
+        scale, unit = (1000, "ms") if row["metric"] == "wall_median" else (1 / 2**20, "MiB")
+        marker = "  REGRESSION" if row["regression"] else ""
+        lines.append(
+            f"{row['name']:<40} {row['metric']:<12} "
+            f"{row['baseline'] * scale:9.1f} {unit:<2} {row['current'] * scale:9.1f} {unit:<2} "
+            f"{row['change']:+8.1%}{marker}"
+        )
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the conversion and analysis hot paths.")
+    parser.add_argument("-o", "--output", help="Write results JSON here")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against a baseline results JSON")
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "forgery_benchmark_corpus"),
+                        help="Directory for the generated inputs (reused across runs)")
+    parser.add_argument("--quick", action="store_true", help="Run the small size ladder only")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per case")
+    parser.add_argument("--filter", dest="name_filter", help="Only run cases whose name contains this text")
+    parser.add_argument("--time-tolerance", type=float, default=0.10, help="Allowed wall-time increase (fraction)")
+    parser.add_argument("--rss-tolerance", type=float, default=0.20, help="Allowed peak-RSS increase (fraction)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(
+        args.corpus, quick=args.quick, repeat=args.repeat, warmup=args.warmup, name_filter=args.name_filter
+    )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("corpus_version") != results["corpus_version"]:
+            print(
+                f"{args.compare} was measured on corpus version {baseline.get('corpus_version')}, "
+                f"this run on {results['corpus_version']}; record a new baseline",
+                file=sys.stderr
+            )
+            return 2
+        rows = compare_results(baseline, results, args.time_tolerance, args.rss_tolerance)
+        print(format_comparison(rows))
+        regressions = [row for row in rows if row["regression"]]
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.compare}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
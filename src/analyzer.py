@@ -1,16 +1,65 @@
 import cv2
 import numpy as np
-import os
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from PIL.ExifTags import TAGS
+from src import instrumentation
+import io
+import time
+
+# IJG (libjpeg) standard luminance quantization table at quality 50, row-major
+STANDARD_LUMINANCE_TABLE = np.array([
+    16, 11, 10, 16, 24, 40, 51, 61,
+    12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56,
+    14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77,
+    24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101,
+    72, 92, 95, 98, 112, 100, 103, 99,
+], dtype=np.float64).reshape(8, 8)
+
+# Low-frequency AC modes (zig-zag order) used for double-quantization histograms
+DOUBLE_QUANTIZATION_MODES = [(0, 1), (1, 0), (2, 0), (1, 1), (0, 2), (0, 3), (1, 2), (2, 1), (3, 0)]
+
+def _dct_matrix(size=8):
+    """Orthonormal DCT-II basis; the same transform JPEG applies to each 8x8 block."""
+    k = np.arange(size)
+    basis = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * size)) * np.sqrt(2.0 / size)
+    basis[0] /= np.sqrt(2.0)
+    return basis
+
+DCT_MATRIX = _dct_matrix()
+
+def _ijg_luminance_tables():
+    """Luminance tables libjpeg writes at qualities 1-100, shaped (100, 8, 8)."""
+    qualities = np.arange(1, 101)
+    scales = np.where(qualities < 50, 5000.0 / qualities, 200.0 - 2.0 * qualities)
+    tables = np.floor((STANDARD_LUMINANCE_TABLE[None] * scales[:, None, None] + 50.0) / 100.0)
+    return qualities, np.clip(tables, 1, 255)
+
+IJG_QUALITIES, IJG_LUMINANCE_TABLES = _ijg_luminance_tables()
+
+# Second-order high-pass filter; removes image content and keeps sensor noise
+RESIDUAL_KERNEL = np.array([
+    [-1, 2, -1],
+    [2, -4, 2],
+    [-1, 2, -1],
+], dtype=np.float32) / 4.0
 
 class ForgeryDetector:
     """Class to detect digital forgeries in documents."""
 
+    # JPEG minimum coded unit with 4:2:0 chroma subsampling (2x2 blocks of 8x8)
+    MCU_SIZE = 16
+
+    @instrumentation.traced("ela.file")
     def perform_ela(self, image_path, quality=90):
         """
         Perform Error Level Analysis (ELA) on an image.
         
+        Thin wrapper around `perform_ela_array` for callers that only have a path.
+        
         Args:
             image_path (str): Path to the input image.
             quality (int): JPEG quality level for resaving (default 90).
@@ -23,37 +72,768 @@ class ForgeryDetector:
         if original is None:
             raise ValueError(f"Could not read image at {image_path}")
 
-        temp_filename = "temp_resaved.jpg"
+        return self.perform_ela_array(original, quality=quality)
+
+    @instrumentation.traced("ela.bytes")
+    def perform_ela_bytes(self, file_bytes, quality=90):
+        """
+        Perform Error Level Analysis (ELA) on an encoded image held in memory.
         
-        try:
-            # Resave the image at the specified quality
-            cv2.imwrite(temp_filename, original, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        Args:
+            file_bytes (bytes): Encoded image content (JPEG, PNG, ...).
+            quality (int): JPEG quality level for resaving (default 90).
             
-            # Load the resaved image
-            resaved = cv2.imread(temp_filename)
+        Returns:
+            numpy.ndarray: The ELA processed image with enhanced brightness.
+        """
+        original = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if original is None:
+            raise ValueError("Could not decode image bytes")
+
+        return self.perform_ela_array(original, quality=quality)
+
+    @instrumentation.traced("ela.resave")
+    def perform_ela_array(self, image, quality=90):
+        """
+        Perform Error Level Analysis (ELA) on a decoded BGR image.
+        
+        The JPEG re-encode is done entirely in memory, so no temporary files are
+        written and the method is safe to call concurrently from several threads.
+        
+        Args:
+            image (numpy.ndarray): The input image in BGR (or grayscale) format.
+            quality (int): JPEG quality level for resaving (default 90).
             
-            # Compute the absolute difference between the original and resaved image
-            # ELA highlights areas where the local compression level differs
-            ela_image = cv2.absdiff(original, resaved)
+        Returns:
+            numpy.ndarray: The ELA processed image with enhanced brightness.
+        """
+        image = self._prepare_for_ela(image)
+
+        # ELA highlights areas where the local compression level differs
+        ela_image = self._resave_difference(image, quality)
+
+        # Enhance brightness so it's visible to the human eye
+        # We use a multiplier (alpha) to boost the low-intensity differences
+        # A common factor for ELA visibility is around 15-30
+        ela_image = cv2.convertScaleAbs(ela_image, alpha=20, beta=0)
+
+        return ela_image
+
+    @instrumentation.traced("ela.sweep")
+    def perform_ela_sweep(self, image, qualities=(70, 80, 90, 95), max_workers=None):
+        """
+        Perform ELA at several JPEG qualities in one batched pass.
+        
+        The source is decoded once and each quality is re-encoded on a thread
+        pool; OpenCV releases the GIL during encode/decode so the qualities run
+        in parallel. Genuine tampering tends to stay bright across the curve,
+        whereas uniform recompression fades out once the sweep passes the
+        original quality.
+        
+        Args:
+            image (numpy.ndarray or bytes): Decoded BGR image, or encoded image bytes.
+            qualities (iterable of int): JPEG qualities to re-encode at.
+            max_workers (int): Thread pool size (default: one per quality).
             
-            # Enhance brightness so it's visible to the human eye
-            # We use a multiplier (alpha) to boost the low-intensity differences
-            # A common factor for ELA visibility is around 15-30
-            ela_image = cv2.convertScaleAbs(ela_image, alpha=20, beta=0)
+        Returns:
+            tuple: (numpy.ndarray, list) where the array stacks the brightened ELA
+                images along a new first axis (one per quality, in the given
+                order) and the list holds per-quality statistics computed on the
+                raw error levels.
+        """
+        qualities = [int(q) for q in qualities]
+        if not qualities:
+            raise ValueError("At least one quality is required for an ELA sweep")
+
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            decoded = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+            if decoded is None:
+                raise ValueError("Could not decode image bytes")
+            image = decoded
+        image = self._prepare_for_ela(image)
+
+        # Preallocate the output stack so workers write straight into it
+        stack = np.empty((len(qualities),) + image.shape, dtype=np.uint8)
+
+        def run(index):
+            difference = self._resave_difference(image, qualities[index])
+            cv2.convertScaleAbs(difference, dst=stack[index], alpha=20, beta=0)
+            return {
+                "quality": qualities[index],
+                "mean_error": float(difference.mean()),
+                "std_error": float(difference.std()),
+                "max_error": int(difference.max()),
+                "p99_error": float(np.percentile(difference, 99)),
+            }
+
+        workers = max_workers or len(qualities)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            stats = list(pool.map(run, range(len(qualities))))
+
+        return stack, stats
+
+    @instrumentation.traced("ela.tiled")
+    def perform_ela_tiled(self, image, quality=90, memory_budget=64 * 1024 * 1024, out=None, memmap_path=None):
+        """
+        Perform ELA tile by tile so peak memory stays bounded on very large scans.
+        
+        Tiles are aligned to the 16x16 JPEG MCU grid (which keeps every 8x8 DCT
+        block intact) and re-encoded with a one-MCU halo, so the result matches
+        whole-image ELA while only one tile's worth of intermediates is alive at
+        a time. The input may itself be an `np.memmap`.
+        
+        Args:
+            image (numpy.ndarray): The input image in BGR (or grayscale) format.
+            quality (int): JPEG quality level for resaving (default 90).
+            memory_budget (int): Approximate bytes of working memory per tile.
+            out (numpy.ndarray): Optional preallocated uint8 output of the same shape.
+            memmap_path (str): If given (and `out` is not), the output is written
+                to a disk-backed `np.memmap` at this path.
             
-            return ela_image
+        Returns:
+            numpy.ndarray: The ELA processed image (the `out` array or memmap).
+        """
+        if image is None or image.size == 0:
+            raise ValueError("Cannot perform ELA on an empty image")
+        if image.ndim == 3 and image.shape[2] not in (1, 3):
+            raise ValueError("Tiled ELA expects a BGR or grayscale image")
+
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+
+        if out is None:
+            if memmap_path:
+                out = np.memmap(memmap_path, dtype=np.uint8, mode="w+", shape=image.shape)
+            else:
+                out = np.empty(image.shape, dtype=np.uint8)
+        elif out.shape != image.shape or out.dtype != np.uint8:
+            raise ValueError("Output array must be uint8 with the same shape as the image")
+
+        tile_rows, tile_cols = self._tile_shape(height, width, channels, memory_budget)
+        halo = self.MCU_SIZE
+
+        for y0 in range(0, height, tile_rows):
+            y1 = min(y0 + tile_rows, height)
+            for x0 in range(0, width, tile_cols):
+                x1 = min(x0 + tile_cols, width)
+
+                # Expand by a halo so chroma subsampling at the seams sees the
+                # same neighbours it would in a whole-image encode
+                hy0, hx0 = max(y0 - halo, 0), max(x0 - halo, 0)
+                hy1, hx1 = min(y1 + halo, height), min(x1 + halo, width)
+                tile = np.ascontiguousarray(image[hy0:hy1, hx0:hx1])
+
+                difference = self._resave_difference(tile, quality)
+                inner = difference[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+                out[y0:y1, x0:x1] = cv2.convertScaleAbs(inner, alpha=20, beta=0)
+
+        if isinstance(out, np.memmap):
+            out.flush()
+
+        return out
+
+    def _tile_shape(self, height, width, channels, memory_budget):
+        """Picks an MCU-aligned tile size whose working set fits the memory budget."""
+        # Each tile keeps roughly four copies alive: source, resaved, diff, scaled
+        bytes_per_pixel = channels * 4
+        max_pixels = max(memory_budget // bytes_per_pixel, self.MCU_SIZE * self.MCU_SIZE)
+
+        # Prefer full-width bands, which keep reads contiguous in row-major images
+        rows = (max_pixels // width) // self.MCU_SIZE * self.MCU_SIZE
+        if rows >= self.MCU_SIZE:
+            return min(rows, height), width
+
+        side = int(np.sqrt(max_pixels)) // self.MCU_SIZE * self.MCU_SIZE
+        side = max(side, self.MCU_SIZE)
+        return side, side
+
+    def iter_page_ela(self, pages, quality=90, tile_threshold=40_000_000):
+        """
+        Run ELA over a stream of pages, yielding each result as soon as it's ready.
+        
+        Pages above `tile_threshold` pixels go through `perform_ela_tiled` so a
+        single huge scan cannot blow up memory.
+        
+        Args:
+            pages (iterable): PageImage tuples, e.g. from `DocumentProcessor.iter_pdf_pages`.
+            quality (int): JPEG quality level for resaving (default 90).
+            tile_threshold (int): Pixel count above which tiled ELA is used.
+            
+        Yields:
+            tuple: (PageImage, numpy.ndarray) pairs of page and ELA image.
+        """
+        for page in pages:
+            height, width = page.image.shape[:2]
+            if height * width > tile_threshold:
+                ela_image = self.perform_ela_tiled(page.image, quality=quality)
+            else:
+                ela_image = self.perform_ela_array(page.image, quality=quality)
+            yield page, ela_image
+
+    @instrumentation.traced("ela.score")
+    def score_ela(self, ela_image, image=None, block_size=8, z_threshold=3.5, min_region_blocks=4, activity_bins=8):
+        """
+        Turn an ELA map into a tamper score and a list of suspicious regions.
+        
+        Error levels are averaged per block with a single reshape. Because busy
+        content (text edges, texture) naturally has a higher error level than flat
+        paper, each block is compared with blocks of similar activity in the
+        original image: blocks are grouped into activity quantiles and scored by a
+        robust (median/MAD) z-score within their group. Outlying blocks are merged
+        into 8-connected regions. The score is how much more of the excess error
+        sits in those regions than their share of the page area explains: near 0
+        for uniform error, approaching 1 when a small area carries most of it.
+        
+        Args:
+            ela_image (numpy.ndarray): ELA output (brightened or raw), BGR or grayscale.
+            image (numpy.ndarray): The analysed image, used for the activity
+                baseline. Without it all blocks share one global baseline.
+            block_size (int): Block edge in pixels; 8 matches the JPEG DCT grid.
+            z_threshold (float): Robust z-score above which a block is an outlier.
+            min_region_blocks (int): Smallest region (in blocks) that is reported.
+            activity_bins (int): Number of activity quantile groups.
+            
+        Returns:
+            dict: 'score' (0-1), 'outlier_fraction', 'regions' (pixel bounding
+                boxes with block count, mean z-score and peak error),
+                'block_scores', the per-block z-score map, and 'skipped' (True
+                when the image is smaller than one block and was not scored).
+        """
+        error = ela_image.max(axis=2) if ela_image.ndim == 3 else ela_image
+        if min(error.shape[:2]) < block_size:
+            return {
+                "score": 0.0,
+                "outlier_fraction": 0.0,
+                "regions": [],
+                "block_scores": np.zeros((0, 0)),
+                "block_size": block_size,
+                "skipped": True,
+            }
+        block_means, block_peaks = self._block_reduce(error, block_size)
+
+        if image is not None:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+            activity = self._block_view(gray.astype(np.float32), block_size).std(axis=(1, 3))
+            edges = np.unique(np.quantile(activity, np.linspace(0, 1, activity_bins + 1)[1:-1]))
+            groups = np.digitize(activity, edges)
+        else:
+            groups = np.zeros(block_means.shape, dtype=np.intp)
+
+        # Robust per-group baseline; the floor keeps near-constant groups (blank
+        # paper) from turning tiny deviations into huge z-scores
+        global_median = np.median(block_means)
+        floor = max(np.median(np.abs(block_means - global_median)) * 1.4826, 1.0)
+        block_scores = np.zeros(block_means.shape, dtype=np.float64)
+        for group in np.unique(groups):
+            members = groups == group
+            values = block_means[members]
+            median = np.median(values)
+            mad = np.median(np.abs(values - median)) * 1.4826
+            block_scores[members] = (values - median) / max(mad, floor)
+
+        outliers = (block_scores > z_threshold).astype(np.uint8)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(outliers, connectivity=8)
+
+        # Per-region aggregates in one pass over the label map
+        flat_labels = labels.ravel()
+        z_sums = np.bincount(flat_labels, weights=block_scores.ravel(), minlength=count)
+        peaks = np.zeros(count, dtype=block_peaks.dtype)
+        np.maximum.at(peaks, flat_labels, block_peaks.ravel())
+
+        kept = np.zeros(count, dtype=bool)
+        kept[1:] = stats[1:, cv2.CC_STAT_AREA] >= min_region_blocks
+        regions = []
+        for label in np.flatnonzero(kept):
+            x, y, w, h, area = stats[label]
+            regions.append({
+                "x": int(x * block_size),
+                "y": int(y * block_size),
+                "width": int(w * block_size),
+                "height": int(h * block_size),
+                "blocks": int(area),
+                "mean_z": float(z_sums[label] / area),
+                "peak_error": int(peaks[label]),
+            })
+        regions.sort(key=lambda region: region["mean_z"] * region["blocks"], reverse=True)
+
+        region_mask = kept[labels]
+        excess = np.clip(block_means - global_median, 0, None)
+        total_excess = excess.sum()
+        if total_excess > 0 and regions:
+            energy_share = excess[region_mask].sum() / total_excess
+            score = float(np.clip(energy_share - region_mask.mean(), 0.0, 1.0))
+        else:
+            score = 0.0
+
+        return {
+            "score": score,
+            "outlier_fraction": float(outliers.mean()),
+            "regions": regions,
+            "block_scores": block_scores,
+            "block_size": block_size,
+            "skipped": False,
+        }
+
+    def _block_view(self, array, block_size):
+        """Crops a 2D array to whole blocks and views it as (rows, block, cols, block)."""
+        rows, cols = array.shape[0] // block_size, array.shape[1] // block_size
+        if rows == 0 or cols == 0:
+            raise ValueError("Image is smaller than one analysis block")
+        cropped = array[:rows * block_size, :cols * block_size]
+        return cropped.reshape(rows, block_size, cols, block_size)
+
+    def _block_reduce(self, array, block_size):
+        """Returns per-block means and maxima of a 2D array."""
+        blocks = self._block_view(array, block_size)
+        return blocks.mean(axis=(1, 3), dtype=np.float64), blocks.max(axis=(1, 3))
+
+    @instrumentation.traced("noise.analyze")
+    def analyze_noise(self, image, block_size=32, z_threshold=3.5, min_region_blocks=3, intensity_bins=8,
+                      jpeg_grid=False, time_budget=2.0):
+        """
+        Look for regions whose sensor noise or interpolation traces differ from the rest of the page.
+
+        A splice from a source with a similar compression level is invisible to
+        ELA but usually brings its own noise level, and a pasted region that was
+        scaled or rotated carries the periodic correlations of interpolation.
+        Both are measured on the high-pass residual of the image, per block:
+
+        - Noise level: the mean absolute residual over the block's flat,
+          unsaturated pixels (edges and clipped paper would dominate otherwise),
+          from block sums (the block-grid equivalent of an integral image). Each
+          block is compared with blocks of similar brightness by a robust
+          z-score on the log scale, in both directions: pasted content can be
+          noisier or cleaner than its surroundings.
+        - Resampling: the residual is turned into a probability map of "well
+          predicted" pixels, whose spectrum shows isolated peaks when the pixels
+          were interpolated. In mostly flat blocks, the strongest
+          non-low-frequency peak over the mean of the spectrum is z-scored
+          against the page.
+
+        Block spectra are computed in batches until `time_budget` seconds have
+        passed; blocks left over are reported as unscored rather than slowing
+        the page down. A 300-DPI letter page takes well under a second.
+
+        Args:
+            image (numpy.ndarray): Page in BGR or grayscale.
+            block_size (int): Block edge in pixels for both measurements.
+            z_threshold (float): Robust z-score above which a block is an outlier.
+            min_region_blocks (int): Smallest region (in blocks) that is reported.
+            intensity_bins (int): Number of brightness quantile groups for the noise baseline.
+            jpeg_grid (bool): Ignore the 8-pixel JPEG block frequencies in the
+                spectra (set for pages that are stored JPEGs).
+            time_budget (float): Seconds allowed for the resampling spectra.
+
+        Returns:
+            dict: 'score' (0-1), 'regions' (pixel bounding boxes with block count
+                and mean noise/resampling z-scores), 'noise_scores' and
+                'resampling_scores' (per-block z-score maps, NaN where a block
+                could not be measured), 'noise_level' (median residual),
+                'budget_exhausted' and 'skipped' (True when the image is smaller
+                than one block and was not analyzed).
+        """
+        if min(image.shape[:2]) < block_size:
+            return {
+                "score": 0.0,
+                "regions": [],
+                "noise_scores": np.zeros((0, 0)),
+                "resampling_scores": np.zeros((0, 0)),
+                "noise_level": 0.0,
+                "block_size": block_size,
+                "budget_exhausted": False,
+                "skipped": True,
+            }
+        start = time.perf_counter()
+        image = self._prepare_for_ela(image)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        gray = gray.astype(np.float32)
+        residual = cv2.filter2D(gray, cv2.CV_32F, RESIDUAL_KERNEL, borderType=cv2.BORDER_REFLECT)
+        abs_residual = np.abs(residual)
+
+        # Flat pixels: small gradient and away from clipping
+        gradient = cv2.magnitude(cv2.Sobel(gray, cv2.CV_32F, 1, 0), cv2.Sobel(gray, cv2.CV_32F, 0, 1))
+        # (the median is taken on a subsample; a full-page partition costs more than the filters)
+        flat = (gradient < max(np.median(gradient[::4, ::4]) * 4.0, 8.0)) & (gray > 4) & (gray < 251)
+        flat = flat.astype(np.float32)
+
+        flat_counts = self._block_view(flat, block_size).sum(axis=(1, 3))
+        residual_sums = self._block_view(abs_residual * flat, block_size).sum(axis=(1, 3))
+        brightness = self._block_view(gray, block_size).mean(axis=(1, 3))
+        measurable = flat_counts >= 0.25 * block_size * block_size
+        noise_level = np.full(flat_counts.shape, np.nan)
+        noise_level[measurable] = residual_sums[measurable] / flat_counts[measurable]
+
+        noise_scores = np.full(flat_counts.shape, np.nan)
+        if measurable.sum() >= 2 * min_region_blocks:
+            log_noise = np.log(noise_level[measurable] + 0.1)
+            levels = brightness[measurable]
+            edges = np.unique(np.quantile(levels, np.linspace(0, 1, intensity_bins + 1)[1:-1]))
+            groups = np.digitize(levels, edges)
+            floor = max(np.median(np.abs(log_noise - np.median(log_noise))) * 1.4826, 0.05)
+            scores = np.zeros(log_noise.shape)
+            for group in np.unique(groups):
+                members = groups == group
+                median = np.median(log_noise[members])
+                mad = np.median(np.abs(log_noise[members] - median)) * 1.4826
+                scores[members] = (log_noise[members] - median) / max(mad, floor)
+            noise_scores[measurable] = scores
+
+        resampling_scores, exhausted = self._resampling_scores(
+            residual, flat, measurable, block_size, jpeg_grid, start + time_budget
+        )
+
+        evidence = np.fmax(np.nan_to_num(np.abs(noise_scores)), np.nan_to_num(resampling_scores))
+        regions, score = self._outlier_regions(
+            evidence, z_threshold, min_region_blocks, block_size,
+            {"noise_z": np.nan_to_num(noise_scores), "resampling_z": np.nan_to_num(resampling_scores)}
+        )
+        return {
+            "score": score,
+            "regions": regions,
+            "noise_scores": noise_scores,
+            "resampling_scores": resampling_scores,
+            "noise_level": float(np.nanmedian(noise_level)) if measurable.any() else 0.0,
+            "block_size": block_size,
+            "budget_exhausted": exhausted,
+            "skipped": False,
+        }
+
+    def _resampling_scores(self, residual, flat, measurable, block_size, jpeg_grid, deadline, batch_size=512):
+        """Per-block resampling z-scores from the spectra of the residual's p-map, within a deadline."""
+        rows, cols = measurable.shape
+        scores = np.full((rows, cols), np.nan)
+        # Spectra need mostly flat blocks: glyph edges leave periodic holes in the p-map
+        flat_share = self._block_view(flat, block_size).mean(axis=(1, 3))
+        indices = np.flatnonzero(measurable & (flat_share >= 0.75))
+        if len(indices) == 0:
+            return scores, False
+
+        # Probability that each pixel is well predicted by its neighbours (Kirchner's
+        # fixed-predictor p-map, with unit spread on the 0-255 scale)
+        p_map = np.exp(-0.5 * residual * residual)
+        blocks = self._block_view(p_map, block_size)
+        masks = self._block_view(flat, block_size)
+
+        # Candidate frequencies: away from DC and the low band where page layout lives
+        fy = np.fft.fftfreq(block_size)[:, None]
+        fx = np.fft.rfftfreq(block_size)[None, :]
+        candidates = np.hypot(fy, fx) > 0.125
+        if jpeg_grid:
+            on_grid = (np.isclose((fy * 8) % 1, 0) | np.isclose((fx * 8) % 1, 0))
+            candidates &= ~on_grid
+        window = np.outer(np.hanning(block_size), np.hanning(block_size)).astype(np.float32)
+
+        peaks = np.full(rows * cols, np.nan)
+        exhausted = False
+        for offset in range(0, len(indices), batch_size):
+            if time.perf_counter() > deadline:
+                exhausted = True
+                break
+            chunk = indices[offset:offset + batch_size]
+            # Advanced indexing on the (rows, block, cols, block) view gathers (n, block, block)
+            batch = blocks[chunk // cols, :, chunk % cols, :]
+            mask = masks[chunk // cols, :, chunk % cols, :]
+            # Edges (glyph strokes) are zeroed so their regular spacing cannot pass for interpolation
+            mean = (batch * mask).sum(axis=(1, 2), keepdims=True) / mask.sum(axis=(1, 2), keepdims=True)
+            batch = (batch - mean) * mask * window
+            spectrum = np.abs(np.fft.rfft2(batch)) ** 2
+            values = spectrum[:, candidates]
+            energy = values.mean(axis=1)
+            # Noise-free blocks (rendered pages) have no spectrum to measure
+            peaks[chunk] = np.where(energy > 1e-9, values.max(axis=1) / np.maximum(energy, 1e-9), np.nan)
+
+        measured = ~np.isnan(peaks)
+        if measured.sum() >= 2:
+            log_peaks = np.log(peaks[measured])
+            median = np.median(log_peaks)
+            mad = max(np.median(np.abs(log_peaks - median)) * 1.4826, 0.05)
+            # Only unusually strong peaks are evidence of interpolation
+            scores.ravel()[measured] = np.clip((log_peaks - median) / mad, 0, None)
+        return scores, exhausted
+
+    def _outlier_regions(self, block_scores, z_threshold, min_region_blocks, block_size, extra_scores):
+        """
+        Merges blocks above `z_threshold` into 8-connected regions.
+
+        Returns:
+            tuple: (regions sorted by strength, score). The score is the share of
+                the excess evidence inside regions minus their share of the area,
+                as in `score_ela`.
+        """
+        outliers = (block_scores > z_threshold).astype(np.uint8)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(outliers, connectivity=8)
+        flat_labels = labels.ravel()
+        sums = {name: np.bincount(flat_labels, weights=values.ravel(), minlength=count)
+                for name, values in {"mean_z": block_scores, **extra_scores}.items()}
+
+        kept = np.zeros(count, dtype=bool)
+        kept[1:] = stats[1:, cv2.CC_STAT_AREA] >= min_region_blocks
+        regions = []
+        for label in np.flatnonzero(kept):
+            x, y, w, h, area = stats[label]
+            region = {
+                "x": int(x * block_size),
+                "y": int(y * block_size),
+                "width": int(w * block_size),
+                "height": int(h * block_size),
+                "blocks": int(area),
+            }
+            region.update({name: float(total[label] / area) for name, total in sums.items()})
+            regions.append(region)
+        regions.sort(key=lambda region: region["mean_z"] * region["blocks"], reverse=True)
+
+        region_mask = kept[labels]
+        excess = np.clip(block_scores, 0, None)
+        total_excess = excess.sum()
+        if total_excess > 0 and regions:
+            score = float(np.clip(excess[region_mask].sum() / total_excess - region_mask.mean(), 0.0, 1.0))
+        else:
+            score = 0.0
+        return regions, score
+
+    def combine_scores(self, ela_scoring, noise_scoring, ela_weight=1.0, z_threshold=3.5, min_region_blocks=3):
+        """
+        Fuse the ELA and noise/resampling evidence into one per-region score.
+
+        The ELA block z-scores are averaged onto the coarser noise grid and the
+        three maps are combined per block with Stouffer's method, so a region
+        flagged by two detectors at once stands out more than by either alone.
+        Lower `ela_weight` for pages without JPEG history (PNG uploads, rendered
+        PDF pages), where the ELA map is mostly noise.
+
+        Args:
+            ela_scoring (dict): Output of `score_ela`.
+            noise_scoring (dict): Output of `analyze_noise` for the same image.
+            ela_weight (float): Weight of the ELA evidence (0 ignores it).
+            z_threshold (float): Combined z-score above which a block is an outlier.
+            min_region_blocks (int): Smallest region (in blocks) that is reported.
+
+        Returns:
+            dict: 'score' (0-1), 'regions' (pixel bounding boxes with the combined
+                and per-detector mean z-scores) and 'block_scores'.
+        """
+        block_size = noise_scoring["block_size"]
+        noise = np.abs(np.nan_to_num(noise_scoring["noise_scores"]))
+        resampling = np.nan_to_num(noise_scoring["resampling_scores"])
+        if noise.size == 0:
+            # Nothing was measured on the noise grid (an image smaller than one block)
+            return {"score": 0.0, "regions": [], "block_scores": noise}
+
+        ela_block = ela_scoring.get("block_size", 8)
+        factor = max(1, block_size // ela_block)
+        ela_scores = ela_scoring["block_scores"]
+        rows = min(noise.shape[0], ela_scores.shape[0] // factor)
+        cols = min(noise.shape[1], ela_scores.shape[1] // factor)
+        ela = np.zeros(noise.shape)
+        if rows and cols:
+            ela[:rows, :cols] = self._block_view(ela_scores[:rows * factor, :cols * factor], factor).mean(axis=(1, 3))
+        ela = np.clip(ela, 0, None)
+
+        combined = (ela_weight * ela + noise + resampling) / np.sqrt(ela_weight ** 2 + 2.0)
+        regions, score = self._outlier_regions(
+            combined, z_threshold, min_region_blocks, block_size,
+            {"ela_z": ela, "noise_z": noise, "resampling_z": resampling}
+        )
+        return {"score": score, "regions": regions, "block_scores": combined}
+
+    @instrumentation.traced("jpeg.compression")
+    def analyze_jpeg_compression(self, file_bytes, double_quantization_threshold=0.45,
+                                 grid_threshold=0.1, sample_blocks=3000):
+        """
+        Inspect a JPEG's own compression history without re-encoding it.
+        
+        Three signals are derived from the file as stored:
+        
+        - The quantization tables, with the IJG quality that best reproduces the
+          luminance table and whether the tables are standard IJG ones.
+        - Double quantization: blockwise DCT coefficients of the luminance plane,
+          divided by the current table, form histograms without any periodic
+          structure after a single compression. A previous compression at a
+          different quality leaves gaps and peaks repeating at the ratio of the
+          two quantization steps; the score is how well the histograms match
+          that pattern for the best-fitting earlier IJG quality.
+        - Grid misalignment: high-frequency DCT energy is lowest on the grid of
+          an earlier compression. A minimum away from the current grid means the
+          content was cropped or shifted after being compressed before.
+        
+        Args:
+            file_bytes (bytes): The encoded JPEG file.
+            double_quantization_threshold (float): Score above which the image
+                is reported as double compressed.
+            grid_threshold (float): Relative energy dip above which an offset
+                grid is reported.
+            sample_blocks (int): Blocks sampled per grid offset.
             
-        finally:
-            # Ensure the temporary file is cleaned up
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
+        Returns:
+            dict: 'quality_estimate', 'standard_tables', 'quantization',
+                'double_compression_score', 'double_compressed', 'grid_offset'
+                (dx, dy), 'grid_strength' and 'grid_misaligned'.
+        """
+        img = Image.open(io.BytesIO(file_bytes))
+        if img.format != "JPEG":
+            raise ValueError("JPEG compression analysis requires a JPEG image")
+        tables = {int(k): [int(v) for v in table] for k, table in img.quantization.items()}
+        if 0 not in tables:
+            raise ValueError("JPEG has no luminance quantization table")
+        luminance_table = np.array(tables[0], dtype=np.float64).reshape(8, 8)
+
+        quality, standard = self._estimate_jpeg_quality(luminance_table)
+
+        bgr_image = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if bgr_image is None:
+            raise ValueError("Could not decode JPEG image")
+        luminance = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2YCrCb)[:, :, 0].astype(np.float64) - 128.0
 
+        coefficients = self._block_dct(luminance)
+        double_score = self._double_quantization_score(coefficients, luminance_table)
+        offset, strength = self._grid_offset(luminance, sample_blocks)
+
+        return {
+            "quality_estimate": quality,
+            "standard_tables": standard,
+            "quantization": tables,
+            "double_compression_score": double_score,
+            "double_compressed": double_score > double_quantization_threshold,
+            "grid_offset": offset,
+            "grid_strength": strength,
+            "grid_misaligned": strength > grid_threshold,
+        }
+
+    def _estimate_jpeg_quality(self, luminance_table):
+        """Finds the IJG quality whose scaled standard table is closest to `luminance_table`."""
+        errors = np.abs(IJG_LUMINANCE_TABLES - luminance_table[None]).sum(axis=(1, 2))
+        best = int(np.argmin(errors))
+        return int(IJG_QUALITIES[best]), bool(errors[best] == 0)
+
+    def _block_dct(self, plane):
+        """2D DCT of every aligned 8x8 block, shaped (rows, cols, 8, 8)."""
+        blocks = self._block_view(plane, 8).transpose(0, 2, 1, 3)
+        return np.einsum('ij,rcjk,lk->rcil', DCT_MATRIX, blocks, DCT_MATRIX, optimize=True)
+
+    def _double_quantization_score(self, coefficients, luminance_table, max_bin=16, min_mode_count=200):
+        """
+        How well the quantized-coefficient histograms fit the periodic trace of an earlier IJG quality.
+
+        Re-quantizing with step q2 a coefficient already quantized with step q1
+        leaves bin k holding the multiples m of q1 with round(m * q1 / q2) == k,
+        a pattern that repeats every q1 / q2 bins. Text and line art give
+        irregular histograms after a single compression too, so deviation from
+        a smooth decay alone is no evidence. The score is the correlation
+        between the histograms' deviations from a smooth decay and that
+        pattern, maximized over the earlier quality; one quality sets q1 for
+        every mode at once, which keeps chance matches low.
+
+        Returns:
+            float: Correlation in [-1, 1]; 0.0 when too few coefficients are populated.
+        """
+        bins = np.arange(1, max_bin + 1, dtype=np.float64)
+        trend_basis = np.stack([np.ones(max_bin), bins, bins ** 2], axis=1)
+        modes = []
+        for u, v in DOUBLE_QUANTIZATION_MODES:
+            values = np.abs(np.rint(coefficients[:, :, u, v] / luminance_table[u, v])).astype(np.int64)
+            histogram = np.bincount(values.ravel(), minlength=max_bin + 1)[1:max_bin + 1].astype(np.float64)
+            if histogram.sum() < min_mode_count:
+                continue
+
+            # Bins are weighted by their counting noise, so sparse bins count for
+            # little; the weighted log-quadratic fit is the smooth decay
+            weights = np.sqrt(histogram + 1.0)
+            root = np.sqrt(weights)
+            detrend = np.eye(max_bin) - trend_basis @ (np.linalg.pinv(trend_basis * root[:, None]) * root[None, :])
+            modes.append((u, v, weights, detrend, detrend @ np.log(histogram + 1.0)))
+
+        best = 0.0
+        patterns = {}
+        for table in IJG_LUMINANCE_TABLES:
+            if np.array_equal(table, luminance_table):
+                continue
+            products = deviations = expected = 0.0
+            used = 0
+            for u, v, weights, detrend, deviation in modes:
+                steps = (table[u, v], luminance_table[u, v])
+                if steps[0] == steps[1]:
+                    continue
+                if steps not in patterns:
+                    patterns[steps] = np.log(self._requantized_bin_counts(*steps, max_bin) + 0.5)
+                pattern = detrend @ patterns[steps]
+                products += (weights * deviation * pattern).sum()
+                deviations += (weights * deviation ** 2).sum()
+                expected += (weights * pattern ** 2).sum()
+                used += 1
+            if used >= 3 and deviations > 0 and expected > 0:
+                best = max(best, products / np.sqrt(deviations * expected))
+
+        return float(best)
+
+    def _requantized_bin_counts(self, first_step, second_step, max_bin):
+        """Number of multiples of `first_step` that land in each bin 1..max_bin when re-quantized with `second_step`."""
+        multiples = np.arange(int((max_bin + 1) * second_step / first_step) + 2)
+        bins = np.rint(multiples * first_step / second_step).astype(np.int64)
+        return np.bincount(bins, minlength=max_bin + 2)[1:max_bin + 1].astype(np.float64)
+
+    def _grid_offset(self, plane, sample_blocks):
+        """Returns the (dx, dy) of the strongest off-grid compression trace and its strength."""
+        # Every offset keeps at least this many whole blocks, so one set of
+        # sampled block coordinates serves all 64 grids
+        rows, cols = (plane.shape[0] - 7) // 8, (plane.shape[1] - 7) // 8
+        if rows <= 0 or cols <= 0:
+            raise ValueError("Image is too small for grid analysis")
+        picks = np.linspace(0, rows * cols - 1, min(rows * cols, sample_blocks)).astype(np.intp)
+        block_rows, block_cols = np.divmod(picks, cols)
+        # A 15x15 window per sampled block covers that block at all 64 offsets
+        pixel_rows = (8 * block_rows)[:, None, None] + np.arange(15)[None, :, None]
+        pixel_cols = (8 * block_cols)[:, None, None] + np.arange(15)[None, None, :]
+        windows = plane[pixel_rows, pixel_cols]
+
+        high_frequency = np.add.outer(np.arange(8), np.arange(8)) >= 4
+        energy = np.zeros((8, 8))
+        for dy in range(8):
+            for dx in range(8):
+                coefficients = DCT_MATRIX @ windows[:, dy:dy + 8, dx:dx + 8] @ DCT_MATRIX.T
+                energy[dy, dx] = np.abs(coefficients[:, high_frequency]).mean()
+
+        # Offsets sharing a row or column with the current grid stay partly
+        # aligned with it, so only fully shifted grids are candidates
+        candidates = energy[1:, 1:]
+        baseline = np.median(candidates)
+        if baseline <= 0:
+            return (0, 0), 0.0
+        dy, dx = np.unravel_index(np.argmin(candidates), candidates.shape)
+        strength = float(1.0 - candidates[dy, dx] / baseline)
+        return (int(dx) + 1, int(dy) + 1), strength
+
+    def _prepare_for_ela(self, image):
+        """Validates an input array and normalises it to a JPEG-encodable layout."""
+        if image is None or image.size == 0:
+            raise ValueError("Cannot perform ELA on an empty image")
+
+        # JPEG has no alpha channel, so drop it before the re-encode
+        if image.ndim == 3 and image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+        return image
+
+    def _resave_difference(self, image, quality):
+        """Returns the raw absolute difference between an image and its JPEG resave."""
+        # Resave the image at the specified quality into an in-memory buffer
+        success, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not success:
+            raise ValueError("Could not JPEG-encode image for ELA")
+
+        # Decode the resaved image with the same channel layout as the original
+        flags = cv2.IMREAD_GRAYSCALE if image.ndim == 2 else cv2.IMREAD_COLOR
+        resaved = cv2.imdecode(buffer, flags)
+
+        return cv2.absdiff(image, resaved)
+
+    @instrumentation.traced("metadata.exif")
     def extract_metadata(self, image_path):
         """
         Extract EXIF metadata from an image and look for editing software markers.
         
         Args:
-            image_path (str): Path to the input image.
+            image_path (str or file-like): Path to the input image, or an
+                in-memory file object (e.g. BytesIO) holding the encoded image.
             
         Returns:
             dict: Dictionary of relevant EXIF tags and their values.
@@ -0,0 +1,332 @@
+"""
+Headless batch screening of document archives.
+
+Usage:
+    python -m src.batch ARCHIVE_DIR_OR_MANIFEST --output results.jsonl [--workers N] [--store reports.sqlite]
+
+Each document goes through the same pipeline as the Streamlit app and one JSON
+line is appended to the output per document. The output file doubles as the
+checkpoint: rerunning the same command skips every path already recorded, so
+a crashed run resumes where it stopped. A document that kills its worker
+process is recorded as an error and the pool is restarted. With a report
+store, records are also bulk-inserted into it for later querying
+(`src.report_store`).
+"""
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import argparse
+import itertools
+import json
+import multiprocessing.util
+import numpy as np
+import os
+import sys
+import time
+
+# Allow running as a script as well as with `python -m src.batch`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import instrumentation
+from src.analyzer import ForgeryDetector
+from src.cache import ResultCache, decode_page_image, default_cache_dir
+from src.converter import DocumentProcessor
+from src.pipeline import SUPPORTED_EXTENSIONS, analyze_document, strip_page_images
+from src.report_store import ArrayStore, ReportStore, default_store_path
+from src.shared_pages import SharedMemoryTransport
+
+# Per-process analysis objects, created once by the pool initializer
+_worker_detector = None
+_worker_processor = None
+_worker_cache = None
+_worker_transport = None
+_worker_arrays = None
+
+# Records are inserted into the report store in transactions of up to this
+# many, or at least this often
+STORE_BATCH_SIZE = 256
+STORE_FLUSH_SECONDS = 2.0
+
+def _init_worker(cache_dir=None, shared_pages=False, array_dir=None):
+    """Creates the detector, converter, optional result cache, page transport and ELA map store once per worker process."""
+    global _worker_detector, _worker_processor, _worker_cache, _worker_transport, _worker_arrays
+    instrumentation.configure_from_env()
+    # Pool workers exit without running atexit hooks; flush buffered metrics
+    # through multiprocessing's own exit finalizers instead
+    multiprocessing.util.Finalize(None, instrumentation.flush, exitpriority=10)
+    _worker_detector = ForgeryDetector()
+    _worker_processor = DocumentProcessor()
+    _worker_cache = ResultCache(cache_dir) if cache_dir else None
+    if shared_pages:
+        # Two buffers: one page being analyzed while the next is converted
+        _worker_transport = SharedMemoryTransport(slots=2)
+        multiprocessing.util.Finalize(None, _worker_transport.close, exitpriority=10)
+    _worker_arrays = ArrayStore(array_dir) if array_dir else None
+
+def analyze_path(path, quality=90, dpi=300, changed_pages_only=False):
+    """
+    Analyzes a single file and returns a JSON-serialisable record.
+
+    Errors are captured in the record instead of raised, so one corrupt file
+    never stops a batch.
+
+    Args:
+        path (str): Path to the document.
+        quality (int): JPEG quality used for ELA.
+        dpi (int): Rendering resolution for rasterized PDF pages.
+        changed_pages_only (bool): Only analyze PDF pages changed by incremental updates.
+
+    Returns:
+        dict: The analysis record for `path`.
+    """
+    start = time.perf_counter()
+    record = {"path": path}
+    try:
+        with open(path, 'rb') as f:
+            file_bytes = f.read()
+        report = analyze_document(
+            file_bytes,
+            os.path.basename(path),
+            quality=quality,
+            dpi=dpi,
+            detector=_worker_detector,
+            processor=_worker_processor,
+            cache=_worker_cache,
+            changed_pages_only=changed_pages_only,
+            transport=_worker_transport,
+            keep_images=_worker_arrays is not None
+        )
+        if _worker_arrays is not None:
+            report = _store_ela_maps(report, _worker_arrays)
+        record.update(report)
+        record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+    record["elapsed"] = round(time.perf_counter() - start, 4)
+    return record
+
+def _store_ela_maps(report, arrays):
+    """Writes each page's ELA map to the array store, leaving its key in 'ela_map' instead of the images."""
+    pages = []
+    for page in report["pages"]:
+        ela_image = page.get("ela_image")
+        page = dict(page)
+        if ela_image is not None:
+            page["ela_map"] = arrays.put(ela_image if isinstance(ela_image, np.ndarray) else decode_page_image(ela_image))
+        pages.append(page)
+    return strip_page_images(dict(report, pages=pages))
+
+def collect_paths(source):
+    """
+    Lists the documents to screen from a directory tree or a manifest file.
+
+    A manifest is either a text file with one path per line or a JSONL file
+    whose lines carry a "path" key. Relative paths are resolved against the
+    manifest's directory.
+
+    Args:
+        source (str): Directory or manifest path.
+
+    Returns:
+        list: Document paths in a stable order.
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+        return paths
+
+    base = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                line = json.loads(line)["path"]
+            paths.append(line if os.path.isabs(line) else os.path.join(base, line))
+    return paths
+
+def load_checkpoint(output_path):
+    """
+    Reads the paths already recorded in an output file.
+
+    A line truncated by a crash is ignored, so its document is analyzed again.
+
+    Args:
+        output_path (str): The JSONL results file.
+
+    Returns:
+        set: Paths that don't need to be analyzed again.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["path"])
+            except (ValueError, KeyError):
+                continue
+    return done
+
+def run_batch(paths, output_path, workers=None, quality=90, dpi=300, cache_dir=None, log=sys.stderr, progress_every=100,
+              changed_pages_only=False, shared_pages=False, store_path=None):
+    """
+    Screens documents on a process pool and streams records to a JSONL file.
+
+    Args:
+        paths (list): Document paths to analyze.
+        output_path (str): JSONL file to append results to (also the checkpoint).
+        workers (int): Number of worker processes (default: CPU count).
+        quality (int): JPEG quality used for ELA.
+        dpi (int): Rendering resolution for rasterized PDF pages.
+        cache_dir (str): Result cache directory shared with the app (disabled if None).
+        log (file): Stream for progress and throughput messages.
+        progress_every (int): Print throughput after this many documents.
+        changed_pages_only (bool): Only analyze PDF pages changed by incremental updates.
+        shared_pages (bool): Convert each document in a child of its worker,
+            overlapping conversion with analysis, and pass pages through
+            shared memory (`src.shared_pages`).
+        store_path (str): Optional ReportStore database; records are added
+            to it in bulk and the workers save ELA maps to its array store.
+
+    Returns:
+        dict: Summary with counts, elapsed seconds and docs/sec.
+    """
+    done = load_checkpoint(output_path)
+    todo = [p for p in paths if p not in done]
+    workers = workers or os.cpu_count() or 1
+    print(f"{len(paths) - len(todo)} already done, {len(todo)} to analyze on {workers} workers", file=log)
+
+    summary = {"analyzed": 0, "errors": 0, "skipped": len(paths) - len(todo)}
+    start = time.perf_counter()
+    store = ReportStore(store_path) if store_path else None
+    array_dir = store.arrays.directory if store is not None and store.arrays is not None else None
+
+    # A crash can leave a truncated last line; start our records on a fresh one
+    needs_newline = False
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+
+    def start_pool():
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache_dir, shared_pages, array_dir))
+
+    pool = start_pool()
+    with open(output_path, 'a', encoding='utf-8') as out:
+        if needs_newline:
+            out.write('\n')
+
+        # Records reach the store before the checkpoint file, so a crash in
+        # between re-analyzes them rather than leaving them out of the store
+        unsaved = []
+        last_flush = time.perf_counter()
+
+        def flush():
+            nonlocal last_flush
+            if store is not None and unsaved:
+                store.add_many(unsaved)
+            for record in unsaved:
+                out.write(json.dumps(record, default=str) + '\n')
+            out.flush()
+            unsaved.clear()
+            last_flush = time.perf_counter()
+
+        def collect(future, path):
+            # A worker that dies (out of memory, a native crash) breaks the
+            # whole pool and fails every in-flight task. Those documents are
+            # recorded as errors so a resumed run doesn't hit the crash again.
+            try:
+                record = future.result()
+            except BrokenProcessPool:
+                record = {"path": path, "status": "error", "error": "Worker process died during analysis"}
+            unsaved.append(record)
+            summary["analyzed"] += 1
+            if record["status"] != "ok":
+                summary["errors"] += 1
+
+            if summary["analyzed"] % progress_every == 0:
+                rate = summary["analyzed"] / (time.perf_counter() - start)
+                print(f"{summary['analyzed']}/{len(todo)} documents, {rate:.1f} docs/sec", file=log)
+
+        try:
+            # Keep a bounded window of in-flight tasks instead of submitting everything
+            pending = {}
+            queue = iter(todo)
+            window = workers * 4
+            while True:
+                broken = False
+                for path in queue:
+                    try:
+                        pending[pool.submit(analyze_path, path, quality, dpi, changed_pages_only)] = path
+                    except BrokenProcessPool:
+                        queue = itertools.chain([path], queue)
+                        broken = True
+                        break
+                    if len(pending) >= window:
+                        break
+                if not pending and not broken:
+                    break
+
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                broken = broken or any(isinstance(future.exception(), BrokenProcessPool) for future in finished)
+                if broken:
+                    finished, _ = wait(pending)
+                for future in finished:
+                    collect(future, pending.pop(future))
+                if broken:
+                    pool.shutdown(wait=False)
+                    pool = start_pool()
+                    print(f"Worker process died; restarted the pool ({summary['errors']} errors so far)", file=log)
+
+                if store is None or len(unsaved) >= STORE_BATCH_SIZE or not pending \
+                        or time.perf_counter() - last_flush >= STORE_FLUSH_SECONDS:
+                    flush()
+        finally:
+            flush()
+            pool.shutdown()
+
+    if store is not None:
+        store.close()
+    summary["elapsed"] = round(time.perf_counter() - start, 3)
+    summary["docs_per_sec"] = round(summary["analyzed"] / summary["elapsed"], 2) if summary["elapsed"] else 0.0
+    print(
+        f"Done: {summary['analyzed']} analyzed ({summary['errors']} errors), "
+        f"{summary['skipped']} skipped, {summary['docs_per_sec']} docs/sec",
+        file=log
+    )
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch forensic screening of document archives.")
+    parser.add_argument("source", help="Directory to walk, or a manifest (.txt paths or .jsonl with 'path').")
+    parser.add_argument("-o", "--output", default="forensic_results.jsonl", help="JSONL results file, also used as checkpoint.")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality used for ELA.")
+    parser.add_argument("--dpi", type=int, default=300, help="Rendering resolution for PDF pages.")
+    parser.add_argument("--cache", action="store_true", help="Reuse and fill the result cache shared with the app.")
+    parser.add_argument("--cache-dir", default=None, help="Result cache directory (implies --cache).")
+    parser.add_argument("--changed-pages-only", action="store_true",
+                        help="For PDFs with incremental updates, only analyze the pages later revisions changed.")
+    parser.add_argument("--store", nargs="?", const=default_store_path(), default=None,
+                        help="Also add every record to a report store for querying (default location if no path given).")
+    parser.add_argument("--shared-pages", action="store_true",
+                        help="Convert pages in a separate process, ahead of the analysis, and share them without copying.")
+    args = parser.parse_args(argv)
+
+    cache_dir = args.cache_dir or (default_cache_dir() if args.cache else None)
+    paths = collect_paths(args.source)
+    summary = run_batch(
+        paths, args.output, workers=args.workers, quality=args.quality, dpi=args.dpi, cache_dir=cache_dir,
+        changed_pages_only=args.changed_pages_only, shared_pages=args.shared_pages, store_path=args.store
+    )
+    return 0 if summary["errors"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+import cv2
+import numpy as np
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from src.pyramid import build_pyramid
+
+# Page fields holding image arrays; they are stored as PNG bytes in the cache
+IMAGE_FIELDS = ("image", "ela_image")
+
+# Display pyramids (`src.pyramid`) built alongside each image field
+PYRAMID_FIELDS = tuple(f"{field}_pyramid" for field in IMAGE_FIELDS)
+
+# ELA maps are zoomed into to read their error levels, so their pyramids are
+# lossless; page images use the default lossy formats
+PYRAMID_FORMATS = {"ela_image": "png"}
+
+def default_cache_dir():
+    """Returns the shared on-disk cache location (override with FORGERY_CACHE_DIR)."""
+    return os.environ.get(
+        "FORGERY_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "document_forgery_detector")
+    )
+
+def encode_page_images(page):
+    """
+    Returns a copy of a page report with its image arrays encoded as PNG bytes.
+
+    PNG is lossless, so cached ELA maps are bit-exact, and the mostly-dark ELA
+    images compress very well. Each image also gets its display pyramid
+    (`<field>_pyramid`), built once here so the UI never has to touch the
+    full-resolution pixels again.
+
+    Args:
+        page (dict): A page entry from `analyze_document`.
+
+    Returns:
+        dict: The same entry with ndarray image fields replaced by PNG bytes,
+            plus the pyramids.
+    """
+    packed = dict(page)
+    for field in IMAGE_FIELDS:
+        value = packed.get(field)
+        pyramid_field = f"{field}_pyramid"
+        if value is not None and packed.get(pyramid_field) is None:
+            image = value if isinstance(value, np.ndarray) else decode_page_image(value)
+            packed[pyramid_field] = build_pyramid(image, image_format=PYRAMID_FORMATS.get(field))
+        if isinstance(value, np.ndarray):
+            success, buffer = cv2.imencode(".png", value)
+            if not success:
+                raise ValueError(f"Could not PNG-encode page {field} for caching")
+            packed[field] = buffer.tobytes()
+    return packed
+
+def decode_page_image(data):
+    """Decodes a PNG-encoded page image from the cache back to a BGR array."""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+class ResultCache:
+    """
+    Content-addressed cache of analysis reports.
+
+    Entries are keyed by the SHA-256 of the document bytes plus the analysis
+    parameters. A small in-process LRU sits in front of a size-bounded directory
+    of pickled reports that can be shared by the Streamlit app and batch workers;
+    the least recently used files are evicted once the directory exceeds
+    `max_bytes`. The directory size is tracked as an estimate (the last scan
+    plus this process's writes since), so it is only listed when the estimate
+    crosses the limit or enough has been written to warrant a fresh look at
+    what other processes added.
+    """
+
+    def __init__(self, directory=None, max_bytes=1024 * 1024 * 1024, memory_bytes=128 * 1024 * 1024):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        # Directory size as of the last scan plus bytes written since (None: not scanned yet)
+        self._disk_estimate = None
+        self._written_since_scan = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_bytes, **params):
+        """
+        Builds a cache key from the document content and analysis parameters.
+
+        Args:
+            file_bytes (bytes): The raw document content.
+            **params: Analysis parameters that affect the result (quality, dpi, ...).
+
+        Returns:
+            str: Hex digest identifying this document/parameter combination.
+        """
+        digest = hashlib.sha256(file_bytes).hexdigest()
+        settings = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(f"{digest}:{settings}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Looks a report up in memory, then on disk.
+
+        Args:
+            key (str): Key from `make_key`.
+
+        Returns:
+            dict: The cached report (page images as PNG bytes), or None on a miss.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry[0]
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Refresh the timestamp so eviction treats this entry as recently used
+            os.utime(path, None)
+        except OSError:
+            return None
+
+        try:
+            report = pickle.loads(data)
+        except Exception:
+            # A corrupt entry is treated as a miss and dropped
+            self._remove(path)
+            return None
+
+        self._remember(key, report, len(data))
+        return report
+
+    def put(self, key, report):
+        """
+        Stores a report in both tiers, evicting old disk entries if needed.
+
+        Args:
+            key (str): Key from `make_key`.
+            report (dict): Report from `analyze_document`; page image arrays
+                are PNG-encoded before storing.
+
+        Returns:
+            dict: The report as stored (page images as PNG bytes).
+        """
+        report = dict(report)
+        report["pages"] = [encode_page_images(page) for page in report.get("pages", [])]
+        data = pickle.dumps(report, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # Write atomically so concurrent readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            self._remove(temp_path)
+            raise
+
+        self._remember(key, report, len(data))
+        with self._lock:
+            if self._disk_estimate is not None:
+                self._disk_estimate += len(data)
+            self._written_since_scan += len(data)
+            # Other processes share the directory, so rescan after writing an eighth of the budget
+            needs_scan = self._disk_estimate is None or self._disk_estimate > self.max_bytes \
+                or self._written_since_scan > self.max_bytes // 8
+        if needs_scan:
+            self._evict()
+        return report
+
+    def clear(self):
+        """Removes every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                self._remove(os.path.join(self.directory, name))
+        with self._lock:
+            self._disk_estimate = 0
+            self._written_since_scan = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _remember(self, key, report, size):
+        """Adds a report to the in-memory LRU tier, respecting its byte budget."""
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_used -= previous[1]
+            self._memory[key] = (report, size)
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_used -= evicted_size
+
+    def _evict(self):
+        """Scans the directory and deletes least recently used files until it fits `max_bytes`."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pkl"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                self._remove(path)
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+        with self._lock:
+            self._disk_estimate = total
+            self._written_since_scan = 0
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -1,11 +1,31 @@
 import numpy as np
 import cv2
-from pdf2image import convert_from_bytes
-from docx import Document
+from pdf2image import convert_from_bytes, convert_from_path, pdfinfo_from_bytes
+from pypdf.generic import ContentStream
+from collections import namedtuple
 import io
 import os
 import shutil
+import tempfile
 from PIL import Image
+from src import instrumentation
+from src.document import ParsedDocument
+
+# A single document page: 1-based page number, BGR image, where the pixels came
+# from ("render" via Poppler or "embedded" image XObject) and, for embedded
+# JPEGs, the original encoded bytes with their compression history intact
+PageImage = namedtuple("PageImage", ["page_number", "image", "source", "encoded"], defaults=("render", None))
+
+# Content stream operators allowed on a page that only paints one image
+IMAGE_ONLY_OPERATORS = {b"q", b"Q", b"cm", b"Do", b"gs"}
+
+# Operators of a text layer, and colour operators that paint nothing by
+# themselves. OCR'd scans carry the recognised text in render mode 3
+# (invisible) on top of the page image
+TEXT_OPERATORS = {b"BT", b"ET", b"Tf", b"Tr", b"Tc", b"Tw", b"Tz", b"TL", b"Ts", b"Td", b"TD", b"Tm", b"T*"}
+TEXT_SHOWING_OPERATORS = {b"Tj", b"TJ", b"'", b'"'}
+COLOR_OPERATORS = {b"g", b"G", b"rg", b"RG", b"k", b"K", b"cs", b"CS", b"sc", b"SC", b"scn", b"SCN"}
+INVISIBLE_TEXT = 3
 
 class DocumentProcessor:
     """Class to handle conversion of various document formats to images for analysis."""
@@ -19,7 +39,7 @@ class DocumentProcessor:
         pdftoppm_path = shutil.which("pdftoppm")
         if pdftoppm_path:
             path = os.path.dirname(pdftoppm_path)
-            print(f"[DEBUG] Found Poppler in PATH: {path}")
+            instrumentation.event("poppler.located", path=path, source="PATH")
             return path
             
         # 2. Check common installation paths
@@ -42,23 +62,31 @@ class DocumentProcessor:
         
         for path in common_paths:
             if os.path.exists(os.path.join(path, "pdftoppm.exe")):
-                print(f"[DEBUG] Found Poppler in common path: {path}")
+                instrumentation.event("poppler.located", path=path, source="common")
                 return path
             
-        print("[DEBUG] Poppler not found in PATH or common locations.")
+        instrumentation.event("poppler.missing")
         return None
 
+    @instrumentation.traced("convert.pdf")
     def process_pdf(self, file_bytes):
         """
         Convert the first page of a PDF to a Numpy image array.
         
         Args:
-            file_bytes (bytes): The bytes content of the PDF file.
+            file_bytes (bytes or ParsedDocument): The bytes content of the PDF file.
             
         Returns:
             numpy.ndarray: The converted image in BGR format (OpenCV compatible).
         """
+        document = ParsedDocument.wrap(file_bytes)
+        file_bytes = document.file_bytes
         try:
+            # Scanner output: take the embedded JPEG as-is instead of rendering
+            embedded = self._extract_embedded_page(self._open_pdf_reader(document), 1)
+            if embedded is not None:
+                return embedded.image
+
             # Detect poppler path on Windows
             poppler_path = self._get_poppler_path()
             
@@ -86,56 +114,343 @@ class DocumentProcessor:
             return numpy_image
 
         except Exception as e:
-            error_msg = str(e)
-            if "poppler" in error_msg.lower() or "page count" in error_msg.lower():
-                raise RuntimeError(
-                    f"Failed to process PDF: {error_msg}\n\n"
-                    "Poppler utilities are required for PDF processing.\n"
-                    "Please see POPPLER_SETUP.md for installation instructions.\n"
-                    "Quick fix: Install via Scoop with 'scoop install poppler'"
+            raise self._pdf_error(e)
+
+    def iter_pdf_pages(self, file_bytes, dpi=300, chunk_size=4, first_page=1, last_page=None, prefer_embedded=True,
+                       pages=None):
+        """
+        Lazily yield the pages of a PDF as images, one page at a time.
+        
+        Pages that consist of a single full-page JPEG (typical scanner output) are
+        taken byte-for-byte from the embedded image XObject, which is much faster
+        than rendering and keeps the original compression history that ELA relies
+        on. Such pages are returned in the image's native orientation. All other
+        pages are rasterized by Poppler in chunks written to a private temporary
+        folder (`paths_only`) and read back and deleted one by one, so only a
+        single decoded page is held in memory regardless of document length.
+        
+        Args:
+            file_bytes (bytes or ParsedDocument): The bytes content of the PDF file.
+                A ParsedDocument lets the fast path reuse an existing pypdf parse.
+            dpi (int): Rendering resolution for rasterized pages (default 300).
+            chunk_size (int): Maximum number of pages Poppler renders per invocation.
+            first_page (int): First page to yield (1-based).
+            last_page (int): Last page to yield (default: the final page).
+            prefer_embedded (bool): Use embedded page images when possible.
+            pages (iterable): Optional 1-based page numbers to yield, e.g. the
+                pages changed by later revisions. Other pages are never rendered.
+            
+        Yields:
+            PageImage: The page number, its image in BGR format and its source.
+        """
+        document = ParsedDocument.wrap(file_bytes)
+        file_bytes = document.file_bytes
+        reader = self._open_pdf_reader(document) if prefer_embedded else None
+        if reader is not None:
+            page_count = len(reader.pages)
+        else:
+            page_count = self._pdf_page_count(file_bytes)
+
+        if page_count == 0:
+            raise RuntimeError("Failed to process PDF: No pages found in PDF.")
+        last_page = min(last_page or page_count, page_count)
+        page_numbers = range(first_page, last_page + 1)
+        if pages is not None:
+            page_numbers = sorted(set(pages).intersection(page_numbers))
+
+        with tempfile.TemporaryDirectory(prefix="forgery_pages_") as output_folder:
+            # Poppler reads the PDF from this file, written once when the first
+            # page needs rendering and shared by every chunk
+            source_path = os.path.join(output_folder, "source.pdf")
+            # Consecutive pages that need rendering are batched into one Poppler call
+            pending = []
+            for page_number in page_numbers:
+                if pending and page_number != pending[-1] + 1:
+                    # Poppler renders a contiguous range; flush before a gap
+                    yield from self._render_pages(file_bytes, pending, dpi, output_folder, source_path)
+                    pending = []
+                page = self._extract_embedded_page(reader, page_number)
+                if page is None:
+                    pending.append(page_number)
+                    if len(pending) < chunk_size:
+                        continue
+
+                yield from self._render_pages(file_bytes, pending, dpi, output_folder, source_path)
+                pending = []
+                if page is not None:
+                    yield page
+
+            yield from self._render_pages(file_bytes, pending, dpi, output_folder, source_path)
+
+    def _open_pdf_reader(self, document):
+        """Returns the document's PdfReader for the fast path, or None if pypdf can't parse the file."""
+        try:
+            return ParsedDocument.wrap(document).pdf_reader
+        except Exception:
+            return None
+
+    def _pdf_page_count(self, file_bytes):
+        """Asks Poppler for the page count of a PDF."""
+        try:
+            info = pdfinfo_from_bytes(file_bytes, poppler_path=self._get_poppler_path())
+        except Exception as e:
+            raise self._pdf_error(e)
+        return int(info.get("Pages", 0))
+
+    @instrumentation.traced("convert.pdf.embedded")
+    def _extract_embedded_page(self, reader, page_number):
+        """
+        Returns the page's embedded JPEG as a PageImage if the page is a single full-page image.
+        
+        An invisible OCR text layer (render mode 3, directly in the page or in
+        a form XObject) is allowed, so searchable scans take this path too.
+        Returns None (meaning "render this page") for vector pages, visible
+        text, mixed pages, masked images, and image encodings other than
+        baseline RGB/gray JPEG.
+        """
+        if reader is None:
+            return None
+
+        try:
+            page = reader.pages[page_number - 1]
+            resources = page.get("/Resources")
+            resources = resources.get_object() if resources is not None else {}
+
+            xobjects = resources.get("/XObject")
+            xobjects = xobjects.get_object() if xobjects is not None else {}
+            images, forms = {}, set()
+            for name, xobject in xobjects.items():
+                xobject = xobject.get_object()
+                if xobject.get("/Subtype") == "/Image":
+                    images[name] = xobject
+                elif xobject.get("/Subtype") == "/Form" and self._draws_invisible_text_only(xobject, reader):
+                    forms.add(name)
+                else:
+                    return None
+            if len(images) != 1:
+                return None
+
+            image_name, image = next(iter(images.items()))
+            if "/SMask" in image or "/Mask" in image:
+                return None
+            if image.get("/ColorSpace") not in ("/DeviceRGB", "/DeviceGray"):
+                return None
+
+            # The stream may be wrapped (e.g. Flate over DCT); the JPEG must come last
+            filters = image.get("/Filter")
+            if not isinstance(filters, list):
+                filters = [filters]
+            if not filters or filters[-1] != "/DCTDecode":
+                return None
+
+            if not self._paints_full_page(page, reader, image_name, forms):
+                return None
+
+            # get_data() undoes any outer filters and passes DCT data through untouched
+            jpeg_bytes = image.get_data()
+            bgr_image = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+            if bgr_image is None:
+                return None
+
+            return PageImage(page_number, bgr_image, "embedded", jpeg_bytes)
+
+        except Exception:
+            return None
+
+    def _paints_full_page(self, page, reader, image_name, forms=(), min_coverage=0.9):
+        """
+        Checks that the page content only places one image covering (almost) the whole page.
+
+        Besides the image, the content may only hold invisible text and the
+        `forms` already checked by `_draws_invisible_text_only`.
+        """
+        operations = ContentStream(page.get_contents(), reader).operations
+        if not operations:
+            return False
+
+        # Track the current transformation matrix as (a, b, c, d) and the text
+        # render mode through q/Q nesting
+        ctm = (1.0, 0.0, 0.0, 1.0)
+        render_mode = 0
+        stack = []
+        painted_area = 0.0
+        for operands, operator in operations:
+            if operator == b"q":
+                stack.append((ctm, render_mode))
+            elif operator == b"Q":
+                ctm, render_mode = stack.pop() if stack else (ctm, render_mode)
+            elif operator == b"cm":
+                a, b, c, d = (float(v) for v in operands[:4])
+                ca, cb, cc, cd = ctm
+                ctm = (a * ca + b * cc, a * cb + b * cd, c * ca + d * cc, c * cb + d * cd)
+            elif operator == b"Tr":
+                render_mode = int(operands[0])
+            elif operator == b"Do":
+                if operands[0] == image_name:
+                    # The unit square maps to a parallelogram with this area
+                    painted_area = abs(ctm[0] * ctm[3] - ctm[1] * ctm[2])
+                elif operands[0] not in forms:
+                    return False
+            elif operator in TEXT_SHOWING_OPERATORS:
+                if render_mode != INVISIBLE_TEXT:
+                    return False
+            elif operator not in IMAGE_ONLY_OPERATORS | TEXT_OPERATORS | COLOR_OPERATORS:
+                return False
+
+        page_area = float(page.mediabox.width) * float(page.mediabox.height)
+        return page_area > 0 and painted_area >= min_coverage * page_area
+
+    def _draws_invisible_text_only(self, form, reader):
+        """Checks that a form XObject only holds invisible text, like the OCR layer some tools add."""
+        render_mode = 0
+        stack = []
+        for operands, operator in ContentStream(form, reader).operations:
+            if operator == b"q":
+                stack.append(render_mode)
+            elif operator == b"Q":
+                render_mode = stack.pop() if stack else render_mode
+            elif operator == b"Tr":
+                render_mode = int(operands[0])
+            elif operator in TEXT_SHOWING_OPERATORS:
+                if render_mode != INVISIBLE_TEXT:
+                    return False
+            elif operator not in {b"cm", b"gs"} | TEXT_OPERATORS | COLOR_OPERATORS:
+                return False
+        return True
+
+    def _render_pages(self, file_bytes, page_numbers, dpi, output_folder, source_path):
+        """
+        Rasterizes a contiguous run of pages with Poppler, yielding them one at a time.
+
+        The PDF is written to `source_path` on the first call and reused by
+        later ones, so a long document is copied to disk once rather than
+        once per chunk.
+        """
+        if not page_numbers:
+            return
+
+        first_page, last_page = page_numbers[0], page_numbers[-1]
+        if not os.path.exists(source_path):
+            with open(source_path, "wb") as f:
+                f.write(file_bytes)
+        # Only the Poppler call is timed: the loop below yields to the caller
+        with instrumentation.span("convert.pdf.render", bytes_in=len(file_bytes), pages=len(page_numbers), dpi=dpi):
+            try:
+                paths = convert_from_path(
+                    source_path,
+                    dpi=dpi,
+                    first_page=first_page,
+                    last_page=last_page,
+                    output_folder=output_folder,
+                    paths_only=True,
+                    poppler_path=self._get_poppler_path()
                 )
-            raise RuntimeError(f"Failed to process PDF: {error_msg}")
+            except Exception as e:
+                raise self._pdf_error(e)
+
+        # pdf2image returns the chunk's files sorted in page order
+        for page_number, path in enumerate(sorted(paths), start=first_page):
+            bgr_image = cv2.imread(path, cv2.IMREAD_COLOR)
+            os.remove(path)
+            if bgr_image is None:
+                raise RuntimeError(f"Failed to process PDF: Could not read rendered page {page_number}.")
+            yield PageImage(page_number, bgr_image)
+
+    def _pdf_error(self, exc):
+        """Wraps a PDF conversion failure, pointing at Poppler setup when relevant."""
+        error_msg = str(exc)
+        if "poppler" in error_msg.lower() or "page count" in error_msg.lower():
+            return RuntimeError(
+                f"Failed to process PDF: {error_msg}\n\n"
+                "Poppler utilities are required for PDF processing.\n"
+                "Please see POPPLER_SETUP.md for installation instructions.\n"
+                "Quick fix: Install via Scoop with 'scoop install poppler'"
+            )
+        return RuntimeError(f"Failed to process PDF: {error_msg}")
 
     def process_word(self, file_bytes):
         """
         Extract the largest embedded image from a .docx file.
         
         Args:
-            file_bytes (bytes): The bytes content of the Word file.
+            file_bytes (bytes or ParsedDocument): The bytes content of the Word file.
             
         Returns:
             numpy.ndarray: The largest image found in BGR format.
         """
-        try:
-            doc = Document(io.BytesIO(file_bytes))
-            largest_image = None
-            max_size = 0
-            
-            # doc.inline_shapes contains embedded images
-            for shape in doc.inline_shapes:
-                if shape._inline.graphic.graphicData.pic is not None:
-                    # Get the image bytes
-                    image_part = shape._inline.graphic.graphicData.pic.blipFill.blip.embed
-                    image_blob = doc.part.related_parts[image_part].blob
-                    
-                    # Open with PIL to check size
-                    img = Image.open(io.BytesIO(image_blob))
-                    width, height = img.size
-                    size = width * height
-                    
-                    if size > max_size:
-                        max_size = size
-                        # Convert to OpenCV format (BGR)
-                        numpy_image = np.array(img)
-                        if len(numpy_image.shape) == 3:
-                            largest_image = cv2.cvtColor(numpy_image, cv2.COLOR_RGB2BGR)
-                        else:
-                            largest_image = numpy_image
+        return self.extract_word_images(file_bytes, top_k=1)[0]
+
+    @instrumentation.traced("convert.docx")
+    def extract_word_images(self, file_bytes, top_k=1):
+        """
+        Extract the largest embedded images from a .docx file, largest first.
+        
+        Candidates are ranked by dimensions read from the image headers only, and
+        just the `top_k` winners are fully decoded. Both inline and floating
+        (anchored) pictures are considered, since both are image parts related to
+        the main document part.
+        
+        Args:
+            file_bytes (bytes or ParsedDocument): The bytes content of the Word file.
+            top_k (int): Number of images to decode (default 1).
             
-            if largest_image is None:
+        Returns:
+            list: Up to `top_k` images in BGR format, largest first.
+        """
+        try:
+            doc = ParsedDocument.wrap(file_bytes).docx
+
+            # Phase 1: rank by header dimensions without decoding any pixels
+            candidates = self._word_image_candidates(doc)
+            if not candidates:
                 raise ValueError("No images found in Word document.")
-            
-            return largest_image
+            candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+            # Phase 2: fully decode only the winners
+            images = []
+            for _, blob in candidates:
+                image = self._decode_image_blob(blob)
+                if image is not None:
+                    images.append(image)
+                if len(images) == top_k:
+                    break
+
+            if not images:
+                raise ValueError("No decodable images found in Word document.")
+
+            return images
 
         except Exception as e:
             raise RuntimeError(f"Failed to process Word document: {str(e)}")
+
+    def _word_image_candidates(self, doc):
+        """Returns (pixel count, blob) for every distinct image part of the document body."""
+        candidates = []
+        seen = set()
+        for rel in doc.part.rels.values():
+            if rel.is_external or not rel.reltype.endswith("/image"):
+                continue
+            part = rel.target_part
+            if part.partname in seen:
+                continue
+            seen.add(part.partname)
+
+            # PIL only parses the header on open; pixels are not decoded here
+            try:
+                width, height = Image.open(io.BytesIO(part.blob)).size
+            except Exception:
+                # Formats PIL can't identify (e.g. EMF/WMF) can't be analyzed anyway
+                continue
+            candidates.append((width * height, part.blob))
+        return candidates
+
+    def _decode_image_blob(self, blob):
+        """Decodes an embedded image to BGR, falling back to PIL for formats OpenCV lacks."""
+        image = cv2.imdecode(np.frombuffer(blob, np.uint8), cv2.IMREAD_COLOR)
+        if image is not None:
+            return image
+        try:
+            rgb_image = np.array(Image.open(io.BytesIO(blob)).convert("RGB"))
+        except Exception:
+            return None
+        return cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
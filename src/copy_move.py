@@ -0,0 +1,343 @@
+import cv2
+import numpy as np
+import time
+from src import instrumentation
+
+# FLANN index parameters for binary (ORB) descriptors: multi-probe LSH
+FLANN_INDEX_LSH = 6
+
+class CopyMoveDetector:
+    """
+    Class to find regions cloned from elsewhere in the same image.
+
+    A stamp, signature or digit copied within a page produces many keypoints
+    whose descriptors match each other under one common displacement. Keypoints
+    are matched against the image itself through an approximate nearest
+    neighbour (LSH) index instead of all-pairs comparison, matches are grouped
+    by displacement, and each group is confirmed by correlating the two regions.
+    All of this runs on one downscaled pyramid level; only the reported boxes
+    are mapped back to full resolution.
+
+    Documents repeat themselves legitimately: the same words recur on many
+    lines of a statement, always shifted by a multiple of the line spacing.
+    Each displacement group is split into spatial clusters that are confirmed
+    separately. When the displacement recurs across many clusters or moves
+    content straight down by whole text lines, a cluster only counts if the
+    matched region holds something taller than a line of text, such as a
+    stamp or signature.
+    """
+
+    def __init__(self, max_side=1600, max_keypoints=8000, grid_cells=8, max_hamming=40, ratio=0.8,
+                 min_offset=16, min_matches=8, offset_bin=4, min_similarity=0.9, time_budget=3.0,
+                 max_clusters=4, cluster_gap=32, ink_contrast=40):
+        """
+        Args:
+            max_side (int): Longest side of the downscaled analysis image.
+            max_keypoints (int): ORB keypoint budget.
+            grid_cells (int): The budget is spread over a grid_cells x grid_cells
+                grid so dense text can't starve flatter areas such as stamps.
+            max_hamming (int): Largest descriptor distance treated as a match.
+            ratio (float): Best match must beat the next candidate by this ratio.
+            min_offset (int): Smallest displacement (analysis pixels) considered,
+                which ignores matches between a keypoint and its own neighbourhood.
+            min_matches (int): Matches needed for one displacement to count as a clone.
+            offset_bin (int): Displacement quantisation (analysis pixels).
+            min_similarity (float): Normalised correlation needed to confirm a pair.
+            time_budget (float): Seconds after which confirmation stops early.
+            max_clusters (int): A displacement group whose source points fall
+                into this many separate clusters is treated as repeated content.
+            cluster_gap (int): Distance (analysis pixels) separating two clusters.
+            ink_contrast (int): Gray levels below the paper that count as ink
+                when measuring text lines.
+        """
+        self.max_side = max_side
+        self.max_keypoints = max_keypoints
+        self.grid_cells = grid_cells
+        self.max_hamming = max_hamming
+        self.ratio = ratio
+        self.min_offset = min_offset
+        self.min_matches = min_matches
+        self.offset_bin = offset_bin
+        self.min_similarity = min_similarity
+        self.time_budget = time_budget
+        self.max_clusters = max_clusters
+        self.cluster_gap = cluster_gap
+        self.ink_contrast = ink_contrast
+
+    @instrumentation.traced("copy_move.detect")
+    def detect(self, image):
+        """
+        Detect copy-moved regions in an image.
+
+        Args:
+            image (numpy.ndarray): The input image in BGR or grayscale format.
+
+        Returns:
+            dict: 'pairs' (each with 'source' and 'target' boxes as x, y, width,
+                height in full-resolution pixels, the 'offset', supporting
+                'matches' and the confirming 'similarity'), plus 'keypoints',
+                'matches', 'scale', 'line_pitch' (text line spacing in analysis
+                pixels, or None), 'elapsed' and 'truncated' (True if the time
+                budget cut confirmation short).
+        """
+        start = time.perf_counter()
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+        # Working on a downscaled pyramid level keeps keypoint count and
+        # matching time bounded on 300-DPI pages
+        scale = min(1.0, self.max_side / max(gray.shape[:2]))
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else gray
+
+        keypoints, descriptors = self._detect_keypoints(small)
+        ink = small < np.percentile(small, 90) - self.ink_contrast
+        pitch = self._line_pitch(ink)
+        result = {
+            "pairs": [],
+            "keypoints": len(keypoints),
+            "matches": 0,
+            "scale": scale,
+            "line_pitch": pitch,
+            "elapsed": 0.0,
+            "truncated": False,
+        }
+        if descriptors is None or len(keypoints) < self.min_matches * 2:
+            result["elapsed"] = time.perf_counter() - start
+            return result
+
+        points = np.float32([kp.pt for kp in keypoints])
+        sources, targets = self._self_match(descriptors, points)
+        result["matches"] = len(sources)
+
+        for src, dst, offset in self._group_by_offset(sources, targets):
+            if time.perf_counter() - start > self.time_budget:
+                result["truncated"] = True
+                break
+            labels = self._cluster_labels(src)
+            repeated = labels.max() + 1 >= self.max_clusters or self._on_line_pitch(offset, pitch)
+            for label in range(labels.max() + 1):
+                if time.perf_counter() - start > self.time_budget:
+                    result["truncated"] = True
+                    break
+                members = labels == label
+                matches = len(np.unique(src[members], axis=0))
+                if min(matches, len(np.unique(dst[members], axis=0))) < self.min_matches:
+                    continue
+                pair = self._confirm(small, src[members], dst[members], offset)
+                if pair is None or (repeated and not self._taller_than_text(ink, pair["source"], pitch)):
+                    continue
+                pair["matches"] = matches
+                self._merge_pair(result["pairs"], pair)
+
+        for pair in result["pairs"]:
+            for key in ("source", "target", "offset"):
+                pair[key] = tuple(int(round(v / scale)) for v in pair[key])
+
+        result["pairs"].sort(key=lambda pair: pair["matches"], reverse=True)
+        result["elapsed"] = time.perf_counter() - start
+        return result
+
+    def _detect_keypoints(self, gray):
+        """Detects ORB keypoints spread over a grid, keeping the strongest per cell."""
+        orb = cv2.ORB_create(nfeatures=self.max_keypoints * 4)
+        keypoints = orb.detect(gray, None)
+        if not keypoints:
+            return [], None
+
+        points = np.float32([kp.pt for kp in keypoints])
+        responses = np.float32([kp.response for kp in keypoints])
+        cell_x = np.minimum((points[:, 0] * self.grid_cells / gray.shape[1]).astype(np.intp), self.grid_cells - 1)
+        cell_y = np.minimum((points[:, 1] * self.grid_cells / gray.shape[0]).astype(np.intp), self.grid_cells - 1)
+        cells = cell_y * self.grid_cells + cell_x
+
+        # Rank keypoints by response within each cell and keep the top of each
+        order = np.lexsort((-responses, cells))
+        sorted_cells = cells[order]
+        first_in_cell = np.searchsorted(sorted_cells, sorted_cells, side="left")
+        rank = np.arange(len(order)) - first_in_cell
+        per_cell = max(1, self.max_keypoints // (self.grid_cells * self.grid_cells))
+        selected = order[rank < per_cell]
+
+        return orb.compute(gray, [keypoints[i] for i in selected])
+
+    def _self_match(self, descriptors, points):
+        """Matches every descriptor against all others through an LSH index."""
+        matcher = cv2.FlannBasedMatcher(
+            dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1),
+            dict(checks=64)
+        )
+        # The nearest neighbour of each descriptor is normally itself, so ask for
+        # two more to get a best candidate and a runner-up for the ratio test
+        knn = matcher.knnMatch(descriptors, descriptors, k=3)
+
+        sources, targets = [], []
+        for query, neighbours in enumerate(knn):
+            others = [m for m in neighbours if m.trainIdx != query]
+            if not others or others[0].distance > self.max_hamming:
+                continue
+            if len(others) > 1 and others[0].distance >= self.ratio * others[1].distance:
+                continue
+            sources.append(query)
+            targets.append(others[0].trainIdx)
+
+        if not sources:
+            return np.empty((0, 2), np.float32), np.empty((0, 2), np.float32)
+        return points[sources], points[targets]
+
+    def _group_by_offset(self, sources, targets):
+        """Yields (source points, target points, median offset) for every well-supported displacement; row i of both is one match."""
+        if len(sources) == 0:
+            return
+
+        offsets = targets - sources
+        # A->B and B->A describe the same clone; orient every match the same way
+        flip = (offsets[:, 0] < 0) | ((offsets[:, 0] == 0) & (offsets[:, 1] < 0))
+        sources, targets = np.where(flip[:, None], targets, sources), np.where(flip[:, None], sources, targets)
+        offsets = targets - sources
+
+        distant = np.hypot(offsets[:, 0], offsets[:, 1]) >= self.min_offset
+        sources, targets, offsets = sources[distant], targets[distant], offsets[distant]
+        if len(offsets) == 0:
+            return
+
+        bins = np.round(offsets / self.offset_bin).astype(np.int64)
+        keys, inverse, counts = np.unique(bins, axis=0, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+
+        # Mutual matches land in the same bin twice, so count distinct source points
+        for key in np.flatnonzero(counts >= self.min_matches)[np.argsort(-counts[counts >= self.min_matches])]:
+            members = inverse == key
+            matches = np.unique(np.hstack([sources[members], targets[members]]), axis=0)
+            src, dst = matches[:, :2], matches[:, 2:]
+            if min(len(np.unique(src, axis=0)), len(np.unique(dst, axis=0))) >= self.min_matches:
+                yield src, dst, np.median(offsets[members], axis=0)
+
+    def _line_pitch(self, ink, min_pitch=8, min_correlation=0.3):
+        """
+        Spacing of regularly repeated text lines, from the autocorrelation of the row ink profile.
+
+        Returns:
+            float: The pitch in analysis pixels, or None if lines don't repeat regularly.
+        """
+        profile = ink.mean(axis=1)
+        # Filled bands (headers, table shading) would swamp the line rhythm
+        profile = np.minimum(profile, 2 * np.percentile(profile, 75) + 1e-3)
+        profile = profile - profile.mean()
+        energy = float(profile @ profile)
+        if energy <= 0 or len(profile) < 4 * min_pitch:
+            return None
+
+        spectrum = np.fft.rfft(profile, 2 * len(profile))
+        correlation = np.fft.irfft(spectrum * np.conj(spectrum))[:len(profile) // 4 + 1] / energy
+        for lag in range(min_pitch, len(correlation) - 1):
+            left, peak, right = correlation[lag - 1:lag + 2]
+            if peak > min_correlation and peak >= left and peak >= right:
+                # Sub-pixel peak, so whole-line multiples stay accurate far down the page
+                curvature = left - 2 * peak + right
+                return float(lag + (0.5 * (left - right) / curvature if curvature < 0 else 0.0))
+        return None
+
+    def _cluster_labels(self, points):
+        """
+        Labels the groups the points form when linked within about `cluster_gap`, numbered from 0.
+
+        Points are binned into cells `cluster_gap` wide and touching occupied
+        cells are joined, so points closer than the gap always share a label;
+        this stays linear in the point count on repetitive backgrounds.
+        """
+        cells = (points // self.cluster_gap).astype(np.intp)
+        cells -= cells.min(axis=0)
+        occupied = np.zeros((cells[:, 1].max() + 1, cells[:, 0].max() + 1), dtype=np.uint8)
+        occupied[cells[:, 1], cells[:, 0]] = 1
+        _, components = cv2.connectedComponents(occupied, connectivity=8)
+        _, labels = np.unique(components[cells[:, 1], cells[:, 0]], return_inverse=True)
+        return labels.ravel()
+
+    def _on_line_pitch(self, offset, pitch):
+        """Whether a displacement moves content straight down by a whole number of text lines."""
+        if pitch is None or abs(offset[0]) > 2 * self.offset_bin:
+            return False
+        lines = round(abs(offset[1]) / pitch)
+        return lines >= 1 and abs(abs(offset[1]) - lines * pitch) <= self.offset_bin + 0.01 * abs(offset[1])
+
+    def _taller_than_text(self, ink, box, pitch):
+        """Whether the box holds ink running unbroken over more than one line spacing, e.g. a stamp or logo."""
+        # Without regular lines, take a generous line height
+        pitch = pitch or 2 * self.cluster_gap
+        x, y, w, h = box
+        inked_rows = ink[y:y + h, x:x + w].any(axis=1)
+        longest = run = 0
+        for inked in inked_rows:
+            run = run + 1 if inked else 0
+            longest = max(longest, run)
+        return longest > pitch
+
+    def _confirm(self, gray, src, dst, offset):
+        """Verifies a candidate pair by correlating the two regions in the analysis image."""
+        sx, sy, sw, sh = cv2.boundingRect(src.astype(np.float32))
+        dx, dy, dw, dh = cv2.boundingRect(dst.astype(np.float32))
+
+        # Keypoints sit inside features; pad the boxes to cover the whole object
+        pad = max(4, int(0.1 * max(sw, sh)))
+        source = self._clip_box(sx - pad, sy - pad, sw + 2 * pad, sh + 2 * pad, gray.shape)
+        if source is None:
+            return None
+        x, y, w, h = source
+        template = gray[y:y + h, x:x + w]
+        if template.std() < 1.0:
+            return None
+
+        # Search for the template around the predicted target location
+        offset_x, offset_y = offset
+        margin = pad * 2
+        window = self._clip_box(
+            int(x + offset_x) - margin, int(y + offset_y) - margin, w + 2 * margin, h + 2 * margin, gray.shape
+        )
+        if window is None or window[2] < w or window[3] < h:
+            return None
+        wx, wy, ww, wh = window
+        response = cv2.matchTemplate(gray[wy:wy + wh, wx:wx + ww], template, cv2.TM_CCOEFF_NORMED)
+        _, similarity, _, location = cv2.minMaxLoc(response)
+        if similarity < self.min_similarity:
+            return None
+
+        tx, ty = wx + location[0], wy + location[1]
+        # Overlapping boxes are self-similar texture, not a clone
+        if abs(tx - x) < w and abs(ty - y) < h:
+            return None
+
+        return {
+            "source": (int(x), int(y), int(w), int(h)),
+            "target": (int(tx), int(ty), int(w), int(h)),
+            "offset": (int(tx - x), int(ty - y)),
+            "similarity": float(similarity),
+        }
+
+    def _merge_pair(self, pairs, pair):
+        """Adds a confirmed pair, folding it into an existing one describing the same clone."""
+        for existing in pairs:
+            same_offset = all(
+                abs(a - b) <= 2 * self.offset_bin for a, b in zip(existing["offset"], pair["offset"])
+            )
+            if same_offset and self._overlaps(existing["source"], pair["source"]):
+                existing["source"] = self._union(existing["source"], pair["source"])
+                existing["target"] = self._union(existing["target"], pair["target"])
+                existing["matches"] += pair["matches"]
+                existing["similarity"] = max(existing["similarity"], pair["similarity"])
+                return
+        pairs.append(pair)
+
+    def _overlaps(self, a, b):
+        return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+    def _union(self, a, b):
+        x0, y0 = min(a[0], b[0]), min(a[1], b[1])
+        x1, y1 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+        return x0, y0, x1 - x0, y1 - y0
+
+    def _clip_box(self, x, y, w, h, shape):
+        """Clips a box to the image, returning None if nothing is left."""
+        x0, y0 = max(int(x), 0), max(int(y), 0)
+        x1, y1 = min(int(x + w), shape[1]), min(int(y + h), shape[0])
+        if x1 - x0 < 8 or y1 - y0 < 8:
+            return None
+        return x0, y0, x1 - x0, y1 - y0
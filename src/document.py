@@ -0,0 +1,89 @@
+from pypdf import PdfReader
+from docx import Document
+from src import instrumentation
+from src.pdf_structure import PdfStructure
+import hashlib
+import io
+
+class ParsedDocument:
+    """
+    An uploaded document whose container is parsed at most once.
+
+    The metadata scanner, revision analysis and the converter all need the
+    parsed PDF or DOCX structure. Passing one ParsedDocument to each means the
+    xref table or the ZIP/XML package is only parsed once per upload, on first
+    use.
+    """
+
+    def __init__(self, file_bytes, filename=None):
+        """
+        Args:
+            file_bytes (bytes): The raw document content.
+            filename (str): Optional original file name, kept for reporting.
+        """
+        self.file_bytes = bytes(file_bytes)
+        self.filename = filename
+        self._pdf_reader = None
+        self._pdf_structure = None
+        self._docx = None
+        self._sha256 = None
+
+    @classmethod
+    def wrap(cls, source, filename=None):
+        """
+        Returns `source` unchanged if it is already a ParsedDocument, else wraps it.
+
+        Args:
+            source (ParsedDocument, bytes or file-like): The document.
+            filename (str): Optional original file name.
+
+        Returns:
+            ParsedDocument: A parsed-document handle for `source`.
+        """
+        if isinstance(source, cls):
+            return source
+        if hasattr(source, "read"):
+            source.seek(0)
+            data = source.read()
+            source.seek(0)
+            return cls(data, filename)
+        return cls(source, filename)
+
+    @property
+    def kind(self):
+        """'pdf', 'docx' or 'image', sniffed from the magic bytes."""
+        if self.file_bytes.startswith(b'%PDF'):
+            return 'pdf'
+        if self.file_bytes.startswith(b'PK'):
+            return 'docx'
+        return 'image'
+
+    @property
+    def sha256(self):
+        """Hex SHA-256 digest of the raw bytes, computed on first access."""
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.file_bytes).hexdigest()
+        return self._sha256
+
+    @property
+    def pdf_reader(self):
+        """The pypdf reader for this document, created on first access."""
+        if self._pdf_reader is None:
+            with instrumentation.span("parse.pdf", bytes_in=len(self.file_bytes)):
+                self._pdf_reader = PdfReader(io.BytesIO(self.file_bytes))
+        return self._pdf_reader
+
+    @property
+    def pdf_structure(self):
+        """The lazily parsed PdfStructure over the raw bytes, created on first access."""
+        if self._pdf_structure is None:
+            self._pdf_structure = PdfStructure(memoryview(self.file_bytes))
+        return self._pdf_structure
+
+    @property
+    def docx(self):
+        """The python-docx Document for this document, created on first access."""
+        if self._docx is None:
+            with instrumentation.span("parse.docx", bytes_in=len(self.file_bytes)):
+                self._docx = Document(io.BytesIO(self.file_bytes))
+        return self._docx
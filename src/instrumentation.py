@@ -0,0 +1,486 @@
+"""
+Per-stage timing and memory instrumentation.
+
+Stages are wrapped in spans that record wall time, bytes in and out, image
+dimensions and, when memory tracking is on, the peak Python/NumPy allocation
+inside the span. Nothing is recorded until an exporter is configured, so the
+default cost of a traced call is one list check.
+
+Typical setup, once per process:
+
+    from src import instrumentation
+    instrumentation.configure([instrumentation.LoggingExporter()])
+
+or from the environment with `configure_from_env()`.
+"""
+import numpy as np
+from contextvars import ContextVar
+import atexit
+import cProfile
+import functools
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the Prometheus duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_exporters = []
+_started_tracemalloc = False
+_current_span = ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+class Span:
+    """
+    One timed stage. Use as a context manager; attributes may be added while it runs.
+
+    Attributes:
+        name (str): Stage name, dotted by component (e.g. 'convert.pdf.render').
+        span_id (int): Process-unique id.
+        parent (Span): Enclosing span in the same thread, or None for a root.
+        attributes (dict): Recorded values (bytes_in, width, peak_alloc, ...).
+        duration (float): Wall time in seconds, set on exit.
+        error (str): Exception type name if the stage raised.
+    """
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent = None
+        self.attributes = attributes
+        self.start_time = None
+        self.duration = None
+        self.error = None
+        self._token = None
+        self._start = None
+        self._alloc_base = None
+        self._alloc_peak = 0
+
+    @property
+    def root(self):
+        """The outermost span this one belongs to."""
+        span = self
+        while span.parent is not None:
+            span = span.parent
+        return span
+
+    def set(self, **attributes):
+        """Adds or overwrites attributes."""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # reset_peak() is shared by every span, so hand the peak seen so
+            # far to the parent before clearing it
+            if self.parent is not None:
+                self.parent._alloc_peak = max(self.parent._alloc_peak, peak)
+            tracemalloc.reset_peak()
+            self._alloc_base = current
+            self._alloc_peak = current
+        for exporter in _exporters:
+            exporter.start(self)
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        if self._alloc_base is not None:
+            self._alloc_peak = max(self._alloc_peak, tracemalloc.get_traced_memory()[1])
+            self.attributes["peak_alloc"] = self._alloc_peak - self._alloc_base
+            if self.parent is not None:
+                self.parent._alloc_peak = max(self.parent._alloc_peak, self._alloc_peak)
+        _current_span.reset(self._token)
+        for exporter in _exporters:
+            try:
+                exporter.finish(self)
+            except Exception:
+                logger.exception("Instrumentation exporter %r failed", exporter)
+        return False
+
+    def to_dict(self):
+        """JSON-serialisable summary of the span."""
+        record = {
+            "span": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "root": self.root.name,
+            "start": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+        }
+        if self.error:
+            record["error"] = self.error
+        record.update(self.attributes)
+        return record
+
+class _NullSpan:
+    """Stands in for a Span when no exporter is configured."""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = _NullSpan()
+
+def enabled():
+    """True if at least one exporter is configured."""
+    return bool(_exporters)
+
+def span(name, **attributes):
+    """
+    Returns a context manager timing one stage.
+
+    Args:
+        name (str): Stage name.
+        **attributes: Initial attributes.
+
+    Returns:
+        Span: A real span, or a shared no-op stand-in when instrumentation is off.
+    """
+    if not _exporters:
+        return NULL_SPAN
+    return Span(name, **attributes)
+
+def current_span():
+    """The innermost active span, or a no-op stand-in, so callers can always call `.set()`."""
+    return _current_span.get() or NULL_SPAN
+
+def event(name, **attributes):
+    """
+    Records a point-in-time event (e.g. which Poppler install was picked).
+
+    Args:
+        name (str): Event name.
+        **attributes: Event details.
+    """
+    if not _exporters:
+        return
+    active = _current_span.get()
+    for exporter in _exporters:
+        exporter.event(name, attributes, active)
+
+def describe(value, prefix):
+    """
+    Summarises an input or output value as span attributes.
+
+    Bytes, parsed documents, file objects and paths contribute their size;
+    images contribute their dimensions and buffer size.
+
+    Args:
+        value: The value to describe.
+        prefix (str): 'in' or 'out'.
+
+    Returns:
+        dict: Attributes such as 'bytes_in', 'width_out' and 'height_out'.
+    """
+    if hasattr(value, "image") and isinstance(getattr(value, "image"), np.ndarray):
+        value = value.image
+    if isinstance(value, np.ndarray):
+        attributes = {f"bytes_{prefix}": int(value.nbytes)}
+        if value.ndim >= 2:
+            attributes[f"height_{prefix}"] = int(value.shape[0])
+            attributes[f"width_{prefix}"] = int(value.shape[1])
+        return attributes
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {f"bytes_{prefix}": len(value)}
+    if hasattr(value, "file_bytes"):
+        return {f"bytes_{prefix}": len(value.file_bytes)}
+    if isinstance(value, io.BytesIO):
+        return {f"bytes_{prefix}": value.getbuffer().nbytes}
+    if isinstance(value, (str, os.PathLike)) and os.path.isfile(value):
+        return {f"bytes_{prefix}": os.path.getsize(value)}
+    if isinstance(value, (list, tuple)) and value:
+        attributes = describe(value[0], prefix)
+        if isinstance(value, list):
+            attributes[f"count_{prefix}"] = len(value)
+        return attributes
+    return {}
+
+def traced(name):
+    """
+    Decorator running a function inside a span.
+
+    The first argument that looks like document data (bytes, a ParsedDocument,
+    a file object, a path or an image) is described as the input and the
+    return value as the output. The function can add more attributes through
+    `current_span().set(...)`. Not meant for generator functions.
+
+    Args:
+        name (str): Stage name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _exporters:
+                return func(*args, **kwargs)
+            with Span(name) as active:
+                for value in itertools.chain(args, kwargs.values()):
+                    attributes = describe(value, "in")
+                    if attributes:
+                        active.set(**attributes)
+                        break
+                result = func(*args, **kwargs)
+                active.set(**describe(result, "out"))
+                return result
+        return wrapper
+    return decorator
+
+class SpanExporter:
+    """Base class for exporters; every hook is optional."""
+
+    def start(self, span):
+        """Called when a span is entered."""
+
+    def finish(self, span):
+        """Called when a span has exited, with its duration and attributes set."""
+
+    def event(self, name, attributes, span):
+        """Called for `event()`, with the active span (or None)."""
+
+    def flush(self):
+        """Writes out anything buffered."""
+
+class LoggingExporter(SpanExporter):
+    """Emits one JSON log record per finished span and per event."""
+
+    def __init__(self, log=None, level=logging.INFO):
+        """
+        Args:
+            log (logging.Logger): Target logger (default: this module's logger).
+            level (int): Level for span records.
+        """
+        self.log = log or logger
+        self.level = level
+
+    def finish(self, span):
+        self.log.log(self.level, json.dumps(span.to_dict(), default=str))
+
+    def event(self, name, attributes, span):
+        record = {"event": name, "span_id": span.span_id if span is not None else None}
+        record.update(attributes)
+        self.log.log(self.level, json.dumps(record, default=str))
+
+class PrometheusTextfileExporter(SpanExporter):
+    """
+    Aggregates spans per stage and writes them in the Prometheus text format.
+
+    Meant for the node_exporter textfile collector: the file is rewritten
+    atomically at most every `flush_interval` seconds and on `flush()`. When
+    several processes export (batch workers), put '{pid}' in the path so each
+    writes its own file.
+    """
+
+    def __init__(self, path, flush_interval=10.0, prefix="forgery_stage"):
+        """
+        Args:
+            path (str): Output .prom file; '{pid}' is replaced by the process id.
+            flush_interval (float): Minimum seconds between automatic rewrites.
+            prefix (str): Metric name prefix.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._last_flush = time.monotonic()
+
+    def finish(self, span):
+        with self._lock:
+            stage = self._stages.setdefault(span.name, {
+                "count": 0, "errors": 0, "seconds": 0.0, "buckets": [0] * len(DURATION_BUCKETS),
+                "bytes_in": 0, "bytes_out": 0, "pixels": 0, "peak_alloc": 0,
+            })
+            stage["count"] += 1
+            stage["errors"] += span.error is not None
+            stage["seconds"] += span.duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    stage["buckets"][i] += 1
+            attributes = span.attributes
+            stage["bytes_in"] += attributes.get("bytes_in", 0)
+            stage["bytes_out"] += attributes.get("bytes_out", 0)
+            stage["pixels"] += attributes.get("width_out", 0) * attributes.get("height_out", 0)
+            stage["peak_alloc"] = max(stage["peak_alloc"], attributes.get("peak_alloc", 0))
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def render(self):
+        """Returns the current metrics as Prometheus exposition text."""
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_duration_seconds Wall time per analysis stage.",
+            f"# TYPE {p}_duration_seconds histogram",
+        ]
+        with self._lock:
+            stages = {name: dict(stage, buckets=list(stage["buckets"])) for name, stage in self._stages.items()}
+        for name, stage in sorted(stages.items()):
+            for bound, count in zip(DURATION_BUCKETS, stage["buckets"]):
+                lines.append(f'{p}_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+            lines.append(f'{p}_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}')
+            lines.append(f'{p}_duration_seconds_sum{{stage="{name}"}} {stage["seconds"]:.6f}')
+            lines.append(f'{p}_duration_seconds_count{{stage="{name}"}} {stage["count"]}')
+
+        counters = (
+            ("errors_total", "errors", "counter", "Stage invocations that raised."),
+            ("bytes_in_total", "bytes_in", "counter", "Bytes consumed per stage."),
+            ("bytes_out_total", "bytes_out", "counter", "Bytes produced per stage."),
+            ("pixels_out_total", "pixels", "counter", "Image pixels produced per stage."),
+            ("peak_alloc_bytes", "peak_alloc", "gauge", "Largest traced allocation peak seen in a stage."),
+        )
+        for suffix, key, kind, help_text in counters:
+            lines.append(f"# HELP {p}_{suffix} {help_text}")
+            lines.append(f"# TYPE {p}_{suffix} {kind}")
+            for name, stage in sorted(stages.items()):
+                lines.append(f'{p}_{suffix}{{stage="{name}"}} {stage[key]}')
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        path = self.path.replace("{pid}", str(os.getpid()))
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Write-then-rename so the collector never reads a half-written file
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+        self._last_flush = time.monotonic()
+
+class SlowRequestProfiler(SpanExporter):
+    """
+    Profiles root spans (whole requests) and keeps the dumps of slow ones.
+
+    cProfile runs for every sampled request because slowness is only known at
+    the end; only requests over `threshold` seconds are written out, as a
+    `.prof` file (open with pstats or snakeviz) plus, when memory tracking is
+    on, a `.txt` with the top allocation sites. Profiling adds noticeable
+    overhead, so lower `sample_rate` on busy servers. One request is profiled
+    at a time per process.
+    """
+
+    def __init__(self, directory, threshold=5.0, sample_rate=1.0, top_allocations=25):
+        """
+        Args:
+            directory (str): Where dumps are written (created if missing).
+            threshold (float): Seconds above which a request is dumped.
+            sample_rate (float): Fraction of requests profiled.
+            top_allocations (int): Allocation sites listed in the tracemalloc dump.
+        """
+        self.directory = directory
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.top_allocations = top_allocations
+        self._busy = threading.Lock()
+        self._active = {}
+
+    def start(self, span):
+        if span.parent is not None or random.random() >= self.sample_rate:
+            return
+        if not self._busy.acquire(blocking=False):
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already active
+            self._busy.release()
+            return
+        self._active[span.span_id] = profiler
+
+    def finish(self, span):
+        profiler = self._active.pop(span.span_id, None)
+        if profiler is None:
+            return
+        try:
+            profiler.disable()
+            if span.duration < self.threshold:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            stem = os.path.join(
+                self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{span.name}-{span.span_id}"
+            )
+            profiler.dump_stats(stem + ".prof")
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot()
+                with open(stem + ".txt", "w", encoding="utf-8") as f:
+                    f.write(f"{span.name} took {span.duration:.3f}s\n{json.dumps(span.to_dict(), default=str)}\n\n")
+                    for stat in snapshot.statistics("lineno")[:self.top_allocations]:
+                        f.write(f"{stat}\n")
+            logger.warning("Slow request %s took %.2fs; profile written to %s.prof", span.name, span.duration, stem)
+        finally:
+            self._busy.release()
+
+def configure(exporters, track_memory=False):
+    """
+    Replaces the active exporters.
+
+    Args:
+        exporters (list): SpanExporter instances; empty turns instrumentation off.
+        track_memory (bool): Start tracemalloc so spans record 'peak_alloc'.
+            This slows allocation-heavy code, so enable it when diagnosing.
+    """
+    global _started_tracemalloc
+    flush()
+    _exporters[:] = list(exporters)
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    elif not track_memory and _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+
+def flush():
+    """Flushes every exporter (e.g. before a process exits)."""
+    for exporter in _exporters:
+        exporter.flush()
+
+# Buffered exporters (Prometheus) get a final write when the process exits
+atexit.register(flush)
+
+def configure_from_env(environ=None):
+    """
+    Configures exporters from environment variables.
+
+    FORGERY_TRACE_LOG=1 enables the logging exporter,
+    FORGERY_PROMETHEUS_FILE=path enables the Prometheus textfile exporter,
+    FORGERY_PROFILE_DIR=dir enables the slow-request profiler, with
+    FORGERY_SLOW_SECONDS as its threshold (default 5), and
+    FORGERY_TRACK_MEMORY=1 records peak allocations.
+
+    Args:
+        environ (dict): Mapping to read instead of os.environ.
+
+    Returns:
+        list: The exporters configured.
+    """
+    environ = os.environ if environ is None else environ
+    exporters = []
+    if environ.get("FORGERY_TRACE_LOG", "") not in ("", "0"):
+        exporters.append(LoggingExporter())
+    if environ.get("FORGERY_PROMETHEUS_FILE"):
+        exporters.append(PrometheusTextfileExporter(environ["FORGERY_PROMETHEUS_FILE"]))
+    if environ.get("FORGERY_PROFILE_DIR"):
+        exporters.append(SlowRequestProfiler(
+            environ["FORGERY_PROFILE_DIR"], threshold=float(environ.get("FORGERY_SLOW_SECONDS", 5.0))
+        ))
+    configure(exporters, track_memory=environ.get("FORGERY_TRACK_MEMORY", "") not in ("", "0"))
+    return exporters
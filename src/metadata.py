@@ -1,77 +1,357 @@
 from pypdf import PdfReader
-from docx import Document
+from src import instrumentation
+from src.document import ParsedDocument
+from src.pdf_structure import PdfStructure, PDFSyntaxError, Stream, decode_text
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import io
-from datetime import datetime
+import mmap
+import os
+import xml.etree.ElementTree as ET
+import zipfile
 
-def scan_metadata(file_object):
+SUSPICIOUS_KEYWORDS = ['photoshop', 'gimp', 'i love pdf', 'modified']
+
+# Document properties reported through `scan_metadata(..., fields=...)`
+INFO_FIELDS = ('Producer', 'Creator', 'Author', 'Title', 'CreationDate', 'ModDate')
+
+# Bytes read to decide the file type
+SNIFF_BYTES = 8
+
+# Largest XMP packet or DOCX property part that will be parsed
+MAX_XML_BYTES = 4 * 1024 * 1024
+
+XMP_NAMESPACES = {
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "xmp": "http://ns.adobe.com/xap/1.0/",
+    "pdf": "http://ns.adobe.com/pdf/1.3/",
+    "xmpMM": "http://ns.adobe.com/xap/1.0/mm/",
+    "stEvt": "http://ns.adobe.com/xap/1.0/sType/ResourceEvent#",
+}
+
+DOCX_NAMESPACES = {
+    "cp": "http://schemas.openxmlformats.org/package/2006/metadata/core-properties",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "dcterms": "http://purl.org/dc/terms/",
+    "ep": "http://schemas.openxmlformats.org/officeDocument/2006/extended-properties",
+}
+
+class _BufferReader(io.RawIOBase):
+    """Read-only, seekable file over a memoryview, so zipfile can work without copying it."""
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._buffer)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def readinto(self, target):
+        chunk = self._buffer[self._position:self._position + len(target)]
+        target[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+@contextmanager
+def _open_buffer(source):
+    """
+    Yields zero-copy, random-access bytes for `source`.
+
+    Paths and real files are memory-mapped, in-memory buffers (bytes,
+    BytesIO, Streamlit uploads, ParsedDocument) are exposed through a
+    memoryview. Only other file-like objects fall back to a full read.
+    """
+    if isinstance(source, ParsedDocument):
+        source = source.file_bytes
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        view = memoryview(source)
+        try:
+            yield view
+        finally:
+            view.release()
+        return
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            with _map_file(f) as view:
+                yield view
+        return
+    if isinstance(source, io.BytesIO):
+        view = source.getbuffer()
+        try:
+            yield view
+        finally:
+            view.release()
+        return
+    try:
+        source.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        position = source.tell() if hasattr(source, "tell") else None
+        source.seek(0)
+        data = source.read()
+        if position is not None:
+            source.seek(position)
+        yield memoryview(data)
+        return
+    with _map_file(source) as view:
+        yield view
+
+@contextmanager
+def _map_file(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        yield memoryview(b"")
+        return
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield mapped
+
+def _sniff(buffer):
+    head = bytes(buffer[:SNIFF_BYTES])
+    if head.startswith(b'%PDF'):
+        return 'pdf'
+    if head.startswith(b'PK'):
+        return 'docx'
+    return 'image'
+
+@instrumentation.traced("metadata.scan")
+def scan_metadata(file_object, fields=None, count_updates=True):
     """
     Scans PDF or Word file metadata for suspicious keywords and temporal anomalies.
-    
+
+    Only the parts that hold metadata are read: for a PDF the trailer, the Info
+    dictionary, the XMP packet and the chain of cross-reference sections (one
+    per incremental update); for a DOCX the `docProps/core.xml` and
+    `docProps/app.xml` entries. Files are memory-mapped or viewed in place,
+    never copied, so the scan time does not grow with the file size.
+
     Args:
-        file_object (BytesIO): The file-like object to scan.
-        
+        file_object (BytesIO, bytes, path or ParsedDocument): The document to scan.
+        fields (dict): Optional dict that receives the document properties
+            read along the way: those of INFO_FIELDS present, XMP
+            'CreatorTool', and for DOCX 'LastModifiedBy', 'Application' and
+            'Company'.
+        count_updates (bool): Flag a PDF's incremental updates by counting its
+            cross-reference sections. Callers that report each revision
+            themselves (see `revisions.analyze_revisions`) turn this off.
+
     Returns:
         list: A list of 'Red Flags' found in the metadata.
     """
+    fields = {} if fields is None else fields
     red_flags = []
-    suspicious_keywords = ['photoshop', 'gimp', 'i love pdf', 'modified']
-    
-    # Reset file pointer
-    file_object.seek(0)
-    file_bytes = file_object.read()
-    file_object.seek(0)
-    
+
     # Helper to check keywords
     def check_keywords(text, source):
         if not text:
             return
         text_lower = str(text).lower()
-        for kw in suspicious_keywords:
+        for kw in SUSPICIOUS_KEYWORDS:
             if kw in text_lower:
                 red_flags.append(f"Suspicious keyword '{kw}' found in {source}: '{text}'")
 
     try:
-        # Check if it's a PDF (starts with %PDF)
-        if file_bytes.startswith(b'%PDF'):
-            reader = PdfReader(file_object)
-            meta = reader.metadata
-            
-            if meta:
-                # Common PDF metadata tags
-                tags_to_check = [('/Producer', 'Producer'), ('/Creator', 'Creator'), ('/Author', 'Author'), ('/Software', 'Software')]
-                for tag, label in tags_to_check:
-                    if tag in meta:
-                        check_keywords(meta[tag], label)
-                
-                # Date anomaly check for PDF
-                # PDF dates are often in format D:YYYYMMDDHHmmSSOHH'mm'
-                creation_date = meta.get('/CreationDate')
-                mod_date = meta.get('/ModDate')
-                
-                # Basic check for existence and common modifications
-                if creation_date and mod_date:
-                    # Very basic check: if they differ and mod is present, it's been edited
-                    if creation_date != mod_date:
-                        red_flags.append(f"Modification detected: Creation and Modification dates differ.")
-        
-        # Check if it's a DOCX (ZIP format starts with PK)
-        elif file_bytes.startswith(b'PK'):
-            doc = Document(file_object)
-            props = doc.core_properties
-            
-            # Check core properties
-            check_keywords(props.author, "Author")
-            check_keywords(props.last_modified_by, "Last Modified By")
-            
-            # Temporal anomalies
-            if props.created and props.modified:
-                if props.created > props.modified:
-                    red_flags.append(f"Temporal Anomaly: Creation date ({props.created}) is after Modification date ({props.modified}).")
-                elif props.created != props.modified:
-                    # In many forgery cases, any modification is a red flag if it's supposed to be an original scan
-                    pass 
-
+        with _open_buffer(file_object) as buffer:
+            kind = _sniff(buffer)
+            if kind == 'pdf':
+                # A ParsedDocument shares its parsed structure with revision analysis
+                structure = file_object.pdf_structure if isinstance(file_object, ParsedDocument) else None
+                _scan_pdf(buffer, red_flags, check_keywords, fields, count_updates, structure)
+            elif kind == 'docx':
+                _scan_docx(buffer, red_flags, check_keywords, fields)
     except Exception as e:
         red_flags.append(f"Error scanning metadata: {str(e)}")
-        
+
     return list(set(red_flags)) # Return unique flags
+
+def _scan_pdf(buffer, red_flags, check_keywords, fields, count_updates=True, structure=None):
+    try:
+        structure = structure or PdfStructure(buffer)
+        trailer = structure.trailer
+    except PDFSyntaxError:
+        # Damaged cross-reference data: let pypdf rebuild it (this reads the whole file)
+        _scan_pdf_fallback(buffer, red_flags, check_keywords, fields)
+        return
+
+    if "Encrypt" in trailer:
+        red_flags.append("Error scanning metadata: PDF is encrypted, its metadata could not be read.")
+        return
+
+    info = structure.resolve(trailer.get("Info"))
+    info = info if isinstance(info, dict) else {}
+    meta = {key: decode_text(structure.resolve(value)) for key, value in info.items()}
+    _check_info(meta, red_flags, check_keywords)
+    _collect_fields(meta, fields)
+
+    xmp = _read_xmp(structure)
+    if xmp is not None:
+        _check_xmp(xmp, meta.get("Producer"), red_flags, check_keywords)
+        for tag, name in (("CreatorTool", "xmp:CreatorTool"), ("Producer", "pdf:Producer")):
+            value = _xmp_value(xmp, name)
+            # The Info dictionary wins where both are set
+            if value and tag not in fields:
+                fields[tag] = value
+
+    # A linearized file carries two cross-reference sections from the start
+    updates = len(structure.sections) - (2 if structure.is_linearized() else 1)
+    if count_updates and updates > 0:
+        red_flags.append(
+            f"Incremental update: PDF was saved {updates} more time(s) after it was first written "
+            f"({len(structure.sections)} cross-reference sections)."
+        )
+
+def _scan_pdf_fallback(buffer, red_flags, check_keywords, fields):
+    raw = PdfReader(_BufferReader(buffer)).metadata or {}
+    meta = {key.lstrip("/"): str(value) for key, value in raw.items()}
+    _check_info(meta, red_flags, check_keywords)
+    _collect_fields(meta, fields)
+
+def _collect_fields(meta, fields):
+    for tag in INFO_FIELDS:
+        value = meta.get(tag)
+        if isinstance(value, str) and value.strip():
+            fields[tag] = value.strip()
+
+def _check_info(meta, red_flags, check_keywords):
+    # Common PDF metadata tags
+    for tag in ('Producer', 'Creator', 'Author', 'Software'):
+        check_keywords(meta.get(tag), tag)
+
+    # PDF dates are often in format D:YYYYMMDDHHmmSSOHH'mm'
+    creation_date = meta.get('CreationDate')
+    mod_date = meta.get('ModDate')
+    if creation_date and mod_date and creation_date != mod_date:
+        red_flags.append("Modification detected: Creation and Modification dates differ.")
+
+def _read_xmp(structure):
+    """Returns the parsed XMP packet referenced from the catalog, or None."""
+    catalog = structure.resolve(structure.trailer.get("Root"))
+    if not isinstance(catalog, dict):
+        return None
+    stream = structure.resolve(catalog.get("Metadata"))
+    if not isinstance(stream, Stream):
+        return None
+    data = stream.data()
+    if not data or len(data) > MAX_XML_BYTES:
+        return None
+    try:
+        return ET.fromstring(data)
+    except ET.ParseError:
+        return None
+
+def _xmp_value(root, name):
+    """Reads an XMP property written either as an attribute or as an element of rdf:Description."""
+    prefix, local = name.split(":")
+    qualified = f"{{{XMP_NAMESPACES[prefix]}}}{local}"
+    for description in root.iter(f"{{{XMP_NAMESPACES['rdf']}}}Description"):
+        if qualified in description.attrib:
+            return description.attrib[qualified].strip()
+        element = description.find(name, XMP_NAMESPACES)
+        if element is not None and element.text:
+            return element.text.strip()
+    return None
+
+def _xmp_history(root):
+    """Returns the xmpMM:History events as (action, software agent, when) tuples."""
+    events = []
+    for history in root.iter(f"{{{XMP_NAMESPACES['xmpMM']}}}History"):
+        for item in history.iter(f"{{{XMP_NAMESPACES['rdf']}}}li"):
+            fields = {}
+            for field in ("action", "softwareAgent", "when"):
+                qualified = f"{{{XMP_NAMESPACES['stEvt']}}}{field}"
+                value = item.attrib.get(qualified)
+                if value is None:
+                    element = item.find(f"stEvt:{field}", XMP_NAMESPACES)
+                    value = element.text if element is not None else None
+                fields[field] = value.strip() if value else None
+            events.append((fields["action"], fields["softwareAgent"], fields["when"]))
+    return events
+
+def _check_xmp(root, info_producer, red_flags, check_keywords):
+    check_keywords(_xmp_value(root, "xmp:CreatorTool"), "XMP CreatorTool")
+    xmp_producer = _xmp_value(root, "pdf:Producer")
+    check_keywords(xmp_producer, "XMP Producer")
+
+    if info_producer and xmp_producer and info_producer.strip() != xmp_producer:
+        red_flags.append(
+            f"Metadata mismatch: Info Producer '{info_producer}' differs from XMP Producer '{xmp_producer}'."
+        )
+
+    events = _xmp_history(root)
+    for action, agent, when in events:
+        check_keywords(agent, "XMP History")
+    edits = [event for event in events if event[0] and event[0] != "created"]
+    if edits:
+        agents = sorted({agent for _, agent, _ in edits if agent})
+        tools = f" with {', '.join(agents)}" if agents else ""
+        last_action, _, last_when = edits[-1]
+        red_flags.append(
+            f"Edit history: XMP records {len(edits)} change(s){tools}; "
+            f"last '{last_action}'{f' at {last_when}' if last_when else ''}."
+        )
+
+def _scan_docx(buffer, red_flags, check_keywords, fields):
+    with zipfile.ZipFile(_BufferReader(buffer)) as package:
+        core = _read_part(package, "docProps/core.xml")
+        app = _read_part(package, "docProps/app.xml")
+
+    if core is not None:
+        # Check core properties
+        check_keywords(_docx_text(core, "dc:creator"), "Author")
+        check_keywords(_docx_text(core, "cp:lastModifiedBy"), "Last Modified By")
+        for tag, name in (("Author", "dc:creator"), ("LastModifiedBy", "cp:lastModifiedBy"), ("Title", "dc:title"),
+                          ("CreationDate", "dcterms:created"), ("ModDate", "dcterms:modified")):
+            value = _docx_text(core, name)
+            if value:
+                fields[tag] = value
+
+        # Temporal anomalies
+        created = _parse_w3cdtf(_docx_text(core, "dcterms:created"))
+        modified = _parse_w3cdtf(_docx_text(core, "dcterms:modified"))
+        if created and modified and created > modified:
+            red_flags.append(f"Temporal Anomaly: Creation date ({created}) is after Modification date ({modified}).")
+
+    if app is not None:
+        # Extended properties name the program that last saved the file
+        check_keywords(_docx_text(app, "ep:Application"), "Application")
+        check_keywords(_docx_text(app, "ep:Company"), "Company")
+        for tag in ("Application", "Company"):
+            value = _docx_text(app, f"ep:{tag}")
+            if value:
+                fields[tag] = value
+
+def _read_part(package, name):
+    try:
+        info = package.getinfo(name)
+    except KeyError:
+        return None
+    if info.file_size > MAX_XML_BYTES:
+        return None
+    try:
+        return ET.fromstring(package.read(info))
+    except ET.ParseError:
+        return None
+
+def _docx_text(root, name):
+    element = root.find(name, DOCX_NAMESPACES)
+    return element.text.strip() if element is not None and element.text else None
+
+def _parse_w3cdtf(value):
+    """Parses a W3CDTF timestamp into a naive UTC datetime, as python-docx reports them."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
@@ -0,0 +1,540 @@
+"""
+Minimal, zero-copy reader for PDF file structure.
+
+Works directly on a bytes-like buffer (bytes, memoryview or mmap) and only
+touches the parts it is asked for: the `startxref` pointer at the end of the
+file, the cross-reference sections chained through `/Prev` (one per saved
+revision), and individual objects located through them. Nothing is read or
+copied wholesale, so looking up the Info dictionary or the XMP packet costs
+about the same for a 100 KB and a 500 MB file.
+"""
+import numpy as np
+from collections import namedtuple
+import re
+import zlib
+
+_WS = rb"\x00\t\n\x0c\r "
+_DELIMITERS = rb"()<>\[\]{}/%"
+_SKIP = re.compile(rb"(?:[" + _WS + rb"]+|%[^\r\n]*)*")
+_NUMBER = re.compile(rb"[+-]?(?:\d+\.?\d*|\.\d+)")
+_REF_TAIL = re.compile(rb"[" + _WS + rb"]+(\d+)[" + _WS + rb"]+R(?![^" + _WS + _DELIMITERS + rb"])")
+_NAME = re.compile(rb"/([^" + _WS + _DELIMITERS + rb"]*)")
+_NAME_ESCAPE = re.compile(rb"#([0-9A-Fa-f]{2})")
+_KEYWORD = re.compile(rb"[A-Za-z]+")
+_HEX_STRING = re.compile(rb"<([0-9A-Fa-f" + _WS + rb"]*)>")
+_STRING_SPECIAL = re.compile(rb"[()\\]")
+_OBJECT_HEADER = re.compile(rb"[" + _WS + rb"]*(\d+)[" + _WS + rb"]+(\d+)[" + _WS + rb"]+obj")
+_SUBSECTION = re.compile(rb"(\d+)[ \t]+(\d+)[ \t]*\r?\n?")
+_STARTXREF = re.compile(rb"startxref[" + _WS + rb"]+(\d+)")
+
+_ESCAPES = {ord("n"): b"\n", ord("r"): b"\r", ord("t"): b"\t", ord("b"): b"\b", ord("f"): b"\f",
+            ord("("): b"(", ord(")"): b")", ord("\\"): b"\\"}
+
+# Nested containers deeper than this are treated as malformed
+MAX_DEPTH = 64
+
+# Largest decoded stream accepted, to bound memory on hostile inputs
+MAX_STREAM_BYTES = 64 * 1024 * 1024
+
+# How far from the end of the file to look for `startxref`
+TAIL_SEARCH = (1024, 64 * 1024)
+
+class PDFSyntaxError(ValueError):
+    """Raised when the PDF structure cannot be parsed."""
+
+class Name(str):
+    """A PDF name object, without its leading slash."""
+
+Ref = namedtuple("Ref", ["number", "generation"])
+
+# One cross-reference entry: type 0 (free), 1 (at a byte offset) or 2 (inside
+# object stream `offset`, at position `generation`)
+XrefEntry = namedtuple("XrefEntry", ["number", "generation", "type", "offset"])
+
+class Stream:
+    """A stream object: its dictionary plus the location of its raw data."""
+
+    def __init__(self, dictionary, data_start, structure):
+        self.dictionary = dictionary
+        self.data_start = data_start
+        self._structure = structure
+
+    def get(self, key, default=None):
+        return self.dictionary.get(key, default)
+
+    def raw(self):
+        """The undecoded stream bytes."""
+        length = self._structure.resolve(self.dictionary.get("Length"))
+        if not isinstance(length, int) or length < 0:
+            # A broken /Length: fall back to the endstream keyword
+            end = self._structure.find(b"endstream", self.data_start)
+            if end < 0:
+                raise PDFSyntaxError("Stream without endstream")
+            length = end - self.data_start
+        return bytes(self._structure.buffer[self.data_start:self.data_start + length])
+
+    def data(self):
+        """
+        The decoded stream bytes.
+
+        Returns:
+            bytes: Decoded data, or None if a filter other than FlateDecode is used.
+        """
+        filters = self._structure.resolve(self.dictionary.get("Filter"))
+        params = self._structure.resolve(self.dictionary.get("DecodeParms"))
+        filters = filters if isinstance(filters, list) else [filters] if filters else []
+        params = params if isinstance(params, list) else [params] * max(1, len(filters))
+
+        data = self.raw()
+        for name, param in zip(filters, params):
+            if name not in ("FlateDecode", "Fl"):
+                return None
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(data, MAX_STREAM_BYTES)
+            if decompressor.unconsumed_tail:
+                raise PDFSyntaxError("Stream exceeds the decoded size limit")
+            param = self._structure.resolve(param) if param else {}
+            if isinstance(param, dict) and param.get("Predictor", 1) >= 10:
+                data = _png_unpredict(data, param.get("Columns", 1), param.get("Colors", 1),
+                                      param.get("BitsPerComponent", 8))
+        return data
+
+class XrefSection:
+    """
+    One cross-reference section (a classic table or an xref stream) and its trailer.
+
+    Classic table entries are not parsed up front: each has a fixed width, so
+    an object's entry is read directly from its computed position.
+    """
+
+    def __init__(self, offset, kind, trailer, structure):
+        self.offset = offset
+        self.kind = kind
+        self.trailer = trailer
+        self._structure = structure
+        # Classic tables: (first number, count, table offset, entry width)
+        self._subsections = []
+        # Xref streams (and the stream half of hybrid sections): number -> XrefEntry
+        self._entries = {}
+
+    def lookup(self, number):
+        """Returns the XrefEntry for an object number, or None if this section lacks it."""
+        entry = None
+        for first, count, table_offset, width in self._subsections:
+            if first <= number < first + count:
+                entry = self._read_entry(number, table_offset + (number - first) * width)
+                break
+        # Hybrid files list compressed objects as free in the table
+        if entry is None or entry.type == 0:
+            return self._entries.get(number, entry)
+        return entry
+
+    def entries(self):
+        """Iterates every entry in this section."""
+        for first, count, table_offset, width in self._subsections:
+            for i in range(count):
+                yield self._read_entry(first + i, table_offset + i * width)
+        yield from self._entries.values()
+
+    def _read_entry(self, number, position):
+        line = bytes(self._structure.buffer[position:position + 18])
+        try:
+            offset, generation, kind = int(line[:10]), int(line[11:16]), line[17:18]
+        except ValueError:
+            raise PDFSyntaxError(f"Malformed xref entry for object {number}")
+        return XrefEntry(number, generation, 1 if kind == b"n" else 0, offset)
+
+class PdfStructure:
+    """
+    Lazily parsed view of a PDF's revisions and objects.
+
+    Args:
+        buffer: The whole file as bytes, memoryview or mmap. It is never copied.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self._sections = None
+        self._section_cache = {}
+        self._objects = {}
+        self._object_streams = {}
+
+    def find(self, needle, start=0, end=None):
+        """Byte offset of `needle` in the buffer, or -1."""
+        match = re.compile(re.escape(needle)).search(self.buffer, start, len(self.buffer) if end is None else end)
+        return match.start() if match else -1
+
+    def startxref(self):
+        """Offset of the newest cross-reference section, read from the file tail."""
+        size = len(self.buffer)
+        for window in TAIL_SEARCH:
+            start = max(0, size - window)
+            matches = list(_STARTXREF.finditer(self.buffer, start))
+            if matches:
+                return int(matches[-1].group(1))
+            if start == 0:
+                break
+        raise PDFSyntaxError("No startxref found")
+
+    @property
+    def sections(self):
+        """Cross-reference sections, newest first (one per saved revision)."""
+        if self._sections is None:
+            self._sections = self.chain(self.startxref())
+        return self._sections
+
+    def chain(self, offset):
+        """
+        Reads the cross-reference section at `offset` and every older one it links to via /Prev.
+
+        Args:
+            offset (int): Byte offset of a section, as given by a `startxref` line.
+
+        Returns:
+            list: XrefSection objects, newest first.
+        """
+        sections = []
+        seen = set()
+        while offset is not None and offset not in seen and len(seen) < 10000:
+            seen.add(offset)
+            if offset not in self._section_cache:
+                section = self._read_section(offset)
+                # Hybrid files add an xref stream to a classic section
+                hybrid = section.trailer.get("XRefStm")
+                if isinstance(hybrid, int) and hybrid != offset:
+                    section._entries = self._read_section(hybrid)._entries
+                self._section_cache[offset] = section
+            section = self._section_cache[offset]
+            sections.append(section)
+            previous = section.trailer.get("Prev")
+            offset = previous if isinstance(previous, int) else None
+        return sections
+
+    @property
+    def trailer(self):
+        """The newest trailer dictionary."""
+        return self.sections[0].trailer
+
+    def get_object(self, number):
+        """
+        Loads an object by number, using the newest revision that defines it.
+
+        Returns:
+            The parsed object (dict, list, Stream, str, ...), or None if free or missing.
+        """
+        if number in self._objects:
+            return self._objects[number]
+        value = None
+        for section in self.sections:
+            entry = section.lookup(number)
+            if entry is None:
+                continue
+            value = self.load_entry(entry)
+            break
+        self._objects[number] = value
+        return value
+
+    def load_entry(self, entry):
+        """Parses the object an XrefEntry points at (None for free entries)."""
+        if entry.type == 1:
+            return self.parse_indirect(entry.offset)[2]
+        if entry.type == 2:
+            return self._from_object_stream(entry.offset, entry.generation)
+        return None
+
+    def resolve(self, value):
+        """Follows an indirect reference; other values are returned unchanged."""
+        depth = 0
+        while isinstance(value, Ref) and depth < MAX_DEPTH:
+            value = self.get_object(value.number)
+            depth += 1
+        return value
+
+    def parse_indirect(self, offset):
+        """
+        Parses 'N G obj ... endobj' at a byte offset.
+
+        Returns:
+            tuple: (number, generation, value); stream objects come back as Stream.
+        """
+        match = _OBJECT_HEADER.match(self.buffer, offset)
+        if not match:
+            raise PDFSyntaxError(f"No object at offset {offset}")
+        value, position = parse_value(self.buffer, match.end())
+        if isinstance(value, dict):
+            position = _SKIP.match(self.buffer, position).end()
+            if self.buffer[position:position + 6] == b"stream":
+                position += 6
+                if self.buffer[position:position + 1] == b"\r":
+                    position += 1
+                if self.buffer[position:position + 1] == b"\n":
+                    position += 1
+                value = Stream(value, position, self)
+        return int(match.group(1)), int(match.group(2)), value
+
+    def is_linearized(self):
+        """True if the file starts with a linearization dictionary (two xref sections by design)."""
+        header = self.find(b"%PDF", 0, min(len(self.buffer), 1024))
+        if header < 0:
+            return False
+        match = _OBJECT_HEADER.search(self.buffer, header, min(len(self.buffer), header + 2048))
+        if not match:
+            return False
+        try:
+            value = self.parse_indirect(match.start())[2]
+        except PDFSyntaxError:
+            return False
+        dictionary = value.dictionary if isinstance(value, Stream) else value
+        return isinstance(dictionary, dict) and "Linearized" in dictionary
+
+    def _read_section(self, offset):
+        position = _SKIP.match(self.buffer, offset).end()
+        if self.buffer[position:position + 4] == b"xref":
+            return self._read_table(position + 4, offset)
+
+        number, generation, value = self.parse_indirect(offset)
+        if not isinstance(value, Stream) or value.get("Type") != "XRef":
+            raise PDFSyntaxError(f"No cross-reference section at offset {offset}")
+        section = XrefSection(offset, "stream", value.dictionary, self)
+        section._entries = self._xref_stream_entries(value)
+        return section
+
+    def _read_table(self, position, offset):
+        section = XrefSection(offset, "table", {}, self)
+        while True:
+            position = _SKIP.match(self.buffer, position).end()
+            if self.buffer[position:position + 7] == b"trailer":
+                section.trailer, _ = parse_value(self.buffer, position + 7)
+                return section
+            match = _SUBSECTION.match(self.buffer, position)
+            if not match:
+                raise PDFSyntaxError(f"Malformed xref table at offset {offset}")
+            first, count = int(match.group(1)), int(match.group(2))
+            table_offset = _SKIP.match(self.buffer, match.end()).end() if count else match.end()
+            # Entries are nominally 20 bytes, but some writers end lines with one byte
+            width = 20
+            if count:
+                end = table_offset + 18
+                while self.buffer[end:end + 1] in (b" ", b"\r", b"\n"):
+                    end += 1
+                width = min(20, max(19, end - table_offset)) if count > 1 else 20
+            section._subsections.append((first, count, table_offset, width))
+            position = table_offset + count * width
+
+    def _xref_stream_entries(self, stream):
+        data = stream.data()
+        if data is None:
+            raise PDFSyntaxError("Unsupported xref stream filter")
+        widths = [self.resolve(w) for w in stream.get("W", [])]
+        if len(widths) != 3:
+            raise PDFSyntaxError("Malformed xref stream /W")
+        index = stream.get("Index") or [0, stream.get("Size", 0)]
+        row = sum(widths)
+
+        entries = {}
+        position = 0
+        for first, count in zip(index[::2], index[1::2]):
+            for number in range(first, first + count):
+                if position + row > len(data):
+                    return entries
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(data[position:position + width], "big") if width else None)
+                    position += width
+                kind = 1 if fields[0] is None else fields[0]
+                entries[number] = XrefEntry(number, fields[2] or 0, kind, fields[1] or 0)
+        return entries
+
+    def _from_object_stream(self, stream_number, index):
+        if stream_number not in self._object_streams:
+            stream = self.get_object(stream_number)
+            if not isinstance(stream, Stream):
+                raise PDFSyntaxError(f"Object stream {stream_number} is missing")
+            data = stream.data()
+            if data is None:
+                raise PDFSyntaxError(f"Unsupported filter on object stream {stream_number}")
+            first = stream.get("First", 0)
+            header = [int(token) for token in data[:first].split()]
+            self._object_streams[stream_number] = (data, first, header[1::2])
+        data, first, offsets = self._object_streams[stream_number]
+        if index >= len(offsets):
+            return None
+        return parse_value(data, first + offsets[index])[0]
+
+def parse_value(buffer, position, depth=0):
+    """
+    Parses one PDF object starting at `position`.
+
+    Args:
+        buffer: bytes-like object.
+        position (int): Where to start (leading whitespace and comments are skipped).
+        depth (int): Current nesting depth.
+
+    Returns:
+        tuple: (value, position after it). Dictionaries map str keys to values,
+            names are Name, strings are bytes, references are Ref.
+    """
+    if depth > MAX_DEPTH:
+        raise PDFSyntaxError("Objects nested too deeply")
+    position = _SKIP.match(buffer, position).end()
+    head = bytes(buffer[position:position + 2])
+    if not head:
+        raise PDFSyntaxError("Unexpected end of data")
+
+    if head == b"<<":
+        result = {}
+        position += 2
+        while True:
+            position = _SKIP.match(buffer, position).end()
+            if buffer[position:position + 2] == b">>":
+                return result, position + 2
+            key = _NAME.match(buffer, position)
+            if not key:
+                raise PDFSyntaxError(f"Expected a name key at offset {position}")
+            value, position = parse_value(buffer, key.end(), depth + 1)
+            result[_decode_name(key.group(1))] = value
+
+    first = head[:1]
+    if first == b"[":
+        result = []
+        position += 1
+        while True:
+            position = _SKIP.match(buffer, position).end()
+            if buffer[position:position + 1] == b"]":
+                return result, position + 1
+            value, position = parse_value(buffer, position, depth + 1)
+            result.append(value)
+
+    if first == b"/":
+        match = _NAME.match(buffer, position)
+        return Name(_decode_name(match.group(1))), match.end()
+
+    if first == b"(":
+        return _parse_literal_string(buffer, position + 1)
+
+    if first == b"<":
+        match = _HEX_STRING.match(buffer, position)
+        if not match:
+            raise PDFSyntaxError(f"Malformed hex string at offset {position}")
+        digits = re.sub(rb"[" + _WS + rb"]", b"", match.group(1))
+        if len(digits) % 2:
+            digits += b"0"
+        return bytes.fromhex(digits.decode("ascii")), match.end()
+
+    match = _NUMBER.match(buffer, position)
+    if match:
+        token = match.group(0)
+        if b"." in token:
+            return float(token), match.end()
+        number = int(token)
+        reference = _REF_TAIL.match(buffer, match.end())
+        if reference:
+            return Ref(number, int(reference.group(1))), reference.end()
+        return number, match.end()
+
+    match = _KEYWORD.match(buffer, position)
+    if match:
+        keyword = match.group(0)
+        if keyword == b"true":
+            return True, match.end()
+        if keyword == b"false":
+            return False, match.end()
+        if keyword == b"null":
+            return None, match.end()
+    raise PDFSyntaxError(f"Unexpected token at offset {position}")
+
+def decode_text(value):
+    """
+    Converts a PDF text string to str.
+
+    Strings with a UTF-16 or UTF-8 byte order mark are decoded accordingly,
+    anything else as PDFDocEncoding (close enough to Latin-1 for metadata).
+    """
+    if isinstance(value, bytes):
+        if value.startswith(b"\xfe\xff"):
+            return value[2:].decode("utf-16-be", errors="replace")
+        if value.startswith(b"\xef\xbb\xbf"):
+            return value[3:].decode("utf-8", errors="replace")
+        return value.decode("latin-1")
+    return None if value is None else str(value)
+
+def _decode_name(raw):
+    return _NAME_ESCAPE.sub(lambda m: bytes.fromhex(m.group(1).decode("ascii")), bytes(raw)).decode("latin-1")
+
+def _parse_literal_string(buffer, position):
+    """Parses a (string) body starting just after the opening parenthesis."""
+    parts = []
+    depth = 1
+    while True:
+        match = _STRING_SPECIAL.search(buffer, position)
+        if not match:
+            raise PDFSyntaxError("Unterminated string")
+        parts.append(bytes(buffer[position:match.start()]))
+        char = match.group(0)
+        position = match.end()
+        if char == b"(":
+            depth += 1
+            parts.append(b"(")
+        elif char == b")":
+            depth -= 1
+            if depth == 0:
+                return b"".join(parts), position
+            parts.append(b")")
+        else:
+            escaped = buffer[position]
+            if escaped in _ESCAPES:
+                parts.append(_ESCAPES[escaped])
+                position += 1
+            elif 0x30 <= escaped <= 0x37:
+                digits = re.match(rb"[0-7]{1,3}", bytes(buffer[position:position + 3])).group(0)
+                parts.append(bytes([int(digits, 8) & 0xFF]))
+                position += len(digits)
+            elif escaped in (0x0D, 0x0A):
+                # Backslash-newline is a line continuation
+                position += 1
+                if escaped == 0x0D and buffer[position:position + 1] == b"\n":
+                    position += 1
+            else:
+                position += 1
+
+def _png_unpredict(data, columns, colors, bits):
+    """Reverses PNG row predictors (PDF /Predictor 10-15)."""
+    width = (columns * colors * bits + 7) // 8
+    stride = width + 1
+    rows = len(data) // stride
+    if rows == 0:
+        return b""
+    table = np.frombuffer(data[:rows * stride], dtype=np.uint8).reshape(rows, stride)
+    filters, raw = table[:, 0], table[:, 1:]
+    bpp = max(1, colors * bits // 8)
+
+    # Xref streams almost always use Up on every row: a column-wise running sum
+    if np.all(filters == 2):
+        return (np.cumsum(raw, axis=0, dtype=np.uint64) % 256).astype(np.uint8).tobytes()
+
+    out = np.zeros_like(raw)
+    previous = np.zeros(width, dtype=np.int32)
+    for r in range(rows):
+        line = raw[r].astype(np.int32)
+        kind = filters[r]
+        if kind == 2:
+            line = (line + previous) % 256
+        elif kind in (1, 3, 4):
+            result = line.copy()
+            for i in range(width):
+                left = result[i - bpp] if i >= bpp else 0
+                up = previous[i]
+                if kind == 1:
+                    predictor = left
+                elif kind == 3:
+                    predictor = (left + up) // 2
+                else:
+                    upper_left = previous[i - bpp] if i >= bpp else 0
+                    p = left + up - upper_left
+                    pa, pb, pc = abs(p - left), abs(p - up), abs(p - upper_left)
+                    predictor = left if pa <= pb and pa <= pc else up if pb <= pc else upper_left
+                result[i] = (result[i] + predictor) % 256
+            line = result
+        out[r] = line
+        previous = line
+    return out.tobytes()
@@ -0,0 +1,428 @@
+from src.analyzer import ForgeryDetector
+from src.cache import IMAGE_FIELDS, PYRAMID_FIELDS, ResultCache
+from src.converter import DocumentProcessor, PageImage
+from src.copy_move import CopyMoveDetector
+from src import instrumentation
+from src.document import ParsedDocument
+from src.metadata import scan_metadata
+from src.revisions import analyze_revisions, changed_pages
+from src.shared_pages import InProcessTransport
+from src.template_index import page_key
+import cv2
+import io
+import numpy as np
+
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.pdf', '.docx')
+EDITING_SOFTWARE = ["photoshop", "gimp", "adobe"]
+
+# Bumped whenever report contents change, so stale cache entries are not reused
+REPORT_VERSION = 10
+
+# Page tamper score (ForgeryDetector.score_ela) above which a red flag is raised
+TAMPER_SCORE_THRESHOLD = 0.15
+
+# Noise/resampling score (ForgeryDetector.analyze_noise) above which a red flag is raised
+NOISE_SCORE_THRESHOLD = 0.15
+
+# Weight of the ELA evidence in the combined score for pages without JPEG history
+# (PNG uploads, rendered PDF pages), where the ELA map is mostly noise
+NO_JPEG_ELA_WEIGHT = 0.5
+
+# Default page transport: conversion runs inline, in the calling process
+IN_PROCESS = InProcessTransport()
+
+def document_kind(filename):
+    """
+    Classifies a file by extension the same way the Streamlit app does.
+    
+    Args:
+        filename (str): Name or path of the document.
+        
+    Returns:
+        str: 'pdf', 'docx' or 'image'.
+    """
+    name = filename.lower()
+    if name.endswith('.pdf'):
+        return 'pdf'
+    if name.endswith('.docx'):
+        return 'docx'
+    return 'image'
+
+def iter_document_pages(processor, document, filename, dpi=300, pages=None):
+    """
+    Yields the page images of a document, lazily for PDFs.
+    
+    Args:
+        processor (DocumentProcessor): Converter used for PDF and Word files.
+        document (bytes or ParsedDocument): The raw or already parsed document.
+        filename (str): Name of the document, used to pick the converter.
+        dpi (int): Rendering resolution for rasterized PDF pages.
+        pages (iterable): Optional PDF page numbers to restrict conversion to.
+        
+    Yields:
+        PageImage: Each page in BGR format.
+    """
+    document = ParsedDocument.wrap(document, filename)
+    kind = document_kind(filename)
+    if kind == 'pdf':
+        yield from processor.iter_pdf_pages(document, dpi=dpi, pages=pages)
+    elif kind == 'docx':
+        yield PageImage(1, processor.process_word(document))
+    else:
+        file_bytes = document.file_bytes
+        bgr_image = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if bgr_image is None:
+            raise ValueError(f"Could not decode image {filename}")
+        yield PageImage(1, bgr_image, "upload", file_bytes)
+
+def ela_statistics(ela_image):
+    """
+    Summarises a brightened ELA image with a few scalar statistics.
+    
+    Args:
+        ela_image (numpy.ndarray): Output of `ForgeryDetector.perform_ela_array`.
+        
+    Returns:
+        dict: Mean, standard deviation, 99th percentile and maximum intensity.
+    """
+    return {
+        "mean": float(ela_image.mean()),
+        "std": float(ela_image.std()),
+        "p99": float(np.percentile(ela_image, 99)),
+        "max": int(ela_image.max()),
+    }
+
+def document_findings(document, filename, detector=None):
+    """
+    Runs the document-level checks: metadata scan and, for images, EXIF.
+    
+    Args:
+        document (bytes or ParsedDocument): The raw or already parsed document.
+        filename (str): Name of the document.
+        detector (ForgeryDetector): Optional detector instance to reuse.
+        
+    Returns:
+        dict: Report skeleton with 'red_flags', 'metadata' (document
+            properties for PDF and DOCX, EXIF tags for images) and an empty
+            'pages' list, plus the 'sha256' of the file and the saved
+            'revisions' of a PDF.
+    """
+    detector = detector or ForgeryDetector()
+    document = ParsedDocument.wrap(document, filename)
+
+    kind = document_kind(filename)
+    revisions, revision_error = None, None
+    if kind == 'pdf':
+        try:
+            revisions = [revision._asdict() for revision in analyze_revisions(document)]
+        except Exception as e:
+            revision_error = f"Error analyzing PDF revisions: {str(e)}"
+
+    properties = {}
+    report = {
+        "filename": filename,
+        "kind": kind,
+        "sha256": document.sha256,
+        # Revisions flag each incremental update; the metadata scan only counts
+        # them, so it does so only when revision analysis had nothing to say
+        "red_flags": scan_metadata(document, fields=properties, count_updates=not revisions),
+        "metadata": properties,
+        "pages": []
+    }
+
+    if revisions is not None:
+        report["revisions"] = revisions
+        report["red_flags"].extend(revision_red_flags(revisions))
+    if revision_error is not None:
+        report["red_flags"].append(revision_error)
+
+    if report["kind"] == 'image':
+        report["metadata"] = detector.extract_metadata(io.BytesIO(document.file_bytes))
+        software = str(report["metadata"].get('Software', '')).lower()
+        if any(tool in software for tool in EDITING_SOFTWARE):
+            report["red_flags"].append(f"Image EXIF: Editing software detected: {software}")
+
+    return report
+
+def iter_page_reports(document, filename, quality=90, dpi=300, detector=None, processor=None, keep_images=False,
+                      copy_move_detector=None, template_index=None, pages=None, transport=None):
+    """
+    Runs the image detectors on each page, yielding page entries as they are ready.
+    
+    Args:
+        document (bytes or ParsedDocument): The raw or already parsed document.
+        filename (str): Name of the document.
+        quality (int): JPEG quality used for ELA.
+        dpi (int): Rendering resolution for rasterized PDF pages.
+        detector (ForgeryDetector): Optional detector instance to reuse.
+        processor (DocumentProcessor): Optional converter instance to reuse.
+        keep_images (bool): Include the page and ELA arrays (BGR) in each entry.
+        copy_move_detector (CopyMoveDetector): Optional copy-move detector to reuse.
+        template_index (TemplateIndex): Optional index of previously seen pages.
+            Each page is looked up, then added to it.
+        pages (iterable): Optional PDF page numbers to analyze (default: all),
+            see `revision_page_filter`.
+        transport: How pages get from the converter to the detectors. The
+            default converts inline; a `shared_pages.SharedMemoryTransport`
+            converts in a child process, ahead of the analysis, and hands
+            the pages over in shared memory.
+        
+    Yields:
+        dict: Page number, source, dimensions, ELA statistics with the tamper
+            score, the suspicious regions found by `score_ela`, the 'noise'
+            and 'combined' scores and regions from `analyze_noise` and
+            `combine_scores`, cloned region pairs from `CopyMoveDetector`,
+            near-duplicate 'template_matches' when an index is given and, for
+            pages that are stored JPEGs, the `analyze_jpeg_compression` findings.
+            Pages too small for a block-based detector get 'notes' saying
+            which ones were skipped.
+    """
+    detector = detector or ForgeryDetector()
+    processor = processor or DocumentProcessor()
+    copy_move_detector = copy_move_detector or CopyMoveDetector()
+
+    document = ParsedDocument.wrap(document, filename)
+    transport = transport or IN_PROCESS
+    page_images = transport.iter_pages(iter_document_pages, processor, document, filename, dpi, pages)
+    for page, ela_image in detector.iter_page_ela(page_images, quality=quality):
+        scoring = detector.score_ela(ela_image, page.image)
+        entry = {
+            "page_number": page.page_number,
+            "source": page.source,
+            "height": int(page.image.shape[0]),
+            "width": int(page.image.shape[1]),
+            "ela": ela_statistics(ela_image),
+            "regions": scoring["regions"],
+        }
+        entry["ela"]["score"] = scoring["score"]
+
+        # Stored JPEGs (uploads, embedded PDF scans) carry their own history
+        jpeg_history = page.encoded is not None and page.encoded[:2] == b"\xff\xd8"
+        noise = detector.analyze_noise(page.image, jpeg_grid=jpeg_history)
+        combined = detector.combine_scores(scoring, noise, ela_weight=1.0 if jpeg_history else NO_JPEG_ELA_WEIGHT)
+        entry["noise"] = {
+            "score": noise["score"],
+            "regions": noise["regions"],
+            "noise_level": noise["noise_level"],
+            "budget_exhausted": noise["budget_exhausted"],
+        }
+        entry["combined"] = {"score": combined["score"], "regions": combined["regions"]}
+        notes = [
+            f"{name} skipped: the {entry['width']}x{entry['height']} px page is smaller than "
+            f"one {result['block_size']} px analysis block."
+            for name, result in (("ELA scoring", scoring), ("Noise analysis", noise)) if result["skipped"]
+        ]
+        if notes:
+            entry["notes"] = notes
+        entry["copy_move"] = copy_move_detector.detect(page.image)["pairs"]
+
+        if template_index is not None:
+            key = page_key(document.sha256, page.page_number)
+            entry["template_matches"] = template_index.query(page.image, exclude_document=document.sha256)
+            template_index.add(page.image, key, filename)
+
+        if jpeg_history:
+            try:
+                entry["jpeg"] = detector.analyze_jpeg_compression(page.encoded)
+            except ValueError:
+                pass
+        if keep_images:
+            # A shared page buffer is reused once the next page is requested
+            entry["image"] = page.image.copy() if transport.shared else page.image
+            entry["ela_image"] = ela_image
+        yield entry
+
+def analysis_cache_key(document, filename, quality=90, dpi=300, changed_pages_only=False):
+    """Returns the ResultCache key for a document (bytes or ParsedDocument) analyzed with these parameters."""
+    file_bytes = ParsedDocument.wrap(document, filename).file_bytes
+    return ResultCache.make_key(
+        file_bytes, kind=document_kind(filename), quality=quality, dpi=dpi, version=REPORT_VERSION,
+        changed_pages_only=changed_pages_only
+    )
+
+def revision_page_filter(report):
+    """
+    Returns the PDF pages changed by incremental updates, for `changed_pages_only` runs.
+    
+    Args:
+        report (dict): Report from `document_findings`.
+        
+    Returns:
+        list: Page numbers touched by later revisions, or None (analyze every
+            page) if the document was never updated incrementally.
+    """
+    revisions = report.get("revisions") or []
+    if len(revisions) < 2:
+        return None
+    return changed_pages(revisions)
+
+@instrumentation.traced("analyze_document")
+def analyze_document(file_bytes, filename, quality=90, dpi=300, detector=None, processor=None, keep_images=False, cache=None,
+                     template_index=None, changed_pages_only=False, transport=None):
+    """
+    Runs the full forensic pipeline on one document.
+    
+    This is the same sequence the Streamlit app performs: metadata scan, image
+    extraction, ELA on every page and, for plain images, EXIF inspection. The
+    document is wrapped in a single ParsedDocument so the metadata scan and the
+    converter share one PDF/DOCX parse.
+    
+    Args:
+        file_bytes (bytes or ParsedDocument): The raw or already parsed document.
+        filename (str): Name of the document.
+        quality (int): JPEG quality used for ELA.
+        dpi (int): Rendering resolution for rasterized PDF pages.
+        detector (ForgeryDetector): Optional detector instance to reuse.
+        processor (DocumentProcessor): Optional converter instance to reuse.
+        keep_images (bool): Keep the page and ELA images in the report.
+        cache (ResultCache): Optional result cache. Cached reports always carry
+            the page images, as PNG bytes rather than arrays.
+        template_index (TemplateIndex): Optional near-duplicate index. Cached
+            reports keep the matches found when they were first analyzed.
+        changed_pages_only (bool): For PDFs with incremental updates, only
+            rasterize and analyze the pages later revisions changed.
+        transport: Page transport between conversion and analysis, see
+            `iter_page_reports`.
+        
+    Returns:
+        dict: Report with 'red_flags', 'metadata' and one entry per page.
+    """
+    document = ParsedDocument.wrap(file_bytes, filename)
+
+    if cache is not None:
+        key = analysis_cache_key(document, filename, quality=quality, dpi=dpi, changed_pages_only=changed_pages_only)
+        report = cache.get(key)
+        if report is None:
+            report = analyze_document(
+                document, filename, quality, dpi, detector, processor, keep_images=True, template_index=template_index,
+                changed_pages_only=changed_pages_only, transport=transport
+            )
+            report = cache.put(key, report)
+        if not keep_images:
+            report = strip_page_images(report)
+        return report
+
+    report = document_findings(document, filename, detector=detector)
+    pages = revision_page_filter(report) if changed_pages_only else None
+    report["pages"] = list(iter_page_reports(
+        document, filename, quality=quality, dpi=dpi,
+        detector=detector, processor=processor, keep_images=keep_images, template_index=template_index,
+        pages=pages, transport=transport
+    ))
+    finalize_report(report)
+    return report
+
+def revision_red_flags(revisions):
+    """
+    Returns one red flag per incremental update, naming what it changed.
+    
+    Args:
+        revisions (list): The report's 'revisions' (dicts of `Revision` fields).
+        
+    Returns:
+        list: Red flag messages.
+    """
+    red_flags = []
+    for revision in revisions[1:]:
+        details = [f"{revision['object_count']} object(s)"]
+        if revision["pages"]:
+            details.append("page(s) " + ", ".join(str(n) for n in revision["pages"]))
+        if revision["added_pages"]:
+            details.append("added page(s) " + ", ".join(str(n) for n in revision["added_pages"]))
+        if revision["fonts"]:
+            details.append("font(s) " + ", ".join(revision["fonts"]))
+        if revision["deleted"]:
+            details.append(f"{len(revision['deleted'])} deleted object(s)")
+        red_flags.append(
+            f"Revision {revision['index']}: Incremental update at bytes {revision['start']}-{revision['end']} "
+            f"changed {'; '.join(details)}."
+        )
+    return red_flags
+
+def page_red_flags(page):
+    """
+    Returns the red flags raised by a page's ELA score, cloned regions, template matches and JPEG history.
+    
+    Args:
+        page (dict): A page entry from `iter_page_reports`.
+        
+    Returns:
+        list: Red flag messages for this page.
+    """
+    red_flags = []
+    number = page["page_number"]
+
+    score = page["ela"].get("score", 0.0)
+    if score >= TAMPER_SCORE_THRESHOLD:
+        red_flags.append(
+            f"ELA: Localized error-level anomaly on page {number} "
+            f"(tamper score {score:.2f}, {len(page['regions'])} suspicious region(s))."
+        )
+
+    noise = page.get("noise")
+    if noise and noise["score"] >= NOISE_SCORE_THRESHOLD:
+        red_flags.append(
+            f"Noise: Inconsistent sensor noise or resampling traces on page {number} "
+            f"(score {noise['score']:.2f}, {len(noise['regions'])} region(s); "
+            f"combined score {page['combined']['score']:.2f})."
+        )
+
+    for pair in page.get("copy_move", []):
+        x, y = pair["source"][:2]
+        tx, ty = pair["target"][:2]
+        red_flags.append(
+            f"Copy-move: Region at ({x}, {y}) appears cloned to ({tx}, {ty}) on page {number} "
+            f"({pair['matches']} matching keypoints, similarity {pair['similarity']:.2f})."
+        )
+
+    matches = page.get("template_matches")
+    if matches:
+        best = matches[0]
+        red_flags.append(
+            f"Template: Page {number} is a near-duplicate of previously seen '{best['label']}' "
+            f"(hash distance {best['distance']}, {len(best['differing_regions'])} differing region(s))."
+        )
+
+    jpeg = page.get("jpeg")
+    if jpeg and jpeg["double_compressed"]:
+        red_flags.append(
+            f"JPEG: Double compression detected on page {number} "
+            f"(score {jpeg['double_compression_score']:.2f}, last saved at ~{jpeg['quality_estimate']}% quality)."
+        )
+    if jpeg and jpeg["grid_misaligned"]:
+        dx, dy = jpeg["grid_offset"]
+        red_flags.append(
+            f"JPEG: Traces of an earlier compression grid shifted by ({dx}, {dy}) px on page {number}; "
+            "content was cropped or moved after being saved."
+        )
+    return red_flags
+
+def finalize_report(report):
+    """
+    Folds the page results into the document-level verdict.
+    
+    Adds the red flags of every page and the document 'tamper_score' (the
+    highest ELA or combined page score), which batch tooling sorts by.
+    
+    Args:
+        report (dict): Report whose 'pages' have all been analyzed; updated in place.
+        
+    Returns:
+        dict: The same report.
+    """
+    for page in report["pages"]:
+        report["red_flags"].extend(page_red_flags(page))
+    report["tamper_score"] = max(
+        (max(page["ela"].get("score", 0.0), page.get("combined", {}).get("score", 0.0)) for page in report["pages"]),
+        default=0.0
+    )
+    return report
+
+def strip_page_images(report):
+    """Returns a copy of a report without the heavy per-page image and pyramid fields."""
+    report = dict(report)
+    report["pages"] = [
+        {k: v for k, v in page.items() if k not in IMAGE_FIELDS and k not in PYRAMID_FIELDS}
+        for page in report["pages"]
+    ]
+    return report
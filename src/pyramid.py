@@ -0,0 +1,201 @@
+"""
+Multi-resolution image pyramids for displaying analysis results.
+
+A 300-DPI page is about 25 MB of raw pixels, far more than a browser needs to
+show it. A pyramid is built once per analyzed image: a small preview for the
+page view, plus tiled levels (full resolution, then halved until one tile
+covers the page) for zooming. Everything is stored encoded, so a pyramid is a
+plain dict of a few hundred KB that can be cached, pickled and served, and a
+zoomed view decodes only the handful of tiles it covers.
+"""
+import cv2
+import numpy as np
+import math
+
+TILE_SIZE = 512
+PREVIEW_SIDE = 1024
+
+# Tiles are numerous, so they use the fast JPEG encoder; the single preview
+# uses WebP where OpenCV was built with it. Images whose pixel values are the
+# evidence (ELA maps) are built losslessly as PNG instead.
+TILE_FORMAT = "jpg"
+PREVIEW_FORMAT = "webp" if cv2.haveImageWriter(".webp") else "jpg"
+
+MEDIA_TYPES = {"jpg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+def _encode(image, fmt, quality):
+    if fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif fmt == "jpg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    else:
+        params = []
+    success, buffer = cv2.imencode("." + fmt, image, params)
+    if not success:
+        raise ValueError(f"Could not encode pyramid image as {fmt}")
+    return buffer.tobytes()
+
+def decode_image(data):
+    """Decodes a preview or tile to a BGR (or grayscale) array."""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+def _shrink(image, max_side):
+    height, width = image.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    if scale == 1.0:
+        return image, 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+def build_pyramid(image, tile_size=TILE_SIZE, preview_side=PREVIEW_SIDE, quality=85, image_format=None):
+    """
+    Builds the encoded preview and tile levels for an image.
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image, e.g. a page or its ELA map.
+        tile_size (int): Tile edge in pixels.
+        preview_side (int): Longest side of the preview.
+        quality (int): JPEG/WebP quality for the preview and tiles.
+        image_format (str): Encoding for both the preview and the tiles, a
+            key of MEDIA_TYPES (e.g. "png" for lossless levels). Defaults to
+            TILE_FORMAT tiles and a PREVIEW_FORMAT preview.
+
+    Returns:
+        dict: 'width', 'height', 'tile_size', 'format', 'preview' (encoded
+            bytes), 'preview_format', 'preview_scale' and 'levels', finest
+            first. Each level has its 'scale', 'width', 'height', 'columns',
+            'rows' and 'tiles', a row-major list of rows of encoded tiles.
+    """
+    if image is None or image.size == 0:
+        raise ValueError("Cannot build a pyramid for an empty image")
+    if image.ndim == 3 and image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+    if image_format is not None and image_format not in MEDIA_TYPES:
+        raise ValueError(f"Unsupported pyramid format: {image_format}")
+    tile_format = image_format or TILE_FORMAT
+    preview_format = image_format or PREVIEW_FORMAT
+
+    height, width = image.shape[:2]
+    preview, preview_scale = _shrink(image, preview_side)
+    pyramid = {
+        "width": width,
+        "height": height,
+        "tile_size": tile_size,
+        "format": tile_format,
+        "preview": _encode(preview, preview_format, quality),
+        "preview_format": preview_format,
+        "preview_scale": preview_scale,
+        "levels": [],
+    }
+
+    level_image = image
+    scale = 1.0
+    while True:
+        level_height, level_width = level_image.shape[:2]
+        columns, rows = math.ceil(level_width / tile_size), math.ceil(level_height / tile_size)
+        tiles = [
+            [_encode(level_image[r * tile_size:(r + 1) * tile_size, c * tile_size:(c + 1) * tile_size],
+                     tile_format, quality) for c in range(columns)]
+            for r in range(rows)
+        ]
+        pyramid["levels"].append({
+            "scale": scale,
+            "width": level_width,
+            "height": level_height,
+            "columns": columns,
+            "rows": rows,
+            "tiles": tiles,
+        })
+        if columns == 1 and rows == 1:
+            return pyramid
+        level_image = cv2.resize(
+            level_image, (max(1, level_width // 2), max(1, level_height // 2)), interpolation=cv2.INTER_AREA
+        )
+        scale /= 2.0
+
+def pyramid_info(pyramid):
+    """Returns a pyramid's geometry without any image data (e.g. to send as JSON)."""
+    info = {k: v for k, v in pyramid.items() if k not in ("preview", "levels")}
+    info["levels"] = [{k: v for k, v in level.items() if k != "tiles"} for level in pyramid["levels"]]
+    return info
+
+def pyramid_size(pyramid):
+    """Total encoded bytes held by a pyramid."""
+    return len(pyramid.get("preview") or b"") + sum(
+        len(tile) for level in pyramid["levels"] for row in level.get("tiles", []) for tile in row
+    )
+
+def choose_level(pyramid, width, height, max_side):
+    """
+    Picks the finest level at which a region fits in `max_side` pixels.
+
+    Args:
+        pyramid (dict): Pyramid or its `pyramid_info`.
+        width (int): Region width in full-resolution pixels.
+        height (int): Region height in full-resolution pixels.
+        max_side (int): Largest side wanted for the rendered region.
+
+    Returns:
+        int: Index into the pyramid's 'levels'.
+    """
+    for index, level in enumerate(pyramid["levels"]):
+        if max(width, height) * level["scale"] <= max_side:
+            return index
+    return len(pyramid["levels"]) - 1
+
+def tiles_for_region(pyramid, level, x, y, width, height):
+    """
+    Lists the tiles of one level that cover a full-resolution region.
+
+    Returns:
+        list: (column, row) pairs.
+    """
+    info = pyramid["levels"][level]
+    tile_size = pyramid["tile_size"]
+    scale = info["scale"]
+    first_column = max(0, int(x * scale) // tile_size)
+    first_row = max(0, int(y * scale) // tile_size)
+    last_column = min(info["columns"] - 1, max(0, math.ceil((x + width) * scale) - 1) // tile_size)
+    last_row = min(info["rows"] - 1, max(0, math.ceil((y + height) * scale) - 1) // tile_size)
+    return [(c, r) for r in range(first_row, last_row + 1) for c in range(first_column, last_column + 1)]
+
+def render_region(pyramid, x, y, width, height, max_side=PREVIEW_SIDE, fetch_tile=None):
+    """
+    Assembles a view of a full-resolution region from the fewest tiles.
+
+    Args:
+        pyramid (dict): Pyramid, or its `pyramid_info` when `fetch_tile` is given.
+        x, y, width, height (int): Region in full-resolution pixels; clipped to the image.
+        max_side (int): Largest side of the returned view; picks the level.
+        fetch_tile (callable): Optional `fetch_tile(level, column, row)` returning
+            encoded tile bytes, e.g. from the HTTP service. By default tiles are
+            read from the pyramid itself.
+
+    Returns:
+        numpy.ndarray: The region at the chosen level's resolution.
+    """
+    x, y = max(0, int(x)), max(0, int(y))
+    width = max(1, min(int(width), pyramid["width"] - x))
+    height = max(1, min(int(height), pyramid["height"] - y))
+    level = choose_level(pyramid, width, height, max_side)
+    info = pyramid["levels"][level]
+    tile_size = pyramid["tile_size"]
+    scale = info["scale"]
+
+    tiles = tiles_for_region(pyramid, level, x, y, width, height)
+    first_column, first_row = tiles[0]
+    last_column, last_row = tiles[-1]
+    canvas = None
+    for column, row in tiles:
+        data = fetch_tile(level, column, row) if fetch_tile is not None else info["tiles"][row][column]
+        tile = decode_image(data)
+        if canvas is None:
+            shape = ((last_row - first_row + 1) * tile_size, (last_column - first_column + 1) * tile_size)
+            canvas = np.zeros(shape + tile.shape[2:], dtype=tile.dtype)
+        top, left = (row - first_row) * tile_size, (column - first_column) * tile_size
+        canvas[top:top + tile.shape[0], left:left + tile.shape[1]] = tile
+
+    left = int(x * scale) - first_column * tile_size
+    top = int(y * scale) - first_row * tile_size
+    return canvas[top:top + max(1, round(height * scale)), left:left + max(1, round(width * scale))]
@@ -0,0 +1,415 @@
+"""
+Persistent history of analysis reports.
+
+Reports otherwise live only as long as a Streamlit rerun or a JSONL line, so
+questions like "every PDF with Photoshop in its Producer and a tamper score
+above 0.3 last month" can't be answered. `ReportStore` keeps one row per
+analyzed document in SQLite: scalar features (hashes, metadata fields,
+scores, timings) as indexed columns, red flags and per-page scores in their
+own indexed tables, and the full report as compressed JSON. The heavy ELA
+maps are kept out of the database in an `ArrayStore`: compressed `.npz`
+files of row bands, named by the hash of the array's contents, so identical
+maps are stored once and a region can be read without decompressing the
+whole page.
+"""
+from src.cache import IMAGE_FIELDS, PYRAMID_FIELDS, decode_page_image, default_cache_dir
+from src.pipeline import REPORT_VERSION
+import numpy as np
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+# Rows of an array per compressed chunk in the ArrayStore
+CHUNK_ROWS = 512
+
+# Scalar columns of the reports table, in insert order
+REPORT_COLUMNS = (
+    "analyzed", "path", "filename", "kind", "sha256", "status", "error", "elapsed", "version",
+    "tamper_score", "max_ela_score", "max_noise_score", "max_combined_score",
+    "page_count", "red_flag_count", "revision_count",
+    "producer", "creator", "author", "created", "modified",
+)
+
+# Report metadata keys feeding each metadata column, first match wins:
+# PDF Info/XMP, DOCX properties and image EXIF tags
+METADATA_COLUMNS = {
+    "producer": ("Producer", "Application", "Software", "Software (Info)"),
+    "creator": ("Creator", "CreatorTool", "LastModifiedBy"),
+    "author": ("Author",),
+    "created": ("CreationDate", "DateTimeOriginal"),
+    "modified": ("ModDate", "DateTime"),
+}
+
+def default_store_path():
+    """Returns the shared report store location (override with FORGERY_REPORT_STORE)."""
+    return os.environ.get("FORGERY_REPORT_STORE", os.path.join(default_cache_dir(), "reports.sqlite"))
+
+def flag_category(message):
+    """
+    Reduces a red flag message to its category, e.g. 'ELA', 'Revision' or 'Suspicious keyword'.
+
+    Args:
+        message (str): A red flag from a report.
+
+    Returns:
+        str: The text before the first ':' without counters or quoted values.
+    """
+    head = message.split(":", 1)[0]
+    head = head.split(" '", 1)[0]
+    return re.sub(r"\s+\d+$", "", head).strip()
+
+class ArrayStore:
+    """
+    Content-addressed store of compressed arrays on disk.
+
+    Each array is saved once as `<hash[:2]>/<hash>.npz`, split into bands of
+    `chunk_rows` rows that are compressed separately, so reading a few rows
+    only decompresses the bands that hold them. Writes go through a temporary
+    file and a rename, so several processes can share one directory.
+    """
+
+    def __init__(self, directory, chunk_rows=CHUNK_ROWS):
+        """
+        Args:
+            directory (str): Root folder (created if missing).
+            chunk_rows (int): Rows per compressed band.
+        """
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(array):
+        """Hex SHA-256 of an array's dtype, shape and contents."""
+        digest = hashlib.sha256(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(np.ascontiguousarray(array).data)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.npz")
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, array):
+        """
+        Stores an array unless an identical one is already present.
+
+        Args:
+            array (numpy.ndarray): Array to store.
+
+        Returns:
+            str: Its key.
+        """
+        key = self.key(array)
+        path = self.path(key)
+        if os.path.exists(path):
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        chunks = {f"rows_{i}": array[start:start + self.chunk_rows]
+                  for i, start in enumerate(range(0, max(len(array), 1), self.chunk_rows))}
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, shape=np.array(array.shape), chunk_rows=self.chunk_rows, **chunks)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return key
+
+    def get(self, key, rows=None):
+        """
+        Loads a stored array, or only some of its rows.
+
+        Args:
+            key (str): Key returned by `put`.
+            rows (slice): Optional row range (step 1); only the bands covering it are read.
+
+        Returns:
+            numpy.ndarray: The array or the requested rows.
+        """
+        with np.load(self.path(key)) as stored:
+            shape = tuple(int(n) for n in stored["shape"])
+            chunk_rows = int(stored["chunk_rows"])
+            start, stop, _ = (rows or slice(None)).indices(shape[0] if shape else 0)
+            if stop <= start:
+                return stored["rows_0"][:0]
+            first, last = start // chunk_rows, (stop - 1) // chunk_rows
+            bands = [stored[f"rows_{i}"] for i in range(first, last + 1)]
+        array = bands[0] if len(bands) == 1 else np.concatenate(bands)
+        offset = first * chunk_rows
+        return array[start - offset:stop - offset]
+
+class ReportStore:
+    """
+    Append-only SQLite store of analysis reports with indexed scalar features.
+
+    Every `add` appends; analyzing a document again adds a second row, so the
+    store keeps the full history. Query filters map onto indexed columns
+    (analysis time, kind, scores, metadata fields, red flag categories).
+    """
+
+    def __init__(self, path, array_dir=None):
+        """
+        Args:
+            path (str): SQLite database file (created if missing), or ':memory:'.
+            array_dir (str): Folder for ELA maps (default: next to the
+                database; None with ':memory:' keeps no arrays).
+        """
+        if path != ":memory:":
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            array_dir = array_dir or os.path.splitext(os.path.abspath(path))[0] + "_arrays"
+        self.path = path
+        self.arrays = ArrayStore(array_dir) if array_dir else None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{name} {self._column_type(name)}" for name in REPORT_COLUMNS)
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS reports (id INTEGER PRIMARY KEY, {columns}, report BLOB NOT NULL);
+            CREATE INDEX IF NOT EXISTS reports_analyzed ON reports (analyzed);
+            CREATE INDEX IF NOT EXISTS reports_kind ON reports (kind, analyzed);
+            CREATE INDEX IF NOT EXISTS reports_tamper_score ON reports (tamper_score);
+            CREATE INDEX IF NOT EXISTS reports_sha256 ON reports (sha256);
+            CREATE INDEX IF NOT EXISTS reports_path ON reports (path);
+            CREATE INDEX IF NOT EXISTS reports_producer ON reports (producer COLLATE NOCASE);
+            CREATE TABLE IF NOT EXISTS red_flags (
+                report_id INTEGER NOT NULL, category TEXT NOT NULL, message TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS red_flags_category ON red_flags (category, report_id);
+            CREATE INDEX IF NOT EXISTS red_flags_report ON red_flags (report_id);
+            CREATE TABLE IF NOT EXISTS pages (
+                report_id INTEGER NOT NULL, page_number INTEGER NOT NULL,
+                ela_score REAL, noise_score REAL, combined_score REAL,
+                region_count INTEGER, copy_move_count INTEGER, jpeg_quality INTEGER, double_compressed INTEGER,
+                ela_map TEXT, PRIMARY KEY (report_id, page_number)) WITHOUT ROWID;
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _column_type(name):
+        if name in ("analyzed", "elapsed", "tamper_score", "max_ela_score", "max_noise_score", "max_combined_score"):
+            return "REAL"
+        if name in ("version", "page_count", "red_flag_count", "revision_count"):
+            return "INTEGER"
+        return "TEXT"
+
+    def add(self, report, analyzed=None):
+        """
+        Appends one report; see `add_many`.
+
+        Returns:
+            int: The new report id.
+        """
+        return self.add_many([report], analyzed=analyzed)[0]
+
+    def add_many(self, reports, analyzed=None):
+        """
+        Appends reports in a single transaction.
+
+        Page ELA maps ('ela_image' arrays or PNG bytes) are moved to the
+        array store and replaced by their key in 'ela_map'; other image and
+        pyramid fields are dropped. Batch records (with 'path', 'status',
+        'error' and 'elapsed') are stored as they are.
+
+        Args:
+            reports (iterable): Report dicts from `analyze_document` or batch records.
+            analyzed (float): Unix time of the analysis (default: now, or the
+                report's own 'analyzed' value).
+
+        Returns:
+            list: The new report ids, in order.
+        """
+        now = time.time()
+        prepared = [self._prepare(report, analyzed or report.get("analyzed") or now) for report in reports]
+        if not prepared:
+            return []
+        placeholders = ", ".join("?" * (len(REPORT_COLUMNS) + 2))
+        with self._lock:
+            # Ids are assigned up front so the flag and page rows can be bulk inserted too
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                first_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM reports").fetchone()[0]
+                ids = list(range(first_id, first_id + len(prepared)))
+                self._conn.executemany(
+                    f"INSERT INTO reports (id, {', '.join(REPORT_COLUMNS)}, report) VALUES ({placeholders})",
+                    [[report_id] + row + [blob] for report_id, (row, blob, _, _) in zip(ids, prepared)]
+                )
+                self._conn.executemany(
+                    "INSERT INTO red_flags (report_id, category, message) VALUES (?, ?, ?)",
+                    [(report_id, flag_category(message), message)
+                     for report_id, (_, _, flags, _) in zip(ids, prepared) for message in flags]
+                )
+                self._conn.executemany(
+                    "INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [[report_id] + page for report_id, (_, _, _, pages) in zip(ids, prepared) for page in pages]
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return ids
+
+    def query(self, since=None, until=None, kind=None, min_tamper_score=None, max_tamper_score=None, producer=None,
+              creator=None, flag=None, filename=None, sha256=None, status=None, limit=100, offset=0):
+        """
+        Finds reports by their scalar features, newest first.
+
+        Text filters on metadata and file names match substrings, ignoring
+        case; combine them with a time range or score threshold to keep the
+        search on an index.
+
+        Args:
+            since (float or datetime): Analyzed at or after this time.
+            until (float or datetime): Analyzed before this time.
+            kind (str): 'pdf', 'docx' or 'image'.
+            min_tamper_score (float): Lowest document tamper score.
+            max_tamper_score (float): Highest document tamper score.
+            producer (str): Text in the producing software (PDF Producer,
+                DOCX Application or EXIF Software).
+            creator (str): Text in the creating software or last editor.
+            flag (str): Red flag category (see `flag_category`), e.g. 'ELA'.
+            filename (str): Text in the file name.
+            sha256 (str): Exact document hash.
+            status (str): Batch record status, e.g. 'error'.
+            limit (int): Maximum number of rows.
+            offset (int): Rows to skip, for paging.
+
+        Returns:
+            list: One dict of scalar columns (plus 'id') per report.
+        """
+        where, params = self._filters(locals())
+        sql = f"SELECT id, {', '.join(REPORT_COLUMNS)} FROM reports {where} ORDER BY analyzed DESC, id DESC LIMIT ? OFFSET ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit, offset]).fetchall()
+        return [dict(zip(("id",) + REPORT_COLUMNS, row)) for row in rows]
+
+    def count(self, **filters):
+        """Number of reports matching `query` filters."""
+        where, params = self._filters(filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM reports {where}", params).fetchone()[0]
+
+    def get(self, report_id):
+        """
+        Loads a stored report.
+
+        Returns:
+            dict: The report as stored (pages carry 'ela_map' keys instead of
+                images; see `load_ela_map`), or None if the id is unknown.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT report FROM reports WHERE id = ?", (report_id,)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
+
+    def red_flags(self, report_id):
+        """Returns the red flags of a stored report."""
+        with self._lock:
+            rows = self._conn.execute("SELECT message FROM red_flags WHERE report_id = ?", (report_id,)).fetchall()
+        return [message for (message,) in rows]
+
+    def load_ela_map(self, key, rows=None):
+        """Loads a page's ELA map (or a row range of it) by its 'ela_map' key."""
+        if self.arrays is None:
+            raise KeyError("This report store keeps no arrays")
+        return self.arrays.get(key, rows=rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def _filters(self, filters):
+        clauses, params = [], []
+        for name, op in (("since", ">="), ("until", "<")):
+            value = filters.get(name)
+            if value is not None:
+                clauses.append(f"analyzed {op} ?")
+                params.append(value.timestamp() if hasattr(value, "timestamp") else float(value))
+        for name, column, op in (("min_tamper_score", "tamper_score", ">="), ("max_tamper_score", "tamper_score", "<="),
+                                 ("kind", "kind", "="), ("sha256", "sha256", "="), ("status", "status", "=")):
+            value = filters.get(name)
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        for name in ("producer", "creator", "filename"):
+            value = filters.get(name)
+            if value:
+                clauses.append(f"{name} LIKE ? ESCAPE '\\'")
+                params.append("%" + re.sub(r"([%_\\])", r"\\\1", value) + "%")
+        if filters.get("flag"):
+            clauses.append("id IN (SELECT report_id FROM red_flags WHERE category = ?)")
+            params.append(filters["flag"])
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _prepare(self, report, analyzed):
+        """Splits a report into its reports row, compressed JSON, red flags and page rows."""
+        pages, page_rows = [], []
+        for page in report.get("pages", []):
+            ela_map = page.get("ela_map")
+            ela_image = page.get("ela_image")
+            if ela_map is None and ela_image is not None and self.arrays is not None:
+                if not isinstance(ela_image, np.ndarray):
+                    ela_image = decode_page_image(ela_image)
+                ela_map = self.arrays.put(ela_image)
+            page = {k: v for k, v in page.items() if k not in IMAGE_FIELDS and k not in PYRAMID_FIELDS}
+            if ela_map is not None:
+                page["ela_map"] = ela_map
+            pages.append(page)
+
+            jpeg = page.get("jpeg") or {}
+            page_rows.append([
+                page.get("page_number"),
+                page.get("ela", {}).get("score"),
+                page.get("noise", {}).get("score"),
+                page.get("combined", {}).get("score"),
+                len(page.get("regions", [])),
+                len(page.get("copy_move", [])),
+                jpeg.get("quality_estimate"),
+                None if not jpeg else int(bool(jpeg.get("double_compressed"))),
+                ela_map,
+            ])
+
+        stored = dict(report, pages=pages, analyzed=analyzed)
+        metadata = report.get("metadata") or {}
+        red_flags = report.get("red_flags") or []
+        values = {
+            "analyzed": analyzed,
+            "version": REPORT_VERSION,
+            "page_count": len(pages),
+            "red_flag_count": len(red_flags),
+            "revision_count": max(0, len(report.get("revisions") or []) - 1),
+            "max_ela_score": _max_score(pages, "ela"),
+            "max_noise_score": _max_score(pages, "noise"),
+            "max_combined_score": _max_score(pages, "combined"),
+        }
+        for column, keys in METADATA_COLUMNS.items():
+            values[column] = next((str(metadata[key]) for key in keys if metadata.get(key)), None)
+        for column in ("path", "filename", "kind", "sha256", "status", "error", "elapsed", "tamper_score"):
+            values[column] = report.get(column)
+        if values["status"] is None:
+            values["status"] = "ok"
+
+        blob = zlib.compress(json.dumps(stored, default=_json_default).encode(), 6)
+        return [values[column] for column in REPORT_COLUMNS], blob, list(red_flags), page_rows
+
+def _max_score(pages, field):
+    scores = [page[field]["score"] for page in pages if isinstance(page.get(field), dict) and "score" in page[field]]
+    return max(scores) if scores else None
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (bytes, bytearray)):
+        return None
+    return str(value)
@@ -0,0 +1,229 @@
+"""
+Revision analysis for PDFs saved with incremental updates.
+
+Every incremental save appends the changed objects, a new cross-reference
+section and a `startxref ... %%EOF` trailer to the end of the file, leaving
+the earlier bytes untouched. Scanning the file for those trailers recovers
+each saved revision, and its cross-reference section tells exactly which
+objects it replaced. Mapping those objects onto the page tree shows which
+pages and fonts a later save touched, without rendering anything.
+"""
+from src import instrumentation
+from src.document import ParsedDocument
+from src.pdf_structure import PdfStructure, PDFSyntaxError, Ref, Stream, decode_text
+from collections import namedtuple
+import re
+
+_TRAILER = re.compile(rb"startxref[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]*%%EOF")
+
+# Keys that point back up the page tree rather than at page content
+_UPWARD_KEYS = {"Parent", "P", "Dest", "A"}
+
+# Object numbers above this many in one revision are summarised by count only
+MAX_LISTED_OBJECTS = 1000
+
+Revision = namedtuple(
+    "Revision",
+    ["index", "start", "end", "xref_offsets", "object_count", "objects", "deleted", "pages", "added_pages", "fonts"],
+)
+Revision.__doc__ = """
+One saved revision of a PDF.
+
+`start`/`end` are the byte range it occupies. `objects` and `deleted` list
+the object numbers it (re)defined or freed, `pages` the 1-based numbers of
+existing pages whose content, resources or annotations it changed,
+`added_pages` the pages it introduced and `fonts` the fonts it (re)defined.
+Object, page and font details are only filled in for later revisions; the
+original revision reports its object count.
+"""
+
+def _as_buffer(source):
+    if isinstance(source, ParsedDocument):
+        return memoryview(source.file_bytes)
+    if isinstance(source, (bytes, bytearray)):
+        return memoryview(source)
+    return source
+
+def find_trailers(buffer):
+    """
+    Finds every `startxref N %%EOF` trailer by scanning the bytes.
+
+    Args:
+        buffer: The file as bytes, memoryview or mmap.
+
+    Returns:
+        list: (xref offset, end of the %%EOF marker) tuples in file order.
+    """
+    return [(int(match.group(1)), match.end()) for match in _TRAILER.finditer(buffer)]
+
+@instrumentation.traced("revisions.analyze")
+def analyze_revisions(source):
+    """
+    Splits a PDF into its saved revisions and reports what each later one changed.
+
+    Args:
+        source (bytes, memoryview, mmap or ParsedDocument): The PDF.
+
+    Returns:
+        list: Revision tuples, oldest first. A file without incremental
+            updates yields a single revision; a file whose trailers cannot be
+            read yields an empty list.
+    """
+    buffer = _as_buffer(source)
+    structure = source.pdf_structure if isinstance(source, ParsedDocument) else PdfStructure(buffer)
+
+    # Each trailer's /Prev chain covers its own revision and all older ones;
+    # the sections not seen in an earlier trailer belong to this revision.
+    # (A linearized file's first-page trailer points at offset 0 and is
+    # skipped, so its two sections fold into the original revision.)
+    groups = []
+    seen = set()
+    for xref_offset, end in find_trailers(buffer):
+        if xref_offset == 0 or xref_offset in seen:
+            continue
+        try:
+            chain = structure.chain(xref_offset)
+        except PDFSyntaxError:
+            # e.g. the trailer of a PDF embedded as a file attachment
+            continue
+        new = [section for section in chain if section.offset not in seen]
+        if not new:
+            continue
+        seen.update(section.offset for section in new)
+        groups.append((end, new))
+
+    if not groups:
+        return []
+
+    pages = None
+    revisions = []
+    defined = set()
+    start = 0
+    for index, (end, sections) in enumerate(groups):
+        entries = {}
+        # Oldest section first, so a newer entry for the same number wins
+        for section in reversed(sections):
+            for entry in section.entries():
+                if entry.number not in entries or entry.type != 0:
+                    entries[entry.number] = entry
+        objects = sorted(number for number, entry in entries.items() if entry.type != 0 and number != 0)
+        deleted = sorted(number for number, entry in entries.items() if entry.type == 0 and number in defined)
+
+        changed_pages, added_pages, fonts = [], [], []
+        if index > 0:
+            if pages is None:
+                pages = _page_dependencies(structure)
+            changed = set(objects) | set(deleted)
+            for page_number, (page_object, dependencies) in enumerate(pages, start=1):
+                if page_object not in defined and page_object in changed:
+                    added_pages.append(page_number)
+                elif changed & dependencies:
+                    changed_pages.append(page_number)
+            fonts = _font_names(structure, [entries[number] for number in objects])
+
+        revisions.append(Revision(
+            index=index,
+            start=start,
+            end=end,
+            xref_offsets=[section.offset for section in sections],
+            object_count=len(objects),
+            objects=objects[:MAX_LISTED_OBJECTS] if index > 0 else [],
+            deleted=deleted,
+            pages=changed_pages,
+            added_pages=added_pages,
+            fonts=fonts,
+        ))
+        defined.update(objects)
+        start = end
+    return revisions
+
+def changed_pages(revisions):
+    """
+    Returns the pages touched by any revision after the original.
+
+    Args:
+        revisions (list): Output of `analyze_revisions`, as Revision tuples or
+            the dicts stored in a report.
+
+    Returns:
+        list: Sorted 1-based page numbers (empty if there are no later revisions).
+    """
+    pages = set()
+    for revision in revisions[1:]:
+        revision = revision._asdict() if isinstance(revision, Revision) else revision
+        pages.update(revision["pages"])
+        pages.update(revision["added_pages"])
+    return sorted(pages)
+
+def _page_dependencies(structure):
+    """
+    Walks the current page tree.
+
+    Returns:
+        list: One (page object number, object numbers its rendering depends on)
+            pair per page, in page order.
+    """
+    catalog = structure.resolve(structure.trailer.get("Root"))
+    root = catalog.get("Pages") if isinstance(catalog, dict) else None
+    pages = []
+    visited_nodes = set()
+
+    def walk(reference, inherited):
+        if not isinstance(reference, Ref) or reference.number in visited_nodes:
+            return
+        visited_nodes.add(reference.number)
+        node = structure.resolve(reference)
+        if not isinstance(node, dict):
+            return
+        inherited = dict(inherited)
+        # Resources may be inherited from any ancestor node
+        if "Resources" in node:
+            inherited["Resources"] = node["Resources"]
+        if node.get("Type") == "Pages" or "Kids" in node:
+            for kid in structure.resolve(node.get("Kids")) or []:
+                walk(kid, inherited)
+            return
+        # Page tree nodes are left out: adding a page rewrites them without
+        # changing the content of the other pages
+        dependencies = {reference.number}
+        _collect_references(structure, node, dependencies, depth=0)
+        _collect_references(structure, inherited.get("Resources"), dependencies, depth=0)
+        pages.append((reference.number, dependencies))
+
+    walk(root, {})
+    return pages
+
+def _collect_references(structure, value, found, depth):
+    """Adds the numbers of every object reachable from `value` (not going back up the tree) to `found`."""
+    if depth > 32:
+        return
+    if isinstance(value, Ref):
+        if value.number in found:
+            return
+        found.add(value.number)
+        value = structure.get_object(value.number)
+    if isinstance(value, Stream):
+        value = value.dictionary
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key not in _UPWARD_KEYS:
+                _collect_references(structure, item, found, depth + 1)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_references(structure, item, found, depth + 1)
+
+def _font_names(structure, entries):
+    """Names the fonts and font descriptors among a revision's objects, as stored in that revision."""
+    names = set()
+    for entry in entries:
+        try:
+            value = structure.load_entry(entry)
+        except PDFSyntaxError:
+            continue
+        if isinstance(value, Stream) or not isinstance(value, dict):
+            continue
+        if value.get("Type") == "Font" and value.get("BaseFont"):
+            names.add(decode_text(value["BaseFont"]))
+        elif value.get("Type") == "FontDescriptor" and value.get("FontName"):
+            names.add(decode_text(value["FontName"]))
+    return sorted(names)
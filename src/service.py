@@ -0,0 +1,586 @@
+"""
+Headless HTTP analysis service.
+
+Usage:
+    python -m src.service [--host 0.0.0.0] [--port 8000] [--workers N] [--queue-size 32]
+
+Endpoints:
+    POST /jobs                          Upload a document (multipart field 'file',
+                                        or a raw body with ?filename=). Returns
+                                        202 with a job id, 429 when the queue is full or
+                                        413 as soon as the body passes the upload limit.
+    GET  /jobs/{id}                     Job status, and the report once done.
+    GET  /jobs/{id}/events              Server-sent events: status changes, document
+                                        findings, each page as it is analyzed, the
+                                        final report.
+    GET  /jobs/{id}/pages/{n}/{field}   PNG of a page 'image' or 'ela_image'.
+    GET  /jobs/{id}/pages/{n}/{field}/preview
+                                        Small WebP/JPEG (PNG for ELA maps) preview
+                                        of that image.
+    GET  /jobs/{id}/pages/{n}/{field}/pyramid
+                                        Tile geometry of its zoom pyramid.
+    GET  /jobs/{id}/pages/{n}/{field}/tiles/{level}/{column}/{row}
+                                        One encoded pyramid tile.
+    GET  /health                        Queue depth and worker counts; 'degraded'
+                                        after a worker process recently crashed.
+
+Analysis runs in a pool of worker processes with the same pipeline as the
+Streamlit app and the batch tool. Jobs wait in a bounded queue; when it is
+full new uploads are refused with 429 so clients back off instead of piling
+up memory. Finished reports go to the shared ResultCache, which also serves
+the page images and makes repeat uploads instant.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from starlette.applications import Starlette
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
+import sys
+import time
+import uuid
+
+# Allow running as a script as well as with `python -m src.service`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import instrumentation
+from src.analyzer import ForgeryDetector
+from src.cache import IMAGE_FIELDS, ResultCache, encode_page_images
+from src.converter import DocumentProcessor
+from src.document import ParsedDocument
+from src.pipeline import (
+    SUPPORTED_EXTENSIONS, analysis_cache_key, document_findings, finalize_report, iter_page_reports,
+    strip_page_images
+)
+from src.pyramid import MEDIA_TYPES, pyramid_info
+from src.template_index import TemplateIndex
+
+# Room for multipart boundaries and part headers on top of the largest accepted file
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Health reads 'degraded' for this long after a worker process crashed
+DEGRADED_SECONDS = 300
+
+# Per-process analysis objects, created once by the pool initializer
+_worker_detector = None
+_worker_processor = None
+_worker_cache = None
+_worker_template_index = None
+_worker_progress = None
+
+def _init_worker(cache_dir, template_index_path, progress):
+    """Creates the detector, converter, cache and template index once per worker process."""
+    global _worker_detector, _worker_processor, _worker_cache, _worker_template_index, _worker_progress
+    instrumentation.configure_from_env()
+    multiprocessing.util.Finalize(None, instrumentation.flush, exitpriority=10)
+    _worker_detector = ForgeryDetector()
+    _worker_processor = DocumentProcessor()
+    _worker_cache = ResultCache(cache_dir)
+    _worker_template_index = TemplateIndex(template_index_path) if template_index_path else None
+    _worker_progress = progress
+
+def analyze_job(job_id, file_bytes, filename, quality=90, dpi=300):
+    """
+    Analyzes one uploaded document inside a worker process.
+
+    Findings and each page entry are sent to the service's progress queue as
+    soon as they are ready; the complete report (with page images) is stored
+    in the result cache.
+
+    Args:
+        job_id (str): Job the progress messages belong to.
+        file_bytes (bytes): The raw document.
+        filename (str): Original file name.
+        quality (int): JPEG quality used for ELA.
+        dpi (int): Rendering resolution for rasterized PDF pages.
+
+    Returns:
+        dict: The finished report without page images.
+    """
+    try:
+        document = ParsedDocument(file_bytes, filename)
+        report = document_findings(document, filename, detector=_worker_detector)
+        _worker_progress.put((job_id, "findings", {k: v for k, v in report.items() if k != "pages"}))
+
+        pages = []
+        for entry in iter_page_reports(
+            document, filename, quality=quality, dpi=dpi, detector=_worker_detector,
+            processor=_worker_processor, keep_images=True, template_index=_worker_template_index
+        ):
+            _worker_progress.put((job_id, "page", {k: v for k, v in entry.items() if k not in IMAGE_FIELDS}))
+            # Encode (and build the display pyramids) right away so raw pages do not pile up
+            pages.append(encode_page_images(entry))
+
+        report["pages"] = pages
+        finalize_report(report)
+        _worker_cache.put(analysis_cache_key(document, filename, quality=quality, dpi=dpi), report)
+        return strip_page_images(report)
+    finally:
+        # Progress travels separately from the return value; this marker tells
+        # the service every message for the job has arrived
+        _worker_progress.put((job_id, "end", None))
+
+class Job:
+    """State of one submitted document, with the events streamed to clients."""
+
+    def __init__(self, filename, cache_key):
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.cache_key = cache_key
+        self.status = "queued"
+        self.created = time.time()
+        self.finished = None
+        self.report = None
+        self.cached = False
+        self.error = None
+        self.events = []
+        self._changed = asyncio.Event()
+        self._drained = asyncio.Event()
+
+    def emit(self, kind, data):
+        """Appends an event and wakes every stream waiting on this job."""
+        self.events.append({"event": kind, "data": data})
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def set_status(self, status, **details):
+        self.status = status
+        if status in ("done", "error"):
+            self.finished = time.time()
+        self.emit("status", dict(status=status, **details))
+
+    async def wait(self, seen):
+        """Waits until there are more than `seen` events or the job has ended."""
+        if len(self.events) <= seen and self.status not in ("done", "error"):
+            await self._changed.wait()
+
+    def summary(self):
+        summary = {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "created": self.created,
+            "finished": self.finished,
+            "cached": self.cached,
+        }
+        if self.report is not None:
+            summary["report"] = self.report
+        if self.error is not None:
+            summary["error"] = self.error
+        return summary
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+class UploadTooLarge(Exception):
+    """Raised while reading a request body that grows past the upload limit."""
+
+async def _limited_body(request, limit):
+    """Yields the request body as it arrives, raising UploadTooLarge once more than `limit` bytes came in."""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise UploadTooLarge()
+        yield chunk
+
+class AnalysisService:
+    """
+    Job queue in front of a process pool.
+
+    `workers` dispatcher tasks take jobs off a bounded asyncio queue and run
+    them in the pool, so at most `workers` documents are analyzed at once and
+    at most `queue_size` wait. A pump task relays progress messages from the
+    worker processes to the matching jobs.
+    """
+
+    def __init__(self, workers=None, queue_size=32, quality=90, dpi=300, cache_dir=None,
+                 template_index_path=None, job_ttl=3600, max_upload_bytes=100 * 1024 * 1024):
+        """
+        Args:
+            workers (int): Worker processes (default: CPU count).
+            queue_size (int): Jobs allowed to wait before uploads get 429.
+            quality (int): JPEG quality used for ELA.
+            dpi (int): Rendering resolution for PDF pages.
+            cache_dir (str): Result cache directory shared with the app and batch tool.
+            template_index_path (str): Near-duplicate template index, or None to skip it.
+            job_ttl (float): Seconds a finished job stays queryable.
+            max_upload_bytes (int): Largest accepted upload.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.quality = quality
+        self.dpi = dpi
+        self.cache = ResultCache(cache_dir)
+        self.template_index_path = template_index_path
+        self.job_ttl = job_ttl
+        self.max_upload_bytes = max_upload_bytes
+        self.jobs = {}
+        self.running = 0
+        self.worker_crashes = 0
+        self.last_crash = None
+        self._queue = None
+        self._pool = None
+        self._progress = None
+        self._tasks = []
+
+    async def start(self):
+        self._progress = multiprocessing.get_context("spawn").Queue()
+        self._pool = self._start_pool()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._dispatch()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._pump()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._progress.close()
+
+    async def submit(self, file_bytes, filename):
+        """
+        Queues a document for analysis.
+
+        Repeat uploads are answered from the result cache without queueing.
+        Hashing the upload and reading the cache run off the event loop.
+
+        Args:
+            file_bytes (bytes): The raw document.
+            filename (str): Original file name.
+
+        Returns:
+            Job: The new job.
+
+        Raises:
+            QueueFull: If `queue_size` jobs are already waiting.
+        """
+        self._expire_jobs()
+        if self._queue.full():
+            raise QueueFull(f"{self.queue_size} jobs already waiting")
+
+        loop = asyncio.get_running_loop()
+        key = await loop.run_in_executor(
+            None, lambda: analysis_cache_key(file_bytes, filename, quality=self.quality, dpi=self.dpi)
+        )
+        job = Job(filename, key)
+
+        cached = await loop.run_in_executor(None, self.cache.get, key)
+        if cached is not None:
+            self.jobs[job.job_id] = job
+            self._complete(job, strip_page_images(cached), cached=True)
+            return job
+
+        try:
+            self._queue.put_nowait((job, file_bytes))
+        except asyncio.QueueFull:
+            raise QueueFull(f"{self.queue_size} jobs already waiting")
+        self.jobs[job.job_id] = job
+        job.set_status("queued", position=self._queue.qsize())
+        return job
+
+    async def page_image(self, job, page_number, field):
+        """Returns a field of a finished job's cached page (PNG bytes or a pyramid), or None."""
+        report = await asyncio.get_running_loop().run_in_executor(None, self.cache.get, job.cache_key)
+        if report is None:
+            return None
+        for page in report["pages"]:
+            if page["page_number"] == page_number:
+                return page.get(field)
+        return None
+
+    def health(self):
+        degraded = self.last_crash is not None and time.time() - self.last_crash < DEGRADED_SECONDS
+        return {
+            "status": "degraded" if degraded else "ok",
+            "workers": self.workers,
+            "worker_crashes": self.worker_crashes,
+            "running": self.running,
+            "queued": self._queue.qsize(),
+            "queue_size": self.queue_size,
+            "jobs": len(self.jobs),
+        }
+
+    async def _dispatch(self):
+        while True:
+            job, file_bytes = await self._queue.get()
+            self.running += 1
+            job.set_status("running")
+            try:
+                report = await self._run(job, file_bytes)
+                try:
+                    await asyncio.wait_for(job._drained.wait(), timeout=10)
+                except asyncio.TimeoutError:
+                    # Progress messages went missing, but the report itself is complete
+                    pass
+                self._complete(job, report)
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.set_status("error", error=job.error)
+            finally:
+                self.running -= 1
+                self._queue.task_done()
+
+    async def _run(self, job, file_bytes):
+        """
+        Analyzes a job in the pool, replacing the pool if a worker process died.
+
+        A crashed worker breaks the whole pool: the jobs it was running fail,
+        and one that could not even be submitted is retried on the new pool.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            pool = self._pool
+            try:
+                future = loop.run_in_executor(
+                    pool, analyze_job, job.job_id, file_bytes, job.filename, self.quality, self.dpi
+                )
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+                continue
+            try:
+                return await future
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+                raise RuntimeError("Worker process died during analysis") from None
+        raise RuntimeError("Worker pool is unavailable")
+
+    def _start_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+            initargs=(self.cache.directory, self.template_index_path, self._progress)
+        )
+
+    def _replace_pool(self, broken):
+        """Starts a new pool in place of `broken`, unless another dispatcher already did."""
+        if self._pool is not broken:
+            return
+        self.worker_crashes += 1
+        self.last_crash = time.time()
+        broken.shutdown(wait=False)
+        self._pool = self._start_pool()
+
+    async def _pump(self):
+        """Relays progress messages from worker processes to their jobs."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                job_id, kind, data = await loop.run_in_executor(None, self._progress.get, True, 0.5)
+            except queue.Empty:
+                continue
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            if kind == "end":
+                job._drained.set()
+            elif job.status == "running":
+                job.emit(kind, data)
+
+    def _complete(self, job, report, cached=False):
+        job.report = report
+        job.cached = cached
+        job.emit("report", report)
+        job.set_status("done", cached=cached)
+
+    def _expire_jobs(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished < cutoff]:
+            del self.jobs[job_id]
+
+def _json(data, status_code=200, **kwargs):
+    return Response(json.dumps(data, default=str), status_code=status_code, media_type="application/json", **kwargs)
+
+def create_app(service):
+    """
+    Builds the ASGI application around an AnalysisService.
+
+    Args:
+        service (AnalysisService): The job queue; started and stopped with the app.
+
+    Returns:
+        Starlette: The application, servable by any ASGI server.
+    """
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        await service.start()
+        try:
+            yield
+        finally:
+            await service.stop()
+
+    def get_job(request):
+        return service.jobs.get(request.path_params["job_id"])
+
+    async def read_upload(request):
+        """Returns (file bytes, filename) or an error response, reading no more than the upload limit."""
+        multipart = request.headers.get("content-type", "").startswith("multipart/form-data")
+        limit = service.max_upload_bytes + (MULTIPART_OVERHEAD if multipart else 0)
+        declared = request.headers.get("content-length", "")
+        # Refuse a declared oversized body before reading any of it
+        if declared.isdigit() and int(declared) > limit:
+            raise UploadTooLarge()
+
+        if multipart:
+            async with contextlib.aclosing(_limited_body(request, limit)) as body:
+                try:
+                    form = await MultiPartParser(request.headers, body, max_files=1).parse()
+                except MultiPartException as e:
+                    return None, JSONResponse({"error": f"Malformed upload: {e.message}"}, status_code=400)
+            try:
+                upload = form.get("file")
+                if upload is None or not hasattr(upload, "read"):
+                    return None, JSONResponse({"error": "Missing multipart field 'file'."}, status_code=400)
+                return (await upload.read(), upload.filename or "upload"), None
+            finally:
+                await form.close()
+
+        filename = request.query_params.get("filename")
+        if not filename:
+            return None, JSONResponse({"error": "Raw uploads need a ?filename= parameter."}, status_code=400)
+        file_bytes = bytearray()
+        async with contextlib.aclosing(_limited_body(request, limit)) as body:
+            async for chunk in body:
+                file_bytes += chunk
+        return (bytes(file_bytes), filename), None
+
+    async def submit(request):
+        try:
+            upload, error = await read_upload(request)
+        except UploadTooLarge:
+            return JSONResponse({"error": "Upload too large."}, status_code=413)
+        if error is not None:
+            return error
+        file_bytes, filename = upload
+
+        if not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+            return JSONResponse({"error": f"Unsupported file type: {filename}"}, status_code=415)
+        if not file_bytes:
+            return JSONResponse({"error": "Empty upload."}, status_code=400)
+        if len(file_bytes) > service.max_upload_bytes:
+            return JSONResponse({"error": "Upload too large."}, status_code=413)
+
+        try:
+            job = await service.submit(file_bytes, filename)
+        except QueueFull as e:
+            return JSONResponse({"error": f"Service busy: {e}"}, status_code=429, headers={"Retry-After": "5"})
+
+        body = job.summary()
+        body["links"] = {"self": f"/jobs/{job.job_id}", "events": f"/jobs/{job.job_id}/events"}
+        return _json(body, status_code=202)
+
+    async def status(request):
+        job = get_job(request)
+        if job is None:
+            return JSONResponse({"error": "Unknown job."}, status_code=404)
+        return _json(job.summary())
+
+    async def events(request):
+        job = get_job(request)
+        if job is None:
+            return JSONResponse({"error": "Unknown job."}, status_code=404)
+
+        async def stream():
+            seen = 0
+            while True:
+                for item in job.events[seen:]:
+                    yield f"event: {item['event']}\ndata: {json.dumps(item['data'], default=str)}\n\n"
+                seen = len(job.events)
+                if job.status in ("done", "error"):
+                    return
+                try:
+                    await asyncio.wait_for(job.wait(seen), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment line so proxies and client read timeouts see activity
+                    yield ": keep-alive\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    async def cached_page_field(request, pyramid=False):
+        """Returns (value, None) for the requested page image or its pyramid, or (None, error response)."""
+        job = get_job(request)
+        field = request.path_params["field"]
+        if job is None or field not in IMAGE_FIELDS:
+            return None, JSONResponse({"error": "Unknown job or image."}, status_code=404)
+        if job.status != "done":
+            return None, JSONResponse({"error": "Job not finished."}, status_code=409)
+        name = f"{field}_pyramid" if pyramid else field
+        data = await service.page_image(job, request.path_params["page_number"], name)
+        if data is None:
+            return None, JSONResponse({"error": "Image no longer cached."}, status_code=410)
+        return data, None
+
+    async def page_image(request):
+        data, error = await cached_page_field(request)
+        return error or Response(data, media_type="image/png")
+
+    async def page_preview(request):
+        pyramid, error = await cached_page_field(request, pyramid=True)
+        if error:
+            return error
+        return Response(pyramid["preview"], media_type=MEDIA_TYPES[pyramid["preview_format"]],
+                        headers={"Cache-Control": "max-age=3600"})
+
+    async def page_pyramid(request):
+        pyramid, error = await cached_page_field(request, pyramid=True)
+        return error or JSONResponse(pyramid_info(pyramid))
+
+    async def page_tile(request):
+        pyramid, error = await cached_page_field(request, pyramid=True)
+        if error:
+            return error
+        level, column, row = (request.path_params[k] for k in ("level", "column", "row"))
+        try:
+            tile = pyramid["levels"][level]["tiles"][row][column]
+        except IndexError:
+            return JSONResponse({"error": "No such tile."}, status_code=404)
+        return Response(tile, media_type=MEDIA_TYPES[pyramid["format"]], headers={"Cache-Control": "max-age=3600"})
+
+    async def health(request):
+        return JSONResponse(service.health())
+
+    return Starlette(
+        routes=[
+            Route("/jobs", submit, methods=["POST"]),
+            Route("/jobs/{job_id}", status),
+            Route("/jobs/{job_id}/events", events),
+            Route("/jobs/{job_id}/pages/{page_number:int}/{field}", page_image),
+            Route("/jobs/{job_id}/pages/{page_number:int}/{field}/preview", page_preview),
+            Route("/jobs/{job_id}/pages/{page_number:int}/{field}/pyramid", page_pyramid),
+            Route("/jobs/{job_id}/pages/{page_number:int}/{field}/tiles/{level:int}/{column:int}/{row:int}", page_tile),
+            Route("/health", health),
+        ],
+        lifespan=lifespan,
+    )
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="HTTP service for document forgery analysis.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind.")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on.")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument("--queue-size", type=int, default=32, help="Jobs allowed to wait before returning 429.")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality used for ELA.")
+    parser.add_argument("--dpi", type=int, default=300, help="Rendering resolution for PDF pages.")
+    parser.add_argument("--cache-dir", default=None, help="Result cache directory shared with the app.")
+    parser.add_argument("--template-index", default=None,
+                        help="Near-duplicate template index (SQLite file); disabled if omitted.")
+    args = parser.parse_args(argv)
+
+    service = AnalysisService(
+        workers=args.workers, queue_size=args.queue_size, quality=args.quality, dpi=args.dpi,
+        cache_dir=args.cache_dir, template_index_path=args.template_index
+    )
+    uvicorn.run(create_app(service), host=args.host, port=args.port)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import requests
+import json
+import time
+
+class ServiceBusy(Exception):
+    """Raised when the service refuses an upload because its queue is full."""
+
+    def __init__(self, message, retry_after=5.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AnalysisClient:
+    """Client for the HTTP analysis service (`python -m src.service`)."""
+
+    def __init__(self, base_url, timeout=30.0):
+        """
+        Args:
+            base_url (str): Service root, e.g. 'http://localhost:8000'.
+            timeout (float): Seconds to wait for each HTTP response.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def submit(self, file_bytes, filename):
+        """
+        Uploads a document.
+
+        Args:
+            file_bytes (bytes): The raw document.
+            filename (str): Original file name.
+
+        Returns:
+            dict: The job summary ('job_id', 'status', 'cached', and 'report' if it was cached).
+
+        Raises:
+            ServiceBusy: If the service queue is full.
+        """
+        response = self.session.post(
+            f"{self.base_url}/jobs", files={"file": (filename, file_bytes)}, timeout=self.timeout
+        )
+        if response.status_code == 429:
+            raise ServiceBusy(response.json().get("error", "Service busy"),
+                              float(response.headers.get("Retry-After", 5)))
+        self._raise_for_status(response)
+        return response.json()
+
+    def status(self, job_id):
+        """Returns the job summary, including the report once it is done."""
+        response = self.session.get(f"{self.base_url}/jobs/{job_id}", timeout=self.timeout)
+        self._raise_for_status(response)
+        return response.json()
+
+    def events(self, job_id):
+        """
+        Streams a job's events until it ends.
+
+        Yields:
+            tuple: (event name, data) such as ('page', {...}) or ('report', {...}).
+        """
+        with self.session.get(f"{self.base_url}/jobs/{job_id}/events", stream=True, timeout=self.timeout) as response:
+            self._raise_for_status(response)
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    yield event, json.loads(line[len("data: "):])
+
+    def page_image(self, job_id, page_number, field="image"):
+        """Returns the PNG bytes of a finished job's 'image' or 'ela_image'."""
+        return self._get_bytes(f"/jobs/{job_id}/pages/{page_number}/{field}")
+
+    def page_preview(self, job_id, page_number, field="image"):
+        """Returns the encoded preview of a finished job's 'image' or 'ela_image'."""
+        return self._get_bytes(f"/jobs/{job_id}/pages/{page_number}/{field}/preview")
+
+    def page_pyramid(self, job_id, page_number, field="image"):
+        """Returns the tile geometry (`src.pyramid.pyramid_info`) of a page image's zoom pyramid."""
+        response = self.session.get(
+            f"{self.base_url}/jobs/{job_id}/pages/{page_number}/{field}/pyramid", timeout=self.timeout
+        )
+        self._raise_for_status(response)
+        return response.json()
+
+    def page_tile(self, job_id, page_number, field, level, column, row):
+        """Returns one encoded tile of a page image's zoom pyramid."""
+        return self._get_bytes(f"/jobs/{job_id}/pages/{page_number}/{field}/tiles/{level}/{column}/{row}")
+
+    def analyze(self, file_bytes, filename, max_wait=300.0, on_event=None):
+        """
+        Submits a document, retrying while the service is busy, and waits for its report.
+
+        Args:
+            file_bytes (bytes): The raw document.
+            filename (str): Original file name.
+            max_wait (float): Seconds to keep retrying a busy service.
+            on_event (callable): Called with (event, data) for every streamed event.
+
+        Returns:
+            tuple: (job id, final report without page images, whether the
+                report came from the service's result cache rather than a
+                fresh analysis).
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            try:
+                job = self.submit(file_bytes, filename)
+                break
+            except ServiceBusy as e:
+                if time.monotonic() + e.retry_after > deadline:
+                    raise
+                time.sleep(e.retry_after)
+
+        if job.get("report") is not None:
+            return job["job_id"], job["report"], job.get("cached", False)
+
+        for event, data in self.events(job["job_id"]):
+            if on_event is not None:
+                on_event(event, data)
+            if event == "report":
+                return job["job_id"], data, False
+            if event == "status" and data["status"] == "error":
+                raise RuntimeError(data.get("error", "Analysis failed"))
+        # The stream ended without a report (e.g. a proxy cut it); fall back to polling
+        job = self.status(job["job_id"])
+        while job["status"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(1.0)
+            job = self.status(job["job_id"])
+        if job["status"] != "done":
+            raise RuntimeError(job.get("error", f"Job {job['job_id']} did not finish"))
+        return job["job_id"], job["report"], job.get("cached", False)
+
+    def _get_bytes(self, path):
+        response = self.session.get(f"{self.base_url}{path}", timeout=self.timeout)
+        self._raise_for_status(response)
+        return response.content
+
+    def _raise_for_status(self, response):
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("error", response.text)
+            except ValueError:
+                message = response.text
+            raise RuntimeError(f"Analysis service error {response.status_code}: {message}")
@@ -0,0 +1,343 @@
+"""
+Page handoff between a conversion process and the analysis stages.
+
+Sending a 300-DPI page (about 25 MB of pixels) to another process through a
+queue pickles, pipes and unpickles the whole array, which costs about as much
+as analyzing it. `SharedMemoryTransport` instead keeps a small ring of
+`multiprocessing.shared_memory` buffers: the converter writes each page into a
+free buffer and sends only a `PageDescriptor` (shape, dtype, buffer name), and
+the analysis side wraps the same memory in a numpy array without copying it.
+A buffer is handed out again once every holder has released it.
+
+`InProcessTransport` has the same interface but runs conversion inline, so
+single-process callers pay nothing.
+"""
+from multiprocessing import shared_memory
+from collections import namedtuple
+from contextlib import contextmanager
+import multiprocessing
+import numpy as np
+import os
+import pickle
+import queue
+import traceback
+
+# Fits a color A4 or Letter page at 300 DPI
+DEFAULT_SLOT_BYTES = 32 * 1024 * 1024
+
+# Seconds between checks for a stopped consumer while waiting for a free buffer
+POLL_SECONDS = 0.1
+
+PageDescriptor = namedtuple("PageDescriptor", ["shape", "dtype", "name"])
+PageDescriptor.__doc__ = "Locates a page array in a shared buffer: its shape, dtype string and the buffer's name."
+
+class SharedPageRing:
+    """
+    A fixed set of reusable shared memory buffers with reference-counted release.
+
+    The ring is created in the parent process and passed to child processes as
+    a `Process` argument (it can't be sent through a queue: the counters and
+    condition are only shared when a process is started). Buffers are attached
+    lazily, by name, in each process that uses them.
+    """
+
+    def __init__(self, slots=4, slot_bytes=DEFAULT_SLOT_BYTES, context=None):
+        """
+        Args:
+            slots (int): Number of buffers, i.e. pages that can be in flight.
+            slot_bytes (int): Size of each buffer; larger pages can't use the ring.
+            context: multiprocessing context used for the shared counters.
+        """
+        if slots < 1:
+            raise ValueError("A page ring needs at least one slot")
+        self.context = context or multiprocessing.get_context()
+        self.slot_bytes = slot_bytes
+        self._segments = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(slots)]
+        self._names = [segment.name for segment in self._segments]
+        self._refcounts = self.context.Array("i", slots, lock=False)
+        self._condition = self.context.Condition()
+        # A forked child inherits this object as-is; only the creator frees the buffers
+        self._owner_pid = os.getpid()
+        self._retired = []
+
+    def __getstate__(self):
+        return {
+            "context": self.context,
+            "slot_bytes": self.slot_bytes,
+            "names": self._names,
+            "refcounts": self._refcounts,
+            "condition": self._condition,
+        }
+
+    def __setstate__(self, state):
+        self.context = state["context"]
+        self.slot_bytes = state["slot_bytes"]
+        self._names = state["names"]
+        self._refcounts = state["refcounts"]
+        self._condition = state["condition"]
+        self._segments = [None] * len(self._names)
+        self._owner_pid = None
+        self._retired = []
+
+    @property
+    def slots(self):
+        return len(self._names)
+
+    def fits(self, shape, dtype):
+        """Whether an array of this shape and dtype fits in one buffer."""
+        return int(np.prod(shape)) * np.dtype(dtype).itemsize <= self.slot_bytes
+
+    def in_use(self):
+        """Number of buffers currently held."""
+        with self._condition:
+            return sum(1 for count in self._refcounts if count > 0)
+
+    def acquire(self, shape, dtype, timeout=None, cancelled=None):
+        """
+        Reserves a free buffer for one array, waiting for a release if all are held.
+
+        Args:
+            shape (tuple): Array shape.
+            dtype: Array dtype.
+            timeout (float): Seconds to wait for a free buffer (default: forever).
+            cancelled (callable): Optional check polled while waiting; the wait
+                is abandoned when it returns True.
+
+        Returns:
+            tuple: (PageDescriptor, writable numpy view of the buffer), or None
+                if the wait timed out or was cancelled. The caller holds one
+                reference.
+        """
+        if not self.fits(shape, dtype):
+            raise ValueError(f"Array of shape {tuple(shape)} does not fit in a {self.slot_bytes}-byte page buffer")
+        waited = 0.0
+        with self._condition:
+            while True:
+                for slot, count in enumerate(self._refcounts):
+                    if count == 0:
+                        self._refcounts[slot] = 1
+                        descriptor = PageDescriptor(tuple(shape), np.dtype(dtype).str, self._names[slot])
+                        return descriptor, self.view(descriptor)
+                if (cancelled is not None and cancelled()) or (timeout is not None and waited >= timeout):
+                    return None
+                self._condition.wait(POLL_SECONDS)
+                waited += POLL_SECONDS
+
+    def put(self, array, **kwargs):
+        """
+        Copies an array into a free buffer.
+
+        Returns:
+            PageDescriptor: The descriptor to send, or None (see `acquire`).
+        """
+        acquired = self.acquire(array.shape, array.dtype, **kwargs)
+        if acquired is None:
+            return None
+        descriptor, view = acquired
+        view[...] = array
+        return descriptor
+
+    def view(self, descriptor):
+        """Returns a numpy array backed by the buffer a descriptor points to (no copy)."""
+        slot = self._slot(descriptor)
+        segment = self._segments[slot]
+        if segment is None:
+            segment = self._segments[slot] = shared_memory.SharedMemory(name=descriptor.name)
+        return np.ndarray(descriptor.shape, dtype=np.dtype(descriptor.dtype), buffer=segment.buf)
+
+    def retain(self, descriptor):
+        """Adds a reference, e.g. before handing a page to a second consumer."""
+        slot = self._slot(descriptor)
+        with self._condition:
+            if self._refcounts[slot] <= 0:
+                raise ValueError(f"Page buffer {descriptor.name} is not in use")
+            self._refcounts[slot] += 1
+
+    def release(self, descriptor):
+        """Drops a reference; the buffer is reused once none are left."""
+        slot = self._slot(descriptor)
+        with self._condition:
+            if self._refcounts[slot] <= 0:
+                raise ValueError(f"Page buffer {descriptor.name} is not in use")
+            self._refcounts[slot] -= 1
+            if self._refcounts[slot] == 0:
+                self._condition.notify_all()
+
+    def reclaim(self):
+        """Marks every buffer free, after the processes holding them are gone."""
+        with self._condition:
+            for slot in range(self.slots):
+                self._refcounts[slot] = 0
+            self._condition.notify_all()
+
+    def close(self):
+        """Detaches this process from the buffers; the owner also frees them."""
+        for slot, segment in enumerate(self._segments):
+            if segment is None:
+                continue
+            if self._owner_pid == os.getpid():
+                segment.unlink()
+            self._segments[slot] = None
+            try:
+                segment.close()
+            except BufferError:
+                # A page view is still alive; keep the mapping until it is dropped
+                self._retired.append(segment)
+
+    def _slot(self, descriptor):
+        try:
+            return self._names.index(descriptor.name)
+        except ValueError:
+            raise ValueError(f"Page buffer {descriptor.name} does not belong to this ring") from None
+
+class InProcessTransport:
+    """Runs the page source in the calling process; pages are passed as they are."""
+
+    shared = False
+
+    def iter_pages(self, page_source, *args):
+        """
+        Yields the pages of `page_source(*args)`.
+
+        Args:
+            page_source (callable): Returns an iterable of PageImage tuples,
+                e.g. `pipeline.iter_document_pages`.
+            *args: Arguments for `page_source`.
+
+        Yields:
+            PageImage: Each page.
+        """
+        yield from page_source(*args)
+
+class SharedMemoryTransport:
+    """
+    Runs the page source in a child process and hands its pages over through a SharedPageRing.
+
+    A yielded page's image is a view of a shared buffer, valid until the
+    consumer asks for the next page (or closes the iterator); copy it to keep
+    it longer. Pages too large for a buffer are sent through the queue instead.
+    """
+
+    shared = True
+
+    def __init__(self, ring=None, **ring_options):
+        """
+        Args:
+            ring (SharedPageRing): Ring to use; by default one is created from `ring_options`.
+            **ring_options: `SharedPageRing` arguments (slots, slot_bytes, context).
+        """
+        self.ring = ring or SharedPageRing(**ring_options)
+        self.stats = {"shared": 0, "inline": 0}
+
+    def close(self):
+        self.ring.close()
+
+    def iter_pages(self, page_source, *args):
+        """
+        Yields the pages of `page_source(*args)`, converted in a child process.
+
+        Conversion runs ahead of the consumer by up to the ring's slot count.
+        Errors raised by the page source are re-raised here.
+
+        Args:
+            page_source (callable): Returns an iterable of PageImage tuples;
+                must be picklable (a module-level function) under the spawn
+                start method.
+            *args: Arguments for `page_source`.
+
+        Yields:
+            PageImage: Each page, its image backed by shared memory.
+        """
+        context = self.ring.context
+        messages = context.Queue(maxsize=self.ring.slots)
+        stop = context.Event()
+        producer = context.Process(
+            target=_produce_pages, args=(self.ring, messages, stop, page_source, args), daemon=True
+        )
+        producer.start()
+        try:
+            while True:
+                try:
+                    kind, payload = messages.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    if not producer.is_alive() and messages.empty():
+                        raise RuntimeError(f"Page conversion process exited with code {producer.exitcode}")
+                    continue
+                if kind == "done":
+                    break
+                if kind == "error":
+                    raise payload
+                with self._open(payload) as page:
+                    yield page
+        finally:
+            stop.set()
+            self._shutdown(producer, messages)
+
+    @contextmanager
+    def _open(self, message):
+        page, descriptor = message
+        if descriptor is None:
+            self.stats["inline"] += 1
+            yield page
+            return
+        self.stats["shared"] += 1
+        try:
+            yield page._replace(image=self.ring.view(descriptor))
+        finally:
+            self.ring.release(descriptor)
+
+    def _shutdown(self, producer, messages):
+        """Stops the producer and releases the buffers of pages it sent but nobody read."""
+        producer.join(timeout=0)
+        while producer.is_alive() or not messages.empty():
+            try:
+                kind, payload = messages.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                producer.join(timeout=POLL_SECONDS)
+                continue
+            if kind == "page" and payload[1] is not None:
+                self.ring.release(payload[1])
+        producer.join()
+        if producer.exitcode != 0:
+            # Killed while holding a buffer; nothing else uses the ring meanwhile
+            self.ring.reclaim()
+        messages.close()
+
+def _send(messages, stop, message):
+    """Puts a message on the queue unless the consumer stops first."""
+    while not stop.is_set():
+        try:
+            messages.put(message, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _produce_pages(ring, messages, stop, page_source, args):
+    """Child process body: converts pages into the ring and sends their descriptors."""
+    try:
+        for page in page_source(*args):
+            if stop.is_set():
+                break
+            image = page.image
+            descriptor = None
+            if ring.fits(image.shape, image.dtype):
+                descriptor = ring.put(image, cancelled=stop.is_set)
+                if descriptor is None:
+                    break
+                page = page._replace(image=None)
+            if not _send(messages, stop, ("page", (page, descriptor))):
+                if descriptor is not None:
+                    ring.release(descriptor)
+                break
+        else:
+            _send(messages, stop, ("done", None))
+    except Exception as e:
+        try:
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            # The queue pickles in a background thread, so check up front
+            e = RuntimeError(traceback.format_exc())
+        _send(messages, stop, ("error", e))
+    finally:
+        ring.close()
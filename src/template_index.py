@@ -0,0 +1,339 @@
+from src.cache import default_cache_dir
+import cv2
+import numpy as np
+import itertools
+import math
+import os
+import sqlite3
+import threading
+import time
+
+# Region hashes are computed on a REGION_GRID x REGION_GRID grid over the page
+REGION_GRID = 4
+REGION_HASH_SIDE = 16
+REGION_HASH_MARGIN = 2
+
+# The 64-bit pHash is split into this many 16-bit chunks for multi-index hashing
+HASH_CHUNKS = 4
+CHUNK_BITS = 64 // HASH_CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# Pages with fewer region hash bits set are blank or nearly so (a page number,
+# a scanner edge) and would match every other such page
+MIN_CONTENT_BITS = 16
+
+# Values bound per SQL IN list, well under SQLite's parameter limit
+PROBE_BATCH = 500
+
+# Beyond this many probed values per chunk, reading every stored hash is cheaper
+MAX_PROBES = 4096
+
+def default_index_path():
+    """Returns the shared template index location (override with FORGERY_TEMPLATE_INDEX)."""
+    return os.environ.get("FORGERY_TEMPLATE_INDEX", os.path.join(default_cache_dir(), "templates.sqlite"))
+
+def page_key(document_hash, page_number):
+    """Index key for one page of a document, from the document's SHA-256."""
+    return f"{document_hash}:{page_number}"
+
+def is_blank(regions, min_bits=MIN_CONTENT_BITS):
+    """Whether `region_hashes` describe a blank or near-uniform page, which has no template to match."""
+    return int(np.unpackbits(regions).sum()) < min_bits
+
+def phash(image):
+    """
+    Computes a 64-bit DCT perceptual hash.
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image.
+
+    Returns:
+        int: The hash as an unsigned 64-bit integer.
+    """
+    gray = _to_gray(image)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    # The DC term only tracks overall brightness, so it's left out of the median
+    bits = low > np.median(low.ravel()[1:])
+    return _pack_bits(bits)
+
+def dhash(image):
+    """
+    Computes a 64-bit difference hash (horizontal gradient signs).
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image.
+
+    Returns:
+        int: The hash as an unsigned 64-bit integer.
+    """
+    gray = _to_gray(image)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _pack_bits(small[:, 1:] > small[:, :-1])
+
+def region_hashes(image, grid=REGION_GRID, side=REGION_HASH_SIDE, margin=REGION_HASH_MARGIN):
+    """
+    Computes a gradient hash for every cell of a grid laid over the image.
+
+    Each cell is reduced to side x (side + 1) pixels and a bit is set where the
+    brightness rises by more than `margin` to the right. The margin keeps flat
+    paper from flipping bits under scanner noise or recompression, while a
+    changed figure still alters the strokes it covers.
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image.
+        grid (int): Cells per side.
+        side (int): Hash resolution per cell.
+        margin (int): Brightness step needed to set a bit.
+
+    Returns:
+        numpy.ndarray: (grid * grid, side * side / 8) packed bits, row-major cells.
+    """
+    gray = _to_gray(image)
+    # Resizing the whole page once lets every cell hash come from one array
+    small = cv2.resize(gray, (grid * (side + 1), grid * side), interpolation=cv2.INTER_AREA).astype(np.int16)
+    cells = small.reshape(grid, side, grid, side + 1).transpose(0, 2, 1, 3)
+    bits = (cells[..., 1:] - cells[..., :-1]) > margin
+    return np.packbits(bits.reshape(grid * grid, -1), axis=1)
+
+def region_distances(a, b):
+    """Per-region Hamming distances between two `region_hashes` results."""
+    return np.unpackbits(np.bitwise_xor(a, b), axis=1).sum(axis=1)
+
+def hamming(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
+
+def page_hashes(image, max_side=512):
+    """
+    Computes the pHash, dHash and region hashes of a page from one reduction.
+
+    The page is converted to grayscale and shrunk once; every hash is then
+    derived from the small copy, which is much cheaper than resizing the full
+    300-DPI page three times.
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image.
+        max_side (int): Longest side of the shared reduced copy.
+
+    Returns:
+        tuple: (phash, dhash, region_hashes).
+    """
+    gray = _to_gray(image)
+    scale = max_side / max(gray.shape[:2])
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return phash(gray), dhash(gray), region_hashes(gray)
+
+def _to_gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+def _pack_bits(bits):
+    return int.from_bytes(np.packbits(bits.ravel().astype(np.uint8)).tobytes(), "big")
+
+def _to_signed(value):
+    """SQLite integers are signed 64-bit; store unsigned hashes two's-complement."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+def _chunks(value):
+    return [(value >> (CHUNK_BITS * i)) & CHUNK_MASK for i in range(HASH_CHUNKS)]
+
+def _neighbour_count(radius):
+    """Number of chunk values within `radius` bit flips of any chunk."""
+    return sum(math.comb(CHUNK_BITS, r) for r in range(min(radius, CHUNK_BITS) + 1))
+
+def _neighbours(chunk, radius):
+    """All chunk values within `radius` bit flips of `chunk`."""
+    values = [chunk]
+    for r in range(1, radius + 1):
+        for positions in itertools.combinations(range(CHUNK_BITS), r):
+            flipped = chunk
+            for position in positions:
+                flipped ^= 1 << position
+            values.append(flipped)
+    return values
+
+class TemplateIndex:
+    """
+    Persistent index of page perceptual hashes for near-duplicate lookup.
+
+    Fraudsters reuse templates (payslips, utility bills) and edit a few fields.
+    Each indexed page stores a pHash, a dHash and per-region hashes in SQLite.
+    Lookups use multi-index hashing: the pHash is split into 16-bit chunks, each
+    with its own B-tree index. By the pigeonhole principle, any hash within
+    Hamming distance d of the query agrees with it in at least one chunk up to
+    d // 4 bit flips, so only those few index buckets are probed instead of
+    scanning every row. Blank and near-uniform pages are neither indexed nor
+    matched.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): SQLite database file (created if missing), or ':memory:'.
+        """
+        if path != ":memory:":
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        chunk_columns = ", ".join(f"c{i} INTEGER NOT NULL" for i in range(HASH_CHUNKS))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "id INTEGER PRIMARY KEY, doc_key TEXT NOT NULL UNIQUE, label TEXT, added REAL NOT NULL, "
+            f"phash INTEGER NOT NULL, dhash INTEGER NOT NULL, regions BLOB NOT NULL, {chunk_columns})"
+        )
+        # Covering indexes: candidate filtering reads only the index B-trees
+        for i in range(HASH_CHUNKS):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS pages_c{i} ON pages (c{i}, phash)")
+        self._conn.commit()
+
+    def add(self, image, doc_key, label=None):
+        """
+        Adds one page to the index; re-adding an existing key or a blank page is a no-op.
+
+        Args:
+            image (numpy.ndarray): The page in BGR or grayscale format.
+            doc_key (str): Unique key for the page (e.g. document hash and page number).
+            label (str): Optional human-readable name (e.g. the file name).
+
+        Returns:
+            bool: True if the page was inserted.
+        """
+        return self.add_many([(image, doc_key, label)]) == 1
+
+    def add_many(self, items):
+        """
+        Adds several pages in a single transaction.
+
+        Args:
+            items (iterable): (image, doc_key, label) tuples.
+
+        Returns:
+            int: Number of pages inserted.
+        """
+        rows = [self._row(image, doc_key, label) for image, doc_key, label in items]
+        rows = [row for row in rows if row is not None]
+        if not rows:
+            return 0
+        placeholders = ", ".join("?" * (6 + HASH_CHUNKS))
+        chunk_names = ", ".join(f"c{i}" for i in range(HASH_CHUNKS))
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO pages (doc_key, label, added, phash, dhash, regions, {chunk_names}) "
+                f"VALUES ({placeholders})",
+                rows
+            )
+            self._conn.commit()
+            return self._conn.total_changes - before
+
+    def query(self, image, max_distance=10, limit=5, exclude_key=None, exclude_document=None, region_threshold=4):
+        """
+        Finds indexed pages whose pHash is within `max_distance` bits of the image.
+
+        Args:
+            image (numpy.ndarray): The page in BGR or grayscale format.
+            max_distance (int): Largest pHash Hamming distance returned.
+            limit (int): Maximum number of matches.
+            exclude_key (str): A doc_key to leave out (e.g. the page itself).
+            exclude_document (str): A document hash whose pages (keys made by
+                `page_key`) are all left out, so a document doesn't match itself.
+            region_threshold (int): Region hash distance (bits out of 256)
+                above which a region is reported as differing from the match.
+
+        Returns:
+            list: Matches sorted by distance, each with 'doc_key', 'label',
+                'distance', 'dhash_distance' and 'differing_regions' (pixel
+                boxes in the query image with their hash distance). Empty for a
+                blank page.
+        """
+        query_phash, query_dhash, query_regions = page_hashes(image)
+        if is_blank(query_regions):
+            return []
+
+        with self._lock:
+            candidates = self._candidates(query_phash, max_distance)
+            close = {}
+            for row_id, stored_phash in candidates:
+                distance = hamming(query_phash, _to_unsigned(stored_phash))
+                if distance <= max_distance:
+                    close[row_id] = distance
+            # Only the few pages within range have their region hashes loaded
+            ids = list(close)
+            rows = []
+            for start in range(0, len(ids), PROBE_BATCH):
+                batch = ids[start:start + PROBE_BATCH]
+                rows += self._conn.execute(
+                    f"SELECT id, doc_key, label, dhash, regions FROM pages WHERE id IN ({', '.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+
+        height, width = image.shape[:2]
+        matches = []
+        excluded_prefix = None if exclude_document is None else page_key(exclude_document, "")
+        for row_id, doc_key, label, stored_dhash, stored_regions in rows:
+            if doc_key == exclude_key or (excluded_prefix and doc_key.startswith(excluded_prefix)):
+                continue
+            distance = close[row_id]
+
+            regions = np.frombuffer(stored_regions, dtype=np.uint8).reshape(query_regions.shape)
+            distances = region_distances(query_regions, regions)
+            differing = []
+            for index in np.flatnonzero(distances > region_threshold):
+                row, col = divmod(int(index), REGION_GRID)
+                differing.append({
+                    "x": col * width // REGION_GRID,
+                    "y": row * height // REGION_GRID,
+                    "width": width // REGION_GRID,
+                    "height": height // REGION_GRID,
+                    "distance": int(distances[index]),
+                })
+
+            matches.append({
+                "doc_key": doc_key,
+                "label": label,
+                "distance": distance,
+                "dhash_distance": hamming(query_dhash, _to_unsigned(stored_dhash)),
+                "differing_regions": differing,
+            })
+
+        matches.sort(key=lambda match: (match["distance"], match["dhash_distance"]))
+        return matches[:limit]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def _candidates(self, query_phash, max_distance):
+        """(id, phash) rows that may lie within `max_distance`; call with the lock held."""
+        # Probe every chunk bucket that can hold a hash within max_distance
+        radius = max_distance // HASH_CHUNKS
+        if _neighbour_count(radius) > MAX_PROBES:
+            return self._conn.execute("SELECT id, phash FROM pages").fetchall()
+
+        candidates = {}
+        for i, chunk in enumerate(_chunks(query_phash)):
+            values = _neighbours(chunk, radius)
+            for start in range(0, len(values), PROBE_BATCH):
+                batch = values[start:start + PROBE_BATCH]
+                candidates.update(self._conn.execute(
+                    f"SELECT id, phash FROM pages WHERE c{i} IN ({', '.join('?' * len(batch))})", batch
+                ).fetchall())
+        return list(candidates.items())
+
+    def _row(self, image, doc_key, label):
+        """The row to insert for a page, or None for a blank page."""
+        page_phash, page_dhash, regions = page_hashes(image)
+        if is_blank(regions):
+            return None
+        return [doc_key, label, time.time(), _to_signed(page_phash), _to_signed(page_dhash), regions.tobytes()] \
+            + _chunks(page_phash)
@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import io
+import json
+import os
+import sys
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.batch import collect_paths, run_batch
+
+def create_archive(folder, count=3):
+    for i in range(count):
+        img = np.ones((200, 200, 3), dtype=np.uint8) * 255
+        cv2.putText(img, f"DOC {i}", (30, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+        cv2.imwrite(str(folder / f"doc_{i}.jpg"), img)
+    (folder / "notes.txt").write_text("not a document")
+    (folder / "broken.png").write_bytes(b"not an image")
+
+def test_batch_resumes_from_checkpoint(tmp_path):
+    archive = tmp_path / "archive"
+    archive.mkdir()
+    create_archive(archive)
+    output = tmp_path / "results.jsonl"
+
+    paths = collect_paths(str(archive))
+    assert len(paths) == 4
+
+    # Simulate a crash: one finished record plus a truncated line
+    output.write_text(json.dumps({"path": paths[-1], "status": "ok"}) + '\n{"path": "trunc')
+
+    summary = run_batch(paths, str(output), workers=1, log=io.StringIO())
+    assert summary["skipped"] == 1
+    assert summary["analyzed"] == 3
+    assert summary["errors"] == 1
+
+    records = {}
+    for line in output.read_text().splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        records[record["path"]] = record
+    assert set(records) == set(paths)
+    assert records[str(archive / "broken.png")]["status"] == "error"
+    assert records[str(archive / "doc_1.jpg")]["pages"][0]["ela"]["max"] >= 0
+
+def test_manifest_paths_resolve_relative_to_manifest(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text('{"path": "a.pdf"}\n# comment\n\n{"path": "/abs/b.docx"}\n')
+    assert collect_paths(str(manifest)) == [str(tmp_path / "a.pdf"), "/abs/b.docx"]
+
+def _crash_on_doc_1(file_bytes, name, **kwargs):
+    if name == "doc_1.jpg":
+        os._exit(1)
+    return {"filename": name, "pages": []}
+
+def test_worker_crash_is_recorded_and_the_batch_continues(tmp_path, monkeypatch):
+    archive = tmp_path / "archive"
+    archive.mkdir()
+    create_archive(archive)
+    output = tmp_path / "results.jsonl"
+    paths = collect_paths(str(archive))
+
+    # Forked workers inherit the patched pipeline; doc_1 takes its worker down
+    monkeypatch.setattr("src.batch.analyze_document", _crash_on_doc_1)
+    summary = run_batch(paths, str(output), workers=1, log=io.StringIO())
+    assert summary["analyzed"] == 4
+
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(record["path"] for record in records) == sorted(paths)
+    crashed = next(record for record in records if record["path"].endswith("doc_1.jpg"))
+    assert crashed["status"] == "error"
+
+    # The crash is checkpointed, so resuming doesn't run into it again
+    assert run_batch(paths, str(output), workers=1, log=io.StringIO())["skipped"] == 4
@@ -0,0 +1,40 @@
+import os
+import sys
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import benchmarks.corpus
+from benchmarks.corpus import build_corpus, make_jpeg
+from benchmarks.run import compare_results, run_case
+
+def test_benchmark_case_and_regression_check(tmp_path):
+    path = tmp_path / "page.jpg"
+    path.write_bytes(make_jpeg(0.5))
+    result = run_case("perform_ela/page", "perform_ela", str(path), repeat=2)
+    assert "error" not in result
+    assert result["wall_median"] > 0 and result["megapixels"] > 0.4
+
+    baseline = {"cases": {"perform_ela/page": result, "gone": result}}
+    slower = dict(result, wall_median=result["wall_median"] * 1.5 + 0.01)
+    rows = compare_results(baseline, {"cases": {"perform_ela/page": slower}})
+    assert [row["metric"] for row in rows if row["regression"]] == ["wall_median"]
+    assert not any(row["regression"] for row in compare_results(baseline, baseline))
+
+def test_corpus_is_rebuilt_for_a_new_generator_version(tmp_path, monkeypatch):
+    generated = []
+    for name in ("make_jpeg", "make_scanned_pdf", "make_vector_pdf", "make_docx"):
+        monkeypatch.setattr(benchmarks.corpus, name, lambda n, name=name: generated.append(name) or b"data")
+
+    version = benchmarks.corpus.CORPUS_VERSION
+    cases = build_corpus(str(tmp_path), quick=True)
+    first = len(generated)
+    assert first and all(os.path.basename(path).split(".")[1] == f"v{version}" for _, _, path in cases)
+    build_corpus(str(tmp_path), quick=True)
+    assert len(generated) == first
+
+    # Files from the previous generators are not reused
+    monkeypatch.setattr(benchmarks.corpus, "CORPUS_VERSION", version + 1)
+    names = [name for name, _, _ in build_corpus(str(tmp_path), quick=True)]
+    assert len(generated) == 2 * first
+    assert names == [name for name, _, _ in cases]
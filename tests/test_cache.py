@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+import os
+import sys
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.cache import ResultCache, decode_page_image
+from src.pipeline import analyze_document
+
+def create_jpeg_bytes(text="INVOICE 0042"):
+    img = np.ones((240, 320, 3), dtype=np.uint8) * 255
+    cv2.putText(img, text, (20, 120), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    success, encoded = cv2.imencode(".jpg", img)
+    assert success
+    return encoded.tobytes()
+
+def test_repeat_upload_is_served_from_cache(tmp_path):
+    file_bytes = create_jpeg_bytes()
+    first_cache = ResultCache(str(tmp_path))
+    first = analyze_document(file_bytes, "scan.jpg", cache=first_cache, keep_images=True)
+
+    # A fresh instance (e.g. another process) only has the disk tier to go on
+    second_cache = ResultCache(str(tmp_path))
+    second = analyze_document(file_bytes, "scan.jpg", cache=second_cache, keep_images=True)
+    assert second["pages"][0]["ela"] == first["pages"][0]["ela"]
+    assert second["pages"][0]["ela_image"] == first["pages"][0]["ela_image"]
+    ela_image = decode_page_image(second["pages"][0]["ela_image"])
+    assert ela_image.shape == (240, 320, 3)
+
+    # Different parameters are a different entry
+    assert ResultCache.make_key(file_bytes, quality=90) != ResultCache.make_key(file_bytes, quality=80)
+
+    slim = analyze_document(file_bytes, "scan.jpg", cache=second_cache)
+    assert "ela_image" not in slim["pages"][0]
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=2500, memory_bytes=0)
+    payload = {"red_flags": [], "blob": b"x" * 1000}
+    for key in ("a", "b"):
+        cache.put(key, payload)
+        os.utime(cache._path(key), (1000, 1000) if key == "a" else (2000, 2000))
+
+    # Touch "a" so that "b" becomes the least recently used entry
+    assert cache.get("a") is not None
+    cache.put("c", payload)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+def test_disk_tier_scans_only_when_the_estimate_crosses_the_limit(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_bytes=100_000, memory_bytes=0)
+    scans = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: scans.append(path) or listdir(path))
+
+    payload = {"red_flags": [], "blob": b"x" * 1000}
+    for i in range(15):
+        cache.put(f"small{i}", payload)
+    # One initial scan, one after an eighth of the budget was written
+    assert len(scans) == 2
+
+    cache.put("big", {"red_flags": [], "blob": b"x" * 95_000})
+    assert len(scans) == 3
+    assert sum(os.path.getsize(tmp_path / name) for name in listdir(tmp_path)) <= 100_000
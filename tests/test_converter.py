@@ -0,0 +1,144 @@
+import cv2
+import numpy as np
+import io
+import os
+import sys
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from PIL import Image
+from src.converter import DocumentProcessor
+
+def create_scanned_pdf(page_count=3):
+    # Pillow writes each page as a single full-page DCTDecode image, like a scanner
+    pages = []
+    for i in range(page_count):
+        img = np.ones((330, 255, 3), dtype=np.uint8) * 255
+        cv2.putText(img, f"PAGE {i + 1}", (30, 160), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+        pages.append(Image.fromarray(img))
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format="PDF", save_all=True, append_images=pages[1:], resolution=72)
+    return buffer.getvalue()
+
+TEXT_PDF = b"%PDF-1.4\n1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n3 0 obj\n<< /Type /Page /Parent 2 0 R /Resources << >> /MediaBox [0 0 612 792] /Contents 4 0 R >>\nendobj\n4 0 obj\n<< /Length 20 >>\nstream\nBT /F1 12 Tf ET\nendstream\nendobj\nxref\n0 5\n0000000000 65535 f\n0000000009 00000 n\n0000000058 00000 n\n0000000115 00000 n\n0000000213 00000 n\ntrailer\n<< /Size 5 /Root 1 0 R >>\nstartxref\n283\n%%EOF"
+
+def test_embedded_pages_skip_rendering():
+    processor = DocumentProcessor()
+    pdf_bytes = create_scanned_pdf()
+
+    pages = list(processor.iter_pdf_pages(pdf_bytes))
+    assert [p.page_number for p in pages] == [1, 2, 3]
+    for page in pages:
+        assert page.source == "embedded"
+        assert page.encoded.startswith(b"\xff\xd8")
+        assert page.image.shape == (330, 255, 3)
+        # Pixels are the embedded JPEG decoded as-is, not a re-render
+        decoded = cv2.imdecode(np.frombuffer(page.encoded, np.uint8), cv2.IMREAD_COLOR)
+        assert np.array_equal(page.image, decoded)
+
+    assert processor.process_pdf(pdf_bytes).shape == (330, 255, 3)
+
+def add_text_layer(pdf_bytes, render_mode, in_form=False):
+    """Adds an OCR-style text layer over the first page, directly or in a form XObject."""
+    from pypdf import PdfReader, PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject, ArrayObject, FloatObject
+
+    writer = PdfWriter(clone_from=PdfReader(io.BytesIO(pdf_bytes)))
+    page = writer.pages[0]
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    fonts = DictionaryObject({NameObject("/F1"): font})
+    text = f"BT /F1 12 Tf {render_mode} Tr 10 10 Td (INVOICE 42) Tj ET".encode()
+
+    resources = page["/Resources"]
+    if in_form:
+        form = DecodedStreamObject()
+        form.set_data(text)
+        form.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): ArrayObject([FloatObject(0), FloatObject(0), FloatObject(255), FloatObject(330)]),
+            NameObject("/Resources"): DictionaryObject({NameObject("/Font"): fonts}),
+        })
+        resources["/XObject"][NameObject("/OCR")] = writer._add_object(form)
+        text = b"q /OCR Do Q"
+    else:
+        resources[NameObject("/Font")] = fonts
+
+    contents = DecodedStreamObject()
+    contents.set_data(page.get_contents().get_data() + b"\n" + text)
+    page[NameObject("/Contents")] = writer._add_object(contents)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def test_searchable_scans_keep_the_fast_path():
+    processor = DocumentProcessor()
+    for in_form in (False, True):
+        reader = processor._open_pdf_reader(add_text_layer(create_scanned_pdf(1), 3, in_form=in_form))
+        page = processor._extract_embedded_page(reader, 1)
+        assert page is not None and page.source == "embedded"
+
+        # Visible text on top of the scan changes what the page looks like
+        reader = processor._open_pdf_reader(add_text_layer(create_scanned_pdf(1), 0, in_form=in_form))
+        assert processor._extract_embedded_page(reader, 1) is None
+
+def test_vector_page_falls_back_to_render():
+    processor = DocumentProcessor()
+    reader = processor._open_pdf_reader(TEXT_PDF)
+    assert reader is not None
+    assert processor._extract_embedded_page(reader, 1) is None
+
+def test_rendered_chunks_share_one_copy_of_the_pdf(monkeypatch):
+    from pypdf import PdfWriter
+    import src.converter
+
+    writer = PdfWriter()
+    for _ in range(5):
+        writer.add_blank_page(100, 100)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    pdf_bytes = buffer.getvalue()
+
+    calls = []
+    def fake_convert(path, dpi, first_page, last_page, output_folder, paths_only, poppler_path):
+        with open(path, "rb") as f:
+            assert f.read() == pdf_bytes
+        calls.append((path, first_page, last_page))
+        paths = []
+        for number in range(first_page, last_page + 1):
+            paths.append(os.path.join(output_folder, f"render-{number:04d}.png"))
+            cv2.imwrite(paths[-1], np.full((20, 20, 3), number, dtype=np.uint8))
+        return paths
+    monkeypatch.setattr(src.converter, "convert_from_path", fake_convert)
+
+    pages = list(DocumentProcessor().iter_pdf_pages(pdf_bytes, chunk_size=2))
+    assert [(p.page_number, int(p.image[0, 0, 0])) for p in pages] == [(n, n) for n in range(1, 6)]
+    assert [call[1:] for call in calls] == [(1, 2), (3, 4), (5, 5)]
+    # Every chunk renders from the same file instead of a fresh copy of the bytes
+    assert len({call[0] for call in calls}) == 1
+
+def test_word_extraction_ranks_by_header_and_sees_floating_images():
+    import docx
+    doc = docx.Document()
+    for width in (60, 140, 100):
+        img = np.full((50, width, 3), 180, dtype=np.uint8)
+        doc.add_picture(io.BytesIO(cv2.imencode(".png", img)[1].tobytes()))
+
+    # An image part related to the body but not placed as an inline shape,
+    # like a floating/anchored picture
+    floating = np.zeros((90, 200, 3), dtype=np.uint8)
+    floating[:, :, 2] = 255
+    doc.part.get_or_add_image(io.BytesIO(cv2.imencode(".png", floating)[1].tobytes()))
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+
+    processor = DocumentProcessor()
+    images = processor.extract_word_images(buffer.getvalue(), top_k=3)
+    assert [img.shape for img in images] == [(90, 200, 3), (50, 140, 3), (50, 100, 3)]
+    assert np.array_equal(processor.process_word(buffer.getvalue()), floating)
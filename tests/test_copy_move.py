@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+import os
+import sys
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.copy_move import CopyMoveDetector
+
+def create_page_with_stamp(seed=0):
+    rng = np.random.default_rng(seed)
+    page = np.full((1754, 1240, 3), 240, dtype=np.uint8)
+    page = np.clip(page + rng.normal(0, 3, page.shape), 0, 255).astype(np.uint8)
+    for i in range(20):
+        cv2.putText(page, f"Line {i} amount {i * 137 % 1000}.{i * 7 % 100:02d}", (60, 100 + i * 70),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 2)
+
+    stamp = np.full((200, 200, 3), 240, dtype=np.uint8)
+    cv2.circle(stamp, (100, 100), 85, (40, 40, 180), 6)
+    cv2.putText(stamp, "PAID", (35, 115), cv2.FONT_HERSHEY_SIMPLEX, 1.6, (40, 40, 180), 4)
+    for _ in range(25):
+        p1 = tuple(int(v) for v in rng.integers(25, 175, 2))
+        p2 = tuple(int(v) for v in rng.integers(25, 175, 2))
+        cv2.line(stamp, p1, p2, (60, 60, 200), 2)
+    page[1500:1700, 100:300] = stamp
+    return page
+
+def test_cloned_stamp_is_found():
+    detector = CopyMoveDetector()
+    page = create_page_with_stamp()
+    assert detector.detect(page)["pairs"] == []
+
+    page[1500:1700, 800:1000] = page[1500:1700, 100:300]
+    result = detector.detect(page)
+    assert len(result["pairs"]) == 1
+    pair = result["pairs"][0]
+    assert abs(pair["offset"][0] - 700) <= 4 and abs(pair["offset"][1]) <= 4
+    sx, sy, sw, sh = pair["source"]
+    assert 80 <= sx <= 200 and 1480 <= sy <= 1600
+    assert pair["similarity"] > 0.9
+
+def create_statement(rows=20, pitch=70, seed=0):
+    # Every row carries the same words, as a statement of recurring fees does
+    rng = np.random.default_rng(seed)
+    page = np.full((1754, 1240, 3), 240, dtype=np.uint8)
+    page = np.clip(page + rng.normal(0, 3, page.shape), 0, 255).astype(np.uint8)
+    for i in range(rows):
+        cv2.putText(page, "Monthly service fee      12.50", (60, 100 + i * pitch),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 2)
+    return page
+
+def test_repeated_text_lines_are_not_clones():
+    detector = CopyMoveDetector()
+    page = create_statement()
+    result = detector.detect(page)
+    assert result["pairs"] == []
+    assert abs(result["line_pitch"] / result["scale"] - 70) < 1
+
+    # A stamp moved straight down by whole lines is still a clone
+    stamp = create_page_with_stamp()[1500:1700, 100:300]
+    page[200:400, 800:1000] = stamp
+    page[1180:1380, 800:1000] = stamp
+    pairs = detector.detect(page)["pairs"]
+    assert len(pairs) == 1
+    assert abs(pairs[0]["offset"][0]) <= 4 and abs(pairs[0]["offset"][1] - 980) <= 4
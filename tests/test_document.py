@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+import io
+import os
+import sys
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import docx
+import src.document
+from src.converter import DocumentProcessor
+from src.document import ParsedDocument
+from src.metadata import scan_metadata
+
+def create_docx_bytes(image_sizes=((120, 80),)):
+    doc = docx.Document()
+    doc.core_properties.author = "Photoshop Operator"
+    for width, height in image_sizes:
+        img = np.full((height, width, 3), 200, dtype=np.uint8)
+        success, encoded = cv2.imencode(".png", img)
+        assert success
+        doc.add_picture(io.BytesIO(encoded.tobytes()))
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def test_docx_is_parsed_once(monkeypatch):
+    calls = []
+    real_document = src.document.Document
+
+    def counting_document(stream):
+        calls.append(stream)
+        return real_document(stream)
+
+    monkeypatch.setattr(src.document, "Document", counting_document)
+
+    document = ParsedDocument(create_docx_bytes(), "report.docx")
+    assert document.kind == 'docx'
+
+    red_flags = scan_metadata(document)
+    image = DocumentProcessor().process_word(document)
+
+    assert any("photoshop" in flag for flag in red_flags)
+    assert image.shape == (80, 120, 3)
+    assert len(calls) == 1
+
+def test_wrap_accepts_bytes_and_file_objects():
+    data = create_docx_bytes()
+    document = ParsedDocument.wrap(data)
+    assert ParsedDocument.wrap(document) is document
+
+    stream = io.BytesIO(data)
+    stream.seek(10)
+    assert ParsedDocument.wrap(stream).file_bytes == data
+    assert stream.tell() == 0
@@ -6,7 +6,9 @@ import sys
 # Add src to path if needed
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from benchmarks.corpus import page_image
 from src.analyzer import ForgeryDetector
+from src.pipeline import analyze_document
 
 def create_dummy_image(path):
     # Create a 400x400 white image
@@ -41,6 +43,163 @@ def test_ela():
         if os.path.exists(test_img_path):
             os.remove(test_img_path)
 
+def test_ela_in_memory():
+    detector = ForgeryDetector()
+    img = np.ones((400, 400, 3), dtype=np.uint8) * 255
+    cv2.putText(img, "DUMMY DOCUMENT", (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    success, encoded = cv2.imencode(".jpg", img)
+    assert success
+
+    # Array and bytes entry points must agree and never touch the disk
+    from_bytes = detector.perform_ela_bytes(encoded.tobytes())
+    from_array = detector.perform_ela_array(cv2.imdecode(encoded, cv2.IMREAD_COLOR))
+    assert from_bytes.shape == (400, 400, 3)
+    assert np.array_equal(from_bytes, from_array)
+    assert not os.path.exists("temp_resaved.jpg")
+
+    gray_ela = detector.perform_ela_array(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+    assert gray_ela.shape == (400, 400)
+
+def test_ela_sweep():
+    detector = ForgeryDetector()
+    img = np.ones((400, 400, 3), dtype=np.uint8) * 255
+    cv2.putText(img, "DUMMY DOCUMENT", (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+
+    stack, stats = detector.perform_ela_sweep(img, qualities=(70, 90))
+    assert stack.shape == (2, 400, 400, 3)
+    assert [s["quality"] for s in stats] == [70, 90]
+    # Each slice must match the single-quality ELA
+    assert np.array_equal(stack[1], detector.perform_ela_array(img, quality=90))
+    # Lower quality throws away more detail
+    assert stats[0]["mean_error"] >= stats[1]["mean_error"]
+
+def test_ela_tiled_matches_whole_image(tmp_path):
+    detector = ForgeryDetector()
+    img = np.ones((333, 517, 3), dtype=np.uint8) * 255
+    cv2.putText(img, "DUMMY DOCUMENT", (20, 150), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    cv2.rectangle(img, (300, 40), (480, 300), (40, 90, 200), -1)
+    expected = detector.perform_ela_array(img)
+
+    # A tiny budget forces many MCU-aligned tiles, including ragged edges
+    tiled = detector.perform_ela_tiled(img, memory_budget=50000)
+    assert np.array_equal(tiled, expected)
+
+    mapped = detector.perform_ela_tiled(img, memory_budget=50000, memmap_path=str(tmp_path / "ela.dat"))
+    assert isinstance(mapped, np.memmap)
+    assert np.array_equal(np.asarray(mapped), expected)
+
+def test_ela_scoring_localizes_pasted_region():
+    detector = ForgeryDetector()
+    img = np.ones((480, 640, 3), dtype=np.uint8) * 245
+    for i in range(12):
+        cv2.putText(img, "Lorem ipsum dolor sit amet 1234", (20, 35 + i * 38), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (20, 20, 20), 2)
+    success, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    document = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+    clean = detector.score_ela(detector.perform_ela_array(document), document)
+    assert clean["score"] < 0.15
+
+    # Paste a never-compressed patch, as an editor would when changing an amount
+    forged = document.copy()
+    patch = np.ones((60, 160, 3), dtype=np.uint8) * 245
+    cv2.putText(patch, "$9,999", (5, 45), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (20, 20, 20), 3)
+    forged[300:360, 400:560] = patch
+
+    result = detector.score_ela(detector.perform_ela_array(forged), forged)
+    assert result["score"] > 0.5
+    assert result["block_scores"].shape == (60, 80)
+    top = result["regions"][0]
+    assert 380 <= top["x"] <= 420 and 290 <= top["y"] <= 320
+    assert top["x"] + top["width"] >= 540
+
+def test_jpeg_compression_history():
+    detector = ForgeryDetector()
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur((rng.random((520, 520, 3)) * 255).astype(np.uint8), (0, 0), 2)
+    base = cv2.add(base, (rng.random((520, 520, 3)) * 30).astype(np.uint8))
+
+    def encode(img, quality):
+        return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+    def decode(data):
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+    single = detector.analyze_jpeg_compression(encode(base, 85))
+    assert single["quality_estimate"] == 85 and single["standard_tables"]
+    assert not single["double_compressed"]
+    assert not single["grid_misaligned"]
+
+    double = detector.analyze_jpeg_compression(encode(decode(encode(base, 60)), 85))
+    assert double["double_compressed"]
+
+    # Cropping 3 columns and 5 rows moves the old grid to x=5, y=3
+    cropped = detector.analyze_jpeg_compression(encode(decode(encode(base, 60))[5:, 3:], 90))
+    assert cropped["grid_misaligned"]
+    assert cropped["grid_offset"] == (5, 3)
+
+def test_text_pages_saved_once_are_not_double_compressed():
+    detector = ForgeryDetector()
+    # Repeated glyphs give irregular coefficient histograms without any earlier compression
+    page = page_image(1, seed=3)
+    for quality in (75, 80, 85, 90):
+        encoded = cv2.imencode(".jpg", page, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+        result = detector.analyze_jpeg_compression(encoded)
+        assert result["quality_estimate"] == quality
+        assert not result["double_compressed"], quality
+
+    resaved = cv2.imdecode(cv2.imencode(".jpg", page, [cv2.IMWRITE_JPEG_QUALITY, 60])[1], cv2.IMREAD_COLOR)
+    encoded = cv2.imencode(".jpg", resaved, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+    assert detector.analyze_jpeg_compression(encoded)["double_compressed"]
+
+def create_noisy_page(height=1100, width=850, seed=0):
+    # A scanned-looking PNG page: paper gradient, sensor noise and text
+    rng = np.random.default_rng(seed)
+    paper = 200 + np.linspace(-30, 20, width)[None, :] + rng.normal(0, 3, (height, width))
+    page = np.clip(paper, 0, 255).astype(np.uint8)
+    for y in range(80, height - 40, 60):
+        cv2.putText(page, "Invoice total 1234.56", (40, y), cv2.FONT_HERSHEY_SIMPLEX, 1.0, 40, 2)
+    return cv2.cvtColor(page, cv2.COLOR_GRAY2BGR)
+
+def test_noise_analysis_finds_splice_and_resampling():
+    detector = ForgeryDetector()
+    page = create_noisy_page()
+    clean = detector.analyze_noise(page)
+    assert clean["score"] < 0.15
+    assert clean["noise_scores"].shape == (1100 // 32, 850 // 32)
+
+    # A noise-free patch (e.g. typed in an editor) and an enlarged copy of part of the page
+    forged = page.copy()
+    forged[320:480, 480:800] = 200
+    enlarged = cv2.resize(page[700:800, 100:300], None, fx=1.6, fy=1.6, interpolation=cv2.INTER_LINEAR)
+    forged[700:860, 100:420] = enlarged
+
+    result = detector.analyze_noise(forged)
+    assert result["score"] > 0.3
+    boxes = [(r["x"], r["y"], r["x"] + r["width"], r["y"] + r["height"]) for r in result["regions"]]
+    assert any(x0 <= 490 and y0 <= 330 and x1 >= 780 and y1 >= 470 for x0, y0, x1, y1 in boxes)
+    assert any(x0 <= 110 and y0 <= 710 and x1 >= 400 for x0, y0, x1, y1 in boxes)
+    assert np.nanmean(result["resampling_scores"][22:26, 4:12]) > np.nanmean(result["resampling_scores"])
+
+    ela = detector.score_ela(detector.perform_ela_array(forged), forged)
+    combined = detector.combine_scores(ela, result, ela_weight=0.5)
+    assert combined["block_scores"].shape == result["noise_scores"].shape
+    assert combined["regions"] and combined["score"] > 0.3
+
+    # With no time left the spectra are skipped, not the page
+    rushed = detector.analyze_noise(forged, time_budget=0)
+    assert rushed["budget_exhausted"]
+    assert np.isnan(rushed["resampling_scores"]).all()
+    assert rushed["regions"]
+
+def test_images_smaller_than_a_block_are_noted_not_fatal():
+    # A 20 px thumbnail fits ELA blocks but not a noise block; a 6 px one fits neither
+    for side, skipped in ((20, ["Noise analysis"]), (6, ["ELA scoring", "Noise analysis"])):
+        image = np.full((side, side, 3), 200, dtype=np.uint8)
+        report = analyze_document(cv2.imencode(".jpg", image)[1].tobytes(), "thumbnail.jpg")
+        page = report["pages"][0]
+        assert [note.split(" skipped")[0] for note in page["notes"]] == skipped
+        assert page["noise"]["score"] == 0.0 and page["combined"]["regions"] == []
+
 if __name__ == "__main__":
     success = test_ela()
     sys.exit(0 if success else 1)
@@ -0,0 +1,47 @@
+import cv2
+import numpy as np
+import os
+import sys
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src import instrumentation
+from src.pipeline import analyze_document
+
+class RecordingExporter(instrumentation.SpanExporter):
+    def __init__(self):
+        self.spans = []
+
+    def finish(self, span):
+        self.spans.append(span)
+
+def test_stage_spans_and_exporters(tmp_path):
+    assert instrumentation.span("idle") is instrumentation.NULL_SPAN
+
+    img = np.full((240, 320, 3), 200, dtype=np.uint8)
+    cv2.putText(img, "INVOICE 42", (20, 120), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    file_bytes = cv2.imencode(".jpg", img)[1].tobytes()
+
+    recorder = RecordingExporter()
+    prometheus = instrumentation.PrometheusTextfileExporter(str(tmp_path / "metrics.prom"))
+    profiler = instrumentation.SlowRequestProfiler(str(tmp_path / "profiles"), threshold=0.0)
+    instrumentation.configure([recorder, prometheus, profiler], track_memory=True)
+    try:
+        analyze_document(file_bytes, "invoice.jpg")
+    finally:
+        instrumentation.configure([])
+
+    spans = {span.name: span for span in recorder.spans}
+    root = spans["analyze_document"]
+    assert root.parent is None and root.attributes["bytes_in"] == len(file_bytes)
+    ela = spans["ela.resave"]
+    assert ela.root is root
+    assert (ela.attributes["width_out"], ela.attributes["height_out"]) == (320, 240)
+    assert ela.attributes["peak_alloc"] > 0
+    assert root.attributes["peak_alloc"] >= ela.attributes["peak_alloc"]
+    assert "metadata.exif" in spans and "copy_move.detect" in spans
+
+    metrics = (tmp_path / "metrics.prom").read_text()
+    assert 'forgery_stage_duration_seconds_count{stage="ela.resave"} 1' in metrics
+    assert any(name.endswith(".prof") for name in os.listdir(tmp_path / "profiles"))
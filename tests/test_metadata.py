@@ -0,0 +1,121 @@
+import io
+import os
+import sys
+import zipfile
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import docx
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import NameObject, StreamObject
+from src.metadata import scan_metadata
+from src.pdf_structure import PdfStructure
+
+XMP_PACKET = b"""<?xpacket begin="" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:xmp="http://ns.adobe.com/xap/1.0/"
+    xmlns:pdf="http://ns.adobe.com/pdf/1.3/"
+    xmlns:xmpMM="http://ns.adobe.com/xap/1.0/mm/"
+    xmlns:stEvt="http://ns.adobe.com/xap/1.0/sType/ResourceEvent#"
+    xmp:CreatorTool="Scanner Suite 2.1"
+    pdf:Producer="Scanner Suite 2.1">
+   <xmpMM:History>
+    <rdf:Seq>
+     <rdf:li stEvt:action="created" stEvt:softwareAgent="Scanner Suite 2.1" stEvt:when="2023-01-02T10:00:00Z"/>
+     <rdf:li rdf:parseType="Resource">
+      <stEvt:action>saved</stEvt:action>
+      <stEvt:softwareAgent>Adobe Photoshop 24.0</stEvt:softwareAgent>
+      <stEvt:when>2023-03-04T12:00:00Z</stEvt:when>
+     </rdf:li>
+    </rdf:Seq>
+   </xmpMM:History>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="r"?>"""
+
+def create_pdf_bytes(xmp=None, padding=0):
+    writer = PdfWriter()
+    writer.add_blank_page(200, 200)
+    writer.add_metadata({"/Producer": "Scanner Suite 2.1", "/CreationDate": "D:20230102100000Z"})
+    if xmp is not None:
+        stream = StreamObject()
+        stream.set_data(xmp)
+        stream[NameObject("/Type")] = NameObject("/Metadata")
+        stream[NameObject("/Subtype")] = NameObject("/XML")
+        writer._root_object[NameObject("/Metadata")] = writer._add_object(stream)
+    if padding:
+        # A large uncompressed stream stands in for page content
+        filler = StreamObject()
+        filler.set_data(b"0" * padding)
+        writer._root_object[NameObject("/Filler")] = writer._add_object(filler)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def save_incremental_update(pdf_bytes, metadata):
+    writer = PdfWriter(PdfReader(io.BytesIO(pdf_bytes)), incremental=True)
+    writer.add_metadata(metadata)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def test_original_pdf_has_no_flags():
+    assert scan_metadata(io.BytesIO(create_pdf_bytes())) == []
+
+def test_incremental_update_and_xmp_history_are_reported():
+    original = create_pdf_bytes(XMP_PACKET)
+    updated = save_incremental_update(original, {"/Producer": "GIMP 2.10", "/ModDate": "D:20230304120000Z"})
+
+    structure = PdfStructure(memoryview(updated))
+    assert len(structure.sections) == 2
+    assert structure.sections[0].kind in ("table", "stream")
+
+    red_flags = scan_metadata(updated)
+    assert any(flag.startswith("Incremental update: PDF was saved 1 more time") for flag in red_flags)
+    assert not any(flag.startswith("Incremental update") for flag in scan_metadata(updated, count_updates=False))
+    assert "Modification detected: Creation and Modification dates differ." in red_flags
+    assert any("'gimp' found in Producer" in flag for flag in red_flags)
+    assert any("'photoshop' found in XMP History" in flag for flag in red_flags)
+    assert any(flag.startswith("Edit history: XMP records 1 change(s) with Adobe Photoshop 24.0") for flag in red_flags)
+    assert any(flag.startswith("Metadata mismatch: Info Producer 'GIMP 2.10'") for flag in red_flags)
+
+def test_pdf_path_is_memory_mapped(tmp_path):
+    path = tmp_path / "large.pdf"
+    path.write_bytes(create_pdf_bytes(padding=8 * 1024 * 1024))
+    assert scan_metadata(str(path)) == []
+    with open(path, "rb") as f:
+        assert scan_metadata(f) == []
+
+def test_damaged_xref_falls_back_to_pypdf():
+    pdf_bytes = create_pdf_bytes()
+    start = pdf_bytes.rindex(b"startxref")
+    damaged = pdf_bytes[:start] + b"startxref\n99999999\n%%EOF\n"
+    red_flags = scan_metadata(damaged)
+    assert not any(flag.startswith("Error scanning metadata") for flag in red_flags)
+
+def test_docx_core_and_app_properties():
+    document = docx.Document()
+    document.core_properties.author = "Analyst"
+    buffer = io.BytesIO()
+    document.save(buffer)
+
+    # Rewrite docProps/app.xml to name an editing tool
+    source = zipfile.ZipFile(io.BytesIO(buffer.getvalue()))
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as target:
+        for item in source.infolist():
+            data = source.read(item)
+            if item.filename == "docProps/app.xml":
+                data = (
+                    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    b'<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties">'
+                    b'<Application>I Love PDF Converter</Application><Company>Acme</Company></Properties>'
+                )
+            target.writestr(item, data)
+
+    red_flags = scan_metadata(io.BytesIO(output.getvalue()))
+    assert red_flags == ["Suspicious keyword 'i love pdf' found in Application: 'I Love PDF Converter'"]
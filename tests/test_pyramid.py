@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+import os
+import pickle
+import sys
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.cache import encode_page_images
+from src.pyramid import build_pyramid, pyramid_info, pyramid_size, render_region, tiles_for_region
+
+def create_page(height=1700, width=1300):
+    rng = np.random.default_rng(0)
+    page = cv2.GaussianBlur((rng.random((height, width, 3)) * 255).astype(np.uint8), (0, 0), 4)
+    cv2.rectangle(page, (900, 1200), (1100, 1300), (0, 0, 255), -1)
+    return page
+
+def test_pyramid_levels_and_region_tiles():
+    page = create_page()
+    pyramid = build_pyramid(page, tile_size=256, preview_side=400)
+
+    assert [(level["columns"], level["rows"]) for level in pyramid["levels"]] == [(6, 7), (3, 4), (2, 2), (1, 1)]
+    preview = cv2.imdecode(np.frombuffer(pyramid["preview"], np.uint8), cv2.IMREAD_COLOR)
+    assert max(preview.shape[:2]) == 400
+    assert pyramid_size(pyramid) < page.nbytes // 10
+    assert "tiles" not in pyramid_info(pyramid)["levels"][0]
+    pickle.dumps(pyramid_info(pyramid))
+
+    # A small region at full resolution only needs the tiles under it
+    fetched = []
+    def fetch_tile(level, column, row):
+        fetched.append((level, column, row))
+        return pyramid["levels"][level]["tiles"][row][column]
+
+    view = render_region(pyramid_info(pyramid), 880, 1180, 240, 140, max_side=400, fetch_tile=fetch_tile)
+    assert view.shape[:2] == (140, 240)
+    assert sorted(fetched) == [(0, 3, 4), (0, 3, 5), (0, 4, 4), (0, 4, 5)]
+    assert np.abs(view.astype(int) - page[1180:1320, 880:1120].astype(int)).mean() < 4
+
+    # A large region is read from a coarser level
+    overview = render_region(pyramid, 0, 0, 1300, 1700, max_side=500)
+    assert max(overview.shape[:2]) <= 500
+    assert tiles_for_region(pyramid, 2, 0, 0, 1300, 1700) == [(0, 0), (1, 0), (0, 1), (1, 1)]
+
+def test_lossless_pyramid_renders_exact_pixels():
+    ela = (np.random.default_rng(1).random((900, 700, 3)) * 60).astype(np.uint8)
+    pyramid = build_pyramid(ela, tile_size=256, image_format="png")
+    view = render_region(pyramid, 300, 200, 300, 300, max_side=400)
+    assert np.array_equal(view, ela[200:500, 300:600])
+
+def test_encoded_pages_carry_pyramids():
+    page = {"page_number": 1, "image": create_page(600, 500), "ela_image": np.zeros((600, 500, 3), np.uint8)}
+    packed = encode_page_images(page)
+    assert packed["image"].startswith(b"\x89PNG")
+    assert packed["image_pyramid"]["width"] == 500
+    assert packed["ela_image_pyramid"]["levels"][-1]["columns"] == 1
+    # ELA maps are zoomed into for their exact error levels, so they stay lossless
+    assert packed["image_pyramid"]["format"] == "jpg"
+    assert packed["ela_image_pyramid"]["format"] == packed["ela_image_pyramid"]["preview_format"] == "png"
+    # Already encoded pages keep their pyramids
+    assert encode_page_images(packed)["image_pyramid"] is packed["image_pyramid"]
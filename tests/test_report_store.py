@@ -0,0 +1,103 @@
+import cv2
+import numpy as np
+from pypdf import PdfReader, PdfWriter
+import io
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.batch import run_batch
+from src.pipeline import analyze_document
+from src.report_store import ArrayStore, ReportStore, flag_category
+from test_converter import create_scanned_pdf
+
+def make_report(index, producer, tamper_score, red_flags=()):
+    return {
+        "filename": f"doc_{index}.pdf",
+        "kind": "pdf",
+        "sha256": f"{index:064x}",
+        "red_flags": list(red_flags),
+        "metadata": {"Producer": producer, "CreationDate": "D:20240101000000Z"},
+        "tamper_score": tamper_score,
+        "pages": [{"page_number": 1, "ela": {"score": tamper_score}, "regions": [], "copy_move": []}],
+    }
+
+def test_flag_categories():
+    assert flag_category("ELA: Localized error-level anomaly on page 2 (tamper score 0.40).") == "ELA"
+    assert flag_category("Revision 2: Incremental update at bytes 10-20 changed 3 object(s).") == "Revision"
+    assert flag_category("Suspicious keyword 'photoshop' found in Producer: 'Adobe Photoshop'") == "Suspicious keyword"
+
+def test_array_store_reads_row_bands(tmp_path):
+    arrays = ArrayStore(str(tmp_path), chunk_rows=64)
+    ela = np.random.default_rng(0).integers(0, 40, (300, 120, 3), dtype=np.uint8)
+    key = arrays.put(ela)
+    assert arrays.put(ela.copy()) == key and key in arrays
+    assert np.array_equal(arrays.get(key), ela)
+    assert np.array_equal(arrays.get(key, rows=slice(100, 140)), ela[100:140])
+    assert arrays.get(key, rows=slice(50, 50)).shape == (0, 120, 3)
+
+def test_store_queries_history(tmp_path):
+    path = str(tmp_path / "reports.sqlite")
+    store = ReportStore(path)
+    last_month = datetime.now() - timedelta(days=30)
+    flags = ["Suspicious keyword 'photoshop' found in Producer: 'Adobe Photoshop 25.0'",
+             "ELA: Localized error-level anomaly on page 1 (tamper score 0.60, 1 suspicious region(s))."]
+    old = store.add(make_report(0, "Adobe Photoshop 25.0", 0.9, flags), analyzed=(last_month - timedelta(days=5)).timestamp())
+    ids = store.add_many([
+        make_report(1, "Adobe Photoshop 25.0", 0.6, flags),
+        make_report(2, "Adobe Photoshop 25.0", 0.05),
+        make_report(3, "Microsoft Word", 0.8, flags[1:]),
+    ])
+    assert ids == [old + 1, old + 2, old + 3]
+    store.close()
+
+    # Reopened from disk, the scalar columns answer history queries
+    store = ReportStore(path)
+    assert len(store) == 4
+    recent = store.query(since=last_month, producer="photoshop", min_tamper_score=0.3)
+    assert [row["filename"] for row in recent] == ["doc_1.pdf"]
+    assert {row["filename"] for row in store.query(flag="ELA")} == {"doc_0.pdf", "doc_1.pdf", "doc_3.pdf"}
+    assert store.count(flag="Suspicious keyword", since=last_month) == 1
+    assert store.count(producer="100%") == 0
+    assert recent[0]["producer"] == "Adobe Photoshop 25.0" and recent[0]["red_flag_count"] == 2
+    assert store.get(ids[0])["metadata"]["Producer"] == "Adobe Photoshop 25.0"
+    assert store.red_flags(ids[2]) == flags[1:]
+
+def test_analyzed_reports_keep_metadata_and_ela_maps(tmp_path):
+    store = ReportStore(str(tmp_path / "reports.sqlite"))
+    writer = PdfWriter(clone_from=PdfReader(io.BytesIO(create_scanned_pdf(1))))
+    writer.add_metadata({"/Producer": "Adobe Photoshop 25.0"})
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    report = analyze_document(buffer.getvalue(), "statement.pdf", keep_images=True)
+    report_id = store.add(report)
+
+    row = store.query(sha256=report["sha256"])[0]
+    assert row["id"] == report_id and row["producer"] == "Adobe Photoshop 25.0"
+    stored = store.get(report_id)
+    assert "ela_image" not in stored["pages"][0] and "image" not in stored["pages"][0]
+    ela_map = store.load_ela_map(stored["pages"][0]["ela_map"])
+    assert np.array_equal(ela_map, report["pages"][0]["ela_image"])
+
+    # Batch runs bulk-insert their records; workers store the ELA maps
+    for i in range(3):
+        image = np.full((120, 160, 3), 200, dtype=np.uint8)
+        cv2.putText(image, f"DOC {i}", (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+        cv2.imwrite(str(tmp_path / f"doc_{i}.jpg"), image)
+    paths = [str(tmp_path / f"doc_{i}.jpg") for i in range(3)]
+    output = tmp_path / "results.jsonl"
+    summary = run_batch(paths, str(output), workers=1, log=io.StringIO(), store_path=str(tmp_path / "reports.sqlite"))
+    assert summary["analyzed"] == 3
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert all("ela_map" in record["pages"][0] for record in records)
+
+    store = ReportStore(str(tmp_path / "reports.sqlite"))
+    assert store.count(kind="image") == 3
+    row = store.query(filename="doc_2.jpg")[0]
+    assert row["status"] == "ok" and row["path"] == paths[2] and row["elapsed"] > 0
+    key = store.get(row["id"])["pages"][0]["ela_map"]
+    assert store.load_ela_map(key).shape == (120, 160, 3)
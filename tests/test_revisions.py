@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+import io
+import os
+import sys
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DictionaryObject, NameObject, NumberObject
+from src.converter import DocumentProcessor
+from src.document import ParsedDocument
+from src.pipeline import analyze_document, document_findings
+from src.revisions import analyze_revisions, changed_pages, find_trailers
+from test_converter import create_scanned_pdf
+
+def replace_page_image(pdf_bytes, page_index):
+    """Appends an incremental update that swaps one page's scan and adds a font."""
+    writer = PdfWriter(PdfReader(io.BytesIO(pdf_bytes)), incremental=True)
+    page = writer.pages[page_index]
+    xobjects = page["/Resources"]["/XObject"]
+    image = xobjects[list(xobjects.keys())[0]].get_object()
+
+    forged = np.ones((330, 255, 3), dtype=np.uint8) * 255
+    cv2.putText(forged, "PAID", (30, 160), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    jpeg = cv2.imencode(".jpg", forged)[1].tobytes()
+    image._data = jpeg
+    image[NameObject("/Length")] = NumberObject(len(jpeg))
+
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica-Bold"),
+    })
+    writer._root_object[NameObject("/ExtraFont")] = writer._add_object(font)
+
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+def test_original_pdf_has_one_revision():
+    pdf_bytes = create_scanned_pdf()
+    revisions = analyze_revisions(pdf_bytes)
+    assert len(revisions) == 1
+    assert revisions[0].start == 0 and revisions[0].end == len(pdf_bytes.rstrip())
+    assert changed_pages(revisions) == []
+
+def test_incremental_update_reports_changed_page_and_font():
+    original = create_scanned_pdf()
+    updated = replace_page_image(original, 1)
+
+    assert len(find_trailers(updated)) == 2
+    revisions = analyze_revisions(memoryview(updated))
+    assert [r.index for r in revisions] == [0, 1]
+    assert revisions[1].start == revisions[0].end
+    assert revisions[1].pages == [2]
+    assert revisions[1].added_pages == []
+    assert revisions[1].fonts == ["Helvetica-Bold"]
+    assert changed_pages(revisions) == [2]
+
+def test_changed_pages_only_skips_untouched_pages():
+    updated = replace_page_image(create_scanned_pdf(), 2)
+
+    assert [p.page_number for p in DocumentProcessor().iter_pdf_pages(updated, pages=[3, 1])] == [1, 3]
+
+    report = analyze_document(updated, "statement.pdf", changed_pages_only=True)
+    assert [page["page_number"] for page in report["pages"]] == [3]
+    assert len(report["revisions"]) == 2
+    assert any(flag.startswith("Revision 1: Incremental update") and "page(s) 3" in flag for flag in report["red_flags"])
+    # The update is flagged once, by its revision, not again by the metadata scan
+    assert sum("Incremental update" in flag for flag in report["red_flags"]) == 1
+
+    full = analyze_document(updated, "statement.pdf")
+    assert [page["page_number"] for page in full["pages"]] == [1, 2, 3]
+
+def test_findings_parse_the_pdf_structure_once(monkeypatch):
+    import src.document, src.metadata, src.revisions
+    built = []
+    original = src.document.PdfStructure
+    def counting(buffer):
+        built.append(len(buffer))
+        return original(buffer)
+    for module in (src.document, src.metadata, src.revisions):
+        monkeypatch.setattr(module, "PdfStructure", counting)
+
+    document = ParsedDocument(replace_page_image(create_scanned_pdf(), 0), "statement.pdf")
+    report = document_findings(document, "statement.pdf")
+    assert len(report["revisions"]) == 2
+    assert sum("Incremental update" in flag for flag in report["red_flags"]) == 1
+    assert len(built) == 1
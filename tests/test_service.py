@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+import os
+import socket
+import sys
+import threading
+import time
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import requests
+import uvicorn
+from src.service import AnalysisService, create_app
+from src.service_client import AnalysisClient, ServiceBusy
+
+def create_upload(i):
+    img = np.full((300, 400, 3), 235, dtype=np.uint8)
+    cv2.putText(img, f"RECEIPT {i}", (40, 160), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 3)
+    return cv2.imencode(".jpg", img)[1].tobytes()
+
+def test_service_queue_backpressure_and_streaming(tmp_path):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    service = AnalysisService(workers=1, queue_size=1, cache_dir=str(tmp_path / "cache"))
+    server = uvicorn.Server(uvicorn.Config(create_app(service), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    try:
+        client = AnalysisClient(f"http://127.0.0.1:{port}")
+        # One job runs, one waits (the pool is still spawning), the rest are refused
+        accepted, refused = [], 0
+        for i in range(4):
+            try:
+                accepted.append(client.submit(create_upload(i), f"receipt_{i}.jpg"))
+            except ServiceBusy:
+                refused += 1
+        assert refused >= 1 and accepted
+
+        job_id = accepted[0]["job_id"]
+        events = [event for event, _ in client.events(job_id)]
+        assert events.index("page") < events.index("report")
+        assert client.status(job_id)["report"]["pages"][0]["page_number"] == 1
+        assert client.page_image(job_id, 1, "ela_image").startswith(b"\x89PNG")
+        pyramid = client.page_pyramid(job_id, 1, "image")
+        assert pyramid["levels"][0]["width"] == pyramid["width"]
+        assert client.page_preview(job_id, 1, "image")
+        assert client.page_tile(job_id, 1, "image", 0, 0, 0).startswith(b"\xff\xd8")
+
+        assert not client.status(job_id)["cached"]
+
+        # A repeat upload is answered from the result cache without queueing,
+        # and says so, so the app doesn't record it in the history again
+        repeat = client.submit(create_upload(0), "receipt_0.jpg")
+        assert repeat["status"] == "done" and repeat["report"]["filename"] == "receipt_0.jpg"
+        assert repeat["cached"]
+        _, report, cached = client.analyze(create_upload(0), "receipt_0.jpg")
+        assert cached and report["filename"] == "receipt_0.jpg"
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+
+def test_oversized_uploads_are_refused_while_streaming(tmp_path):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    service = AnalysisService(workers=1, queue_size=4, cache_dir=str(tmp_path / "cache"), max_upload_bytes=20000)
+    server = uvicorn.Server(uvicorn.Config(create_app(service), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    try:
+        url = f"http://127.0.0.1:{port}/jobs"
+        large = b"\xff\xd8" + bytes(300000)
+
+        # A declared Content-Length over the limit is refused before the body is read
+        response = requests.post(url, params={"filename": "scan.jpg"}, data=large)
+        assert response.status_code == 413
+
+        # Chunked bodies carry no length; reading stops once the limit is passed
+        chunks = (large[i:i + 8192] for i in range(0, len(large), 8192))
+        response = requests.post(url, params={"filename": "scan.jpg"}, data=chunks)
+        assert response.status_code == 413
+        response = requests.post(url, files={"file": ("scan.jpg", large[:30000])})
+        assert response.status_code == 413
+
+        response = requests.post(url, files={"file": ("receipt.jpg", create_upload(0))})
+        assert response.status_code == 202
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
+
+def test_service_replaces_a_crashed_worker_pool(tmp_path):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    service = AnalysisService(workers=1, queue_size=4, cache_dir=str(tmp_path / "cache"))
+    server = uvicorn.Server(uvicorn.Config(create_app(service), host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    try:
+        client = AnalysisClient(f"http://127.0.0.1:{port}")
+        client.analyze(create_upload(0), "receipt_0.jpg")
+        assert requests.get(f"http://127.0.0.1:{port}/health").json()["status"] == "ok"
+
+        # Kill the worker as an out-of-memory kill or a native crash would
+        for process in list(service._pool._processes.values()):
+            process.kill()
+
+        # The job caught by the crash may fail, but the service recovers
+        try:
+            client.analyze(create_upload(1), "receipt_1.jpg")
+        except RuntimeError as e:
+            assert "Worker process died" in str(e)
+        _, report, cached = client.analyze(create_upload(2), "receipt_2.jpg")
+        assert report["pages"] and not cached
+
+        health = requests.get(f"http://127.0.0.1:{port}/health").json()
+        assert health["status"] == "degraded" and health["worker_crashes"] == 1
+    finally:
+        server.should_exit = True
+        thread.join(timeout=30)
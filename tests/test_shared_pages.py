@@ -0,0 +1,101 @@
+import numpy as np
+import io
+import json
+import os
+import sys
+import pytest
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.batch import run_batch
+from src.converter import PageImage
+from src.pipeline import iter_page_reports
+from src.shared_pages import SharedMemoryTransport, SharedPageRing
+from test_converter import create_scanned_pdf
+
+def make_pages(count, height=300, width=200):
+    """Page source run in the conversion process."""
+    for number in range(1, count + 1):
+        yield PageImage(number, np.full((height, width, 3), number, dtype=np.uint8))
+
+def failing_pages():
+    yield PageImage(1, np.zeros((10, 10, 3), dtype=np.uint8))
+    raise ValueError("page 2 is corrupt")
+
+def test_ring_reuses_buffers_after_last_release():
+    ring = SharedPageRing(slots=2, slot_bytes=1024)
+    try:
+        first = ring.put(np.arange(100, dtype=np.int32))
+        second = ring.put(np.ones((4, 4), dtype=np.uint8))
+        assert ring.in_use() == 2
+        assert ring.acquire((8,), np.uint8, timeout=0.2) is None
+
+        # The view shares memory with the buffer and sees later writes
+        view = ring.view(first)
+        assert view.tolist() == list(range(100)) and not view.flags.owndata
+        ring.retain(first)
+        ring.release(first)
+        assert ring.acquire((8,), np.uint8, timeout=0.2) is None
+        ring.release(first)
+        third, _ = ring.acquire((8,), np.uint8, timeout=0.2)
+        assert third.name == first.name
+
+        ring.release(second)
+        with pytest.raises(ValueError):
+            ring.release(second)
+        with pytest.raises(ValueError):
+            ring.put(np.zeros(2048, dtype=np.uint8))
+    finally:
+        ring.close()
+
+def test_transport_hands_pages_over_in_shared_memory():
+    transport = SharedMemoryTransport(slots=2, slot_bytes=300 * 200 * 3)
+    try:
+        received = []
+        for page in transport.iter_pages(make_pages, 5):
+            # Zero-copy on this side: the image is a view of a ring buffer
+            assert not page.image.flags.owndata
+            assert transport.ring.in_use() >= 1
+            received.append((page.page_number, int(page.image[0, 0, 0]), page.image.shape))
+        assert received == [(n, n, (300, 200, 3)) for n in range(1, 6)]
+        assert transport.stats == {"shared": 5, "inline": 0}
+        assert transport.ring.in_use() == 0
+
+        # Stopping early and oversized pages (sent inline) leave no buffer held
+        pages = transport.iter_pages(make_pages, 10, 400, 200)
+        assert next(pages).image.shape == (400, 200, 3)
+        pages.close()
+        assert transport.stats["inline"] == 1
+        pages = transport.iter_pages(make_pages, 10)
+        next(pages)
+        pages.close()
+        assert transport.ring.in_use() == 0
+
+        with pytest.raises(ValueError, match="page 2 is corrupt"):
+            for _ in transport.iter_pages(failing_pages):
+                pass
+        assert transport.ring.in_use() == 0
+    finally:
+        transport.close()
+
+def test_shared_transport_matches_in_process_reports(tmp_path):
+    pdf_bytes = create_scanned_pdf()
+    expected = list(iter_page_reports(pdf_bytes, "scan.pdf", keep_images=True))
+    transport = SharedMemoryTransport(slots=2)
+    try:
+        shared = list(iter_page_reports(pdf_bytes, "scan.pdf", keep_images=True, transport=transport))
+    finally:
+        transport.close()
+    assert transport.stats["shared"] == 3
+    for a, b in zip(expected, shared):
+        assert a["ela"] == b["ela"] and a["regions"] == b["regions"]
+        # Kept images outlive the shared buffers
+        assert np.array_equal(a["image"], b["image"]) and b["image"].flags.owndata
+
+    (tmp_path / "scan.pdf").write_bytes(pdf_bytes)
+    output = tmp_path / "results.jsonl"
+    summary = run_batch([str(tmp_path / "scan.pdf")], str(output), workers=1, log=io.StringIO(), shared_pages=True)
+    assert summary["errors"] == 0
+    record = json.loads(output.read_text())
+    assert [page["ela"]["score"] for page in record["pages"]] == [page["ela"]["score"] for page in expected]
@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+import os
+import sys
+
+# Add src to path if needed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.template_index import TemplateIndex, page_key
+
+def create_payslip(seed, net_pay="1,250.00"):
+    rng = np.random.default_rng(seed)
+    page = np.full((1600, 1200, 3), 245, dtype=np.uint8)
+    cv2.rectangle(page, (60, 60), (1140, 220), (90, 60, 20), -1)
+    cv2.putText(page, f"ACME CORP {seed}", (100, 170), cv2.FONT_HERSHEY_SIMPLEX, 2.5, (255, 255, 255), 5)
+    for i in range(12):
+        width = int(rng.integers(300, 900))
+        cv2.rectangle(page, (100, 300 + i * 80), (100 + width, 330 + i * 80), (60, 60, 60), -1)
+    cv2.putText(page, net_pay, (750, 1480), cv2.FONT_HERSHEY_SIMPLEX, 3, (0, 0, 0), 8)
+    return page
+
+def test_near_duplicate_template_is_found(tmp_path):
+    path = str(tmp_path / "templates.sqlite")
+    index = TemplateIndex(path)
+    original = create_payslip(1)
+    assert index.add(original, "original:1", "payslip_march.pdf")
+    assert not index.add(original, "original:1", "payslip_march.pdf")
+    index.add_many([(create_payslip(seed), f"other{seed}:1", f"other{seed}.pdf") for seed in range(2, 8)])
+    index.close()
+
+    # Reopened from disk, a rescaled copy with an edited amount still matches
+    index = TemplateIndex(path)
+    assert len(index) == 7
+    edited = cv2.resize(create_payslip(1, net_pay="9,870.00"), (1020, 1360), interpolation=cv2.INTER_AREA)
+    matches = index.query(edited)
+    assert matches[0]["label"] == "payslip_march.pdf"
+    assert all(match["distance"] > matches[0]["distance"] for match in matches[1:])
+
+    # Only the bottom-right quarter, where the amount was changed, differs
+    regions = matches[0]["differing_regions"]
+    assert regions
+    assert all(region["x"] >= 510 and region["y"] >= 1020 for region in regions)
+
+    assert index.query(original, exclude_key="original:1", max_distance=4) == []
+
+def test_pages_of_the_same_document_and_blank_pages_are_skipped():
+    index = TemplateIndex(":memory:")
+    document_hash = "ab" * 32
+    first = create_payslip(1)
+    index.add(first, page_key(document_hash, 1), "statement.pdf")
+    index.add(create_payslip(2), "other:1", "other.pdf")
+
+    # Page 2 of the same document is not a template match for itself
+    second = create_payslip(1, net_pay="1,250.01")
+    assert [m["doc_key"] for m in index.query(second)][0] == page_key(document_hash, 1)
+    assert all(m["label"] != "statement.pdf" for m in index.query(second, exclude_document=document_hash))
+
+    # Blank pages carry no template and would all match each other
+    rng = np.random.default_rng(0)
+    blank = np.clip(np.full((1600, 1200, 3), 240.0) + rng.normal(0, 4, (1600, 1200, 3)), 0, 255).astype(np.uint8)
+    assert not index.add(blank, "blank:1", "blank.pdf")
+    assert index.query(blank) == []
+    assert len(index) == 2
+
+    # Wide searches probe thousands of chunk values without overflowing SQLite's parameter limit
+    for max_distance in (16, 24, 64):
+        matches = index.query(first, max_distance=max_distance, limit=10)
+        assert matches[0]["doc_key"] == page_key(document_hash, 1)
+    assert len(index.query(first, max_distance=64, limit=10)) == 2